@@ -0,0 +1,57 @@
+"""
+Benchmarks for the MrParse hot paths
+
+These use pytest-benchmark and are kept separate from the unit tests so that they are only
+run on request. The inputs are generated by synthetic.py so no CCP4 services or databases are
+needed, although the benchmarks of code that imports mrbump or simbad are skipped if they
+aren't installed.
+
+Record a baseline on the current code with:
+
+    ccp4-python -m pytest benchmarks --benchmark-autosave
+
+and compare a later run against it, failing if any benchmark has slowed down by more than 20%:
+
+    ccp4-python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:20%
+
+The size of the inputs is set with --bench-scale (small, medium or large). The large scale includes
+phmmer logs with 100000 domains, which take several minutes to parse.
+"""
+import os
+import sys
+
+import pytest
+
+MRPARSE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..')
+sys.path.insert(0, MRPARSE_DIR)
+
+# The sizes of the synthetic inputs at each scale
+SCALES = {
+    'small': {'ndomains': [1000], 'nhits': [1000], 'nsequences': [100], 'annotation_length': [10000]},
+    'medium': {'ndomains': [1000, 10000], 'nhits': [1000, 10000], 'nsequences': [100, 1000],
+               'annotation_length': [10000, 1000000]},
+    'large': {'ndomains': [1000, 10000, 100000], 'nhits': [1000, 10000, 100000], 'nsequences': [100, 1000, 10000],
+              'annotation_length': [10000, 1000000, 10000000]},
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench-scale', choices=sorted(SCALES), default='medium',
+                     help='The size of the synthetic benchmark inputs [medium]')
+
+
+def pytest_generate_tests(metafunc):
+    sizes = SCALES[metafunc.config.getoption('bench_scale')]
+    for name, values in sizes.items():
+        if name in metafunc.fixturenames:
+            metafunc.parametrize(name, values, ids=[f"{name}={v}" for v in values], scope='module')
+
+
+@pytest.fixture(scope='module')
+def work_dir(tmp_path_factory):
+    """A directory for the files written by the benchmarked code"""
+    cwd = os.getcwd()
+    path = tmp_path_factory.mktemp('bench')
+    os.chdir(path)
+    yield path
+    os.chdir(cwd)
@@ -0,0 +1,181 @@
+"""
+Generators of synthetic MrParse inputs for the benchmarks
+
+All the generators are seeded so that the same inputs are created on every run and benchmark results can be
+compared with a saved baseline.
+"""
+import random
+
+import numpy as np
+
+from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation
+from mrparse.mr_hit import SequenceHit
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+PDB = 'PDB'
+AFDB = 'AFCCP4'
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choices(AMINO_ACIDS, k=length))
+
+
+def mutate(rng, sequence, identity=0.4, gap_fraction=0.05):
+    """Return a copy of sequence with (1 - identity) of the residues substituted and gap_fraction of them gaps"""
+    residues = []
+    for aa in sequence:
+        r = rng.random()
+        if r < gap_fraction:
+            residues.append('-')
+        elif r < identity + gap_fraction:
+            residues.append(aa)
+        else:
+            residues.append(rng.choice(AMINO_ACIDS))
+    return ''.join(residues)
+
+
+def hit_names(nhits, db=PDB):
+    """Return nhits unique database entry names in the style of the phmmer sequence database"""
+    if db == AFDB:
+        return [f"AF-P{i:05d}-F1-model_v4" for i in range(nhits)]
+    # PDB codes are a digit and three alphanumeric characters, which gives unique names for up to 419904 hits
+    return [f"{i % 9 + 1}{np.base_repr(i // 9, 36).lower():0>3}_A" for i in range(nhits)]
+
+
+def phmmer_log(target, ndomains, domains_per_hit=1, db=PDB, seed=0, min_length=30, max_length=300):
+    """Return the text of a phmmer log with ndomains aligned domains against target
+
+    Parameters
+    ----------
+    target : str
+       The query sequence
+    ndomains : int
+       The total number of domains in the log
+    domains_per_hit : int
+       The number of domains of each hit
+    db : str
+       The type of sequence database (PDB or AFCCP4) that determines the format of the hit names
+    seed : int
+       The seed of the random number generator
+    min_length, max_length : int
+       The range of the lengths of the aligned domains
+    """
+    rng = random.Random(seed)
+    nhits = max(1, ndomains // domains_per_hit)
+    names = hit_names(nhits, db)
+    if db == AFDB:
+        descriptions = [f"AFDB release_date: 2022-06-01 [ {i} : ALL ]" for i in range(nhits)]
+    else:
+        descriptions = [f"resolution: 1.50 experiment: XRAY release_date: 2008-05-27 [ {i} : ALL ] ['1-{max_length}'] "
+                        f"<RLEVEL>95<RLEVEL>" for i in range(nhits)]
+    query = 'QUERY|SEQUENCE'
+    width = max(len(query), max(len(n) for n in names))
+
+    lines = ["# phmmer :: search a protein sequence against a protein database",
+             "# HMMER 3.3.2 (Nov 2020); http://hmmer.org/",
+             "# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -",
+             "",
+             f"Query:       {query}  [L={len(target)}]",
+             "Scores for complete sequences (score includes all domains):",
+             "   --- full sequence ---   --- best 1 domain ---    -#dom-",
+             "    E-value  score  bias    E-value  score  bias    exp  N  Sequence Description",
+             "    ------- ------ -----    ------- ------ -----   ---- --  -------- -----------"]
+    scores = sorted((rng.uniform(20.0, 400.0) for _ in range(nhits)), reverse=True)
+    for name, description, score in zip(names, descriptions, scores):
+        evalue = 10 ** (-score / 4.0)
+        lines.append(f"    {evalue:7.2g} {score:6.1f}  10.0    {evalue:7.2g} {score:6.1f}  10.0    1.0 "
+                     f"{domains_per_hit:2d}  {name}    {description}")
+    lines += ["", "", "Domain annotation for each sequence (and alignments):"]
+
+    for name, description, score in zip(names, descriptions, scores):
+        domains = []
+        for _ in range(domains_per_hit):
+            length = rng.randint(min_length, min(max_length, len(target)))
+            start = rng.randint(1, len(target) - length + 1)
+            domains.append((start, start + length - 1, rng.uniform(20.0, score)))
+        lines += [f">> {name}  {description}",
+                  "   #    score  bias  c-Evalue  i-Evalue hmmfrom  hmm to    alifrom  ali to    envfrom  env to     acc",
+                  " ---   ------ ----- --------- --------- ------- -------    ------- -------    ------- -------    ----"]
+        for i, (start, stop, dscore) in enumerate(domains, 1):
+            lines.append(f"  {i:2d} !  {dscore:5.1f}  10.0     1e-10     1e-10 {start:7d} {stop:7d} .. "
+                         f"{1:7d} {stop - start + 1:7d} .. {1:7d} {stop - start + 1:7d} .. 0.90")
+        lines += ["", "  Alignments for each domain:"]
+        for i, (start, stop, dscore) in enumerate(domains, 1):
+            target_alignment = target[start - 1:stop].lower()
+            alignment = mutate(rng, target_alignment.upper())
+            hit_stop = len(alignment) - alignment.count('-')
+            lines += [f"  == domain {i}  score: {dscore:.1f} bits;  conditional E-value: 1e-10",
+                      f"  {query:>{width}} {start:4d} {target_alignment} {stop}",
+                      f"  {'':>{width}}      {''.join(a.lower() if a == t.upper() else ' ' for a, t in zip(alignment, target_alignment))}",
+                      f"  {name:>{width}} {1:4d} {alignment} {hit_stop}",
+                      f"  {'':>{width}}      {'*' * len(alignment)} PP",
+                      ""]
+    lines += ["", "Internal pipeline statistics summary:", "-------------------------------------",
+              f"Query model(s):                            1  ({len(target)} nodes)", "//", "[ok]", ""]
+    return '\n'.join(lines)
+
+
+def sequence_hits(target_length, nhits, seed=0, min_length=30):
+    """Return an OrderedDict-like dict of nhits SequenceHits covering random ranges of the target"""
+    rng = random.Random(seed)
+    hits = {}
+    for i in range(nhits):
+        hit = SequenceHit()
+        hit.name = f"hit_{i}"
+        hit.rank = i + 1
+        length = rng.randint(min_length, target_length)
+        hit.query_start = rng.randint(1, target_length - length + 1)
+        hit.query_stop = hit.query_start + length - 1
+        hit.hit_start, hit.hit_stop = 1, length
+        hit.score = rng.uniform(20.0, 400.0)
+        hit.local_sequence_identity = rng.uniform(20.0, 100.0)
+        hits[hit.name] = hit
+    return hits
+
+
+def afdb_model(nresidues=3000, seed=0):
+    """Return the text of an AlphaFold database model with nresidues residues and random pLDDT values
+
+    The pLDDT values vary smoothly along the chain so that there are contiguous regions of each confidence level.
+    """
+    rng = np.random.default_rng(seed)
+    plddt = np.clip(70.0 + np.cumsum(rng.normal(0.0, 3.0, nresidues)), 20.0, 99.0)
+    lines = ["HEADER    STRUCTURE PREDICTION                    01-JUL-21",
+             "CRYST1    1.000    1.000    1.000  90.00  90.00  90.00 P 1           1"]
+    serial = 1
+    for i, b in enumerate(plddt):
+        for name, element, offset in (('N', 'N', 0.0), ('CA', 'C', 1.5), ('C', 'C', 2.5), ('O', 'O', 3.0)):
+            x, y, z = 3.8 * i + offset, 10.0 * np.sin(i / 10.0), 10.0 * np.cos(i / 10.0)
+            lines.append(f"ATOM  {serial:5d}  {name:<3s} ALA A{i + 1:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00{b:6.2f}"
+                         f"           {element}")
+            serial += 1
+    lines += ["TER", "END", ""]
+    return '\n'.join(lines)
+
+
+def multi_fasta(nsequences, length=300, nduplicates=0, seed=0):
+    """Return the text of a FASTA file of nsequences sequences, nduplicates of which repeat an earlier sequence"""
+    rng = random.Random(seed)
+    sequences = [random_sequence(rng, length) for _ in range(nsequences - nduplicates)]
+    sequences += [rng.choice(sequences) for _ in range(nduplicates)]
+    records = []
+    for i, sequence in enumerate(sequences):
+        records.append(f">SEQ{i}|chain {i}")
+        records += [sequence[j:j + 80] for j in range(0, len(sequence), 80)]
+    return '\n'.join(records) + '\n'
+
+
+def sequence_annotation(length, symbols, source, seed=0):
+    """Return a SequenceAnnotation of length residues with random runs of the annotation symbols"""
+    rng = np.random.default_rng(seed)
+    annotation = SequenceAnnotation()
+    annotation.source = source
+    for symbol, name in symbols.items():
+        annotation.library_add_annotation(AnnotationSymbol(name=name, symbol=symbol, stype=name))
+    choices = np.frombuffer((annotation.null_symbol + ''.join(symbols)).encode('ascii'), dtype=np.uint8)
+    run_starts = np.sort(rng.choice(length, size=max(1, length // 20), replace=False))
+    run_starts[0] = 0
+    run_lengths = np.diff(np.append(run_starts, length))
+    annotation.codes = np.repeat(rng.choice(choices, size=len(run_starts)), run_lengths)
+    annotation.scores = rng.random(length)
+    return annotation
@@ -0,0 +1,44 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark combining and serialising the annotations of very long sequences"""
+import pytest
+
+from mrparse.mr_annotation import SequenceAnnotation, get_annotation_chunks
+from mrparse.mr_classify import MrClassifier
+
+from synthetic import sequence_annotation
+
+
+@pytest.fixture(scope="module")
+def annotations(annotation_length):
+    return [sequence_annotation(annotation_length, {'C': 'CC'}, 'Deepcoil', seed=0),
+            sequence_annotation(annotation_length, {'M': 'TM', 'B': 'TM'}, 'DeepTMHMM', seed=1),
+            sequence_annotation(annotation_length, {'H': 'helix', 'E': 'strand'}, 'JPred', seed=2)]
+
+
+def test_consensus(annotations):
+    cc, tm, _ = annotations
+    consensus = cc + tm
+    assert len(consensus) == len(cc)
+    assert set(consensus.annotation) <= {'-', 'C', 'M', 'B'}
+
+
+def test_bench_add(benchmark, annotations):
+    cc, tm, _ = annotations
+    benchmark(lambda: cc + tm)
+
+
+def test_bench_consensus_classification(benchmark, annotations):
+    benchmark(MrClassifier.generate_consensus_classification, annotations)
+
+
+def test_bench_annotation_chunks(benchmark, annotations):
+    benchmark(get_annotation_chunks, annotations[1])
+
+
+def test_bench_dict_round_trip(benchmark, annotations):
+    benchmark(lambda: SequenceAnnotation.from_dict(annotations[1].to_dict()))
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,61 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark the parsing of phmmer logs with many aligned domains"""
+import random
+import pytest
+
+pytest.importorskip('mrbump')
+from mrparse.mr_hit import _find_hits
+from mrparse.searchDB import phmmer
+
+from synthetic import AFDB, phmmer_log, random_sequence
+
+TARGET_LENGTH = 1000
+DOMAINS_PER_HIT = 2
+
+
+@pytest.fixture(scope="module")
+def target():
+    return random_sequence(random.Random(0), TARGET_LENGTH)
+
+
+@pytest.fixture(scope="module")
+def logfile(work_dir, target, ndomains):
+    fpath = work_dir.joinpath(f'phmmer_{ndomains}.log')
+    fpath.write_text(phmmer_log(target, ndomains, domains_per_hit=DOMAINS_PER_HIT, db=AFDB))
+    return str(fpath)
+
+
+def get_phmmer_alignments(logfile, target):
+    phr = phmmer()
+    phr.logfile = logfile
+    with open(logfile) as fh:
+        lines = fh.readlines()
+    phr.getPhmmerAlignments(targetSequence=target, phmmerALNLog=lines, PDBLOCAL=None, DB=AFDB, seqMetaDB=None)
+    return phr
+
+
+def find_hits(logfile, target):
+    return _find_hits(logfile=logfile, searchio_type='hmmer3-text', target_sequence=target, af2=True,
+                      max_hits=10 ** 9, dbtype=AFDB)
+
+
+def test_all_domains_parsed(logfile, target, ndomains):
+    phr = get_phmmer_alignments(logfile, target)
+    assert len(phr.resultsList) == ndomains
+    hit = phr.resultsDict[phr.resultsList[0]]
+    assert len(hit.alignment) == len(hit.targetAlignment)
+    assert 0 < hit.localSEQID <= 100
+
+
+def test_bench_get_phmmer_alignments(benchmark, logfile, target):
+    benchmark(get_phmmer_alignments, logfile, target)
+
+
+def test_bench_find_hits(benchmark, logfile, target, ndomains):
+    hits = benchmark(find_hits, logfile, target)
+    assert len(hits) == ndomains // DOMAINS_PER_HIT
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
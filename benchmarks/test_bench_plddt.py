@@ -0,0 +1,58 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark the pLDDT metrics of a large AlphaFold model"""
+import gemmi
+import pytest
+
+pytest.importorskip('simbad')
+from mrparse import mr_alphafold
+
+from synthetic import afdb_model
+
+NRESIDUES = 3000
+
+
+@pytest.fixture(scope="module")
+def pdb_string():
+    return afdb_model(NRESIDUES)
+
+
+@pytest.fixture(scope="module")
+def structure(pdb_string):
+    return gemmi.read_pdb_string(pdb_string)
+
+
+def test_model(structure):
+    assert len(mr_alphafold.get_plddt(structure)) == NRESIDUES
+    regions = mr_alphafold.get_plddt_regions(structure, range(1, NRESIDUES + 1))
+    assert sum(end - start + 1 for r in regions.values() for start, end in r) == NRESIDUES
+
+
+def test_bench_read_model(benchmark, pdb_string):
+    benchmark(gemmi.read_pdb_string, pdb_string)
+
+
+def test_bench_plddt_regions(benchmark, structure):
+    benchmark(mr_alphafold.get_plddt_regions, structure, range(1, NRESIDUES + 1))
+
+
+def test_bench_avg_plddt(benchmark, structure):
+    benchmark(mr_alphafold.calculate_avg_plddt, structure)
+
+
+def test_bench_h_score(benchmark, structure):
+    benchmark(mr_alphafold.calculate_quality_h_score, structure)
+
+
+def test_bench_convert_plddt_to_bfactor(benchmark, structure):
+    # The structure is modified in place so each round works on a fresh copy
+    benchmark.pedantic(mr_alphafold.convert_plddt_to_bfactor, setup=lambda: ((structure.clone(),), {}), rounds=20)
+
+
+def test_bench_remove_low_plddt(benchmark, structure):
+    benchmark.pedantic(mr_alphafold.remove_residues_below_plddt_threshold,
+                       setup=lambda: ((structure.clone(), 70), {}), rounds=20)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
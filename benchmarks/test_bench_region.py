@@ -0,0 +1,28 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark finding the regions of the target sequence covered by the hits"""
+import pytest
+
+from mrparse.mr_region import RegionFinder
+
+from synthetic import sequence_hits
+
+TARGET_LENGTH = 1000
+
+
+@pytest.fixture(scope="module")
+def hits(nhits):
+    return sequence_hits(TARGET_LENGTH, nhits)
+
+
+def test_all_hits_assigned(hits):
+    regions = RegionFinder().find_regions_from_hits(hits)
+    assert sum(len(r.matches) for r in regions) == len(hits)
+
+
+def test_bench_find_regions(benchmark, hits):
+    benchmark(RegionFinder().find_regions_from_hits, hits)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,61 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark the sequence identity calculation for the alignments of many hits"""
+import random
+import pytest
+
+from mrparse.mr_seqid import batch_identity
+
+NALIGNMENTS = 10000
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def python_identity(seq1, seq2, target_sequence):
+    """A per-residue Python loop used as a reference"""
+    naligned = nidentical = 0
+    for a, b in zip(seq1, seq2):
+        if a != '-' and b != '-':
+            naligned += 1
+            nidentical += a == b
+    local = 100.0 * nidentical / naligned if naligned else 0.0
+    overall = 100.0 * nidentical / len(target_sequence) if target_sequence else 0.0
+    return local, overall
+
+
+@pytest.fixture(scope="module")
+def alignments():
+    rng = random.Random(0)
+    target = ''.join(rng.choice(AMINO_ACIDS) for _ in range(500))
+    alignments, target_alignments = [], []
+    for _ in range(NALIGNMENTS):
+        start = rng.randrange(0, 300)
+        tali = target[start:start + rng.randrange(50, 200)]
+        alignments.append(''.join(c if rng.random() < 0.4 else rng.choice(AMINO_ACIDS + '-') for c in tali))
+        target_alignments.append(tali)
+    return alignments, target_alignments, target
+
+
+def test_batch_identity_matches_python(alignments):
+    alis, talis, target = alignments
+    local, overall = batch_identity(alis, talis, target)
+    for i in range(100):
+        assert (local[i], overall[i]) == pytest.approx(python_identity(alis[i], talis[i], target))
+
+
+def test_bench_batch_identity(benchmark, alignments):
+    benchmark(batch_identity, *alignments)
+
+
+def test_bench_python_identity(benchmark, alignments):
+    alis, talis, target = alignments
+    benchmark(lambda: [python_identity(a, t, target) for a, t in zip(alis, talis)])
+
+
+def test_bench_simpleseqid(benchmark, alignments):
+    simpleSeqID = pytest.importorskip('mrbump.seq_align.simpleSeqID').simpleSeqID
+    alis, talis, target = alignments
+    benchmark(lambda: [simpleSeqID().getPercent(a, t, target) for a, t in zip(alis, talis)])
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,31 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark reading and merging large multi-sequence FASTA files"""
+import pytest
+
+from mrparse.mr_sequence import MultipleSequenceException, Sequence, merge_multiple_sequences
+
+from synthetic import multi_fasta
+
+
+@pytest.fixture(scope="module")
+def fasta(work_dir, nsequences):
+    fpath = work_dir.joinpath(f'seqs_{nsequences}.fasta')
+    # A tenth of the sequences are copies of others, as for the chains of a homo-oligomer
+    fpath.write_text(multi_fasta(nsequences, nduplicates=nsequences // 10))
+    return str(fpath)
+
+
+def test_merge(fasta, nsequences):
+    with pytest.raises(MultipleSequenceException):
+        Sequence(fasta)
+    merged = merge_multiple_sequences(fasta)
+    assert merged.nresidues == 300 * (nsequences - nsequences // 10)
+
+
+def test_bench_merge_multiple_sequences(benchmark, fasta):
+    benchmark(merge_multiple_sequences, fasta)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
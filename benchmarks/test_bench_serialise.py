@@ -0,0 +1,78 @@
+#!/usr/bin/env ccp4-python
+"""Benchmark the JSON serialisation of HomologData/ModelData objects"""
+import json
+import pytest
+
+pytest.importorskip('simbad')
+from mrparse.mr_alphafold import ModelData
+from mrparse.mr_hit import SequenceHit
+from mrparse.mr_homolog import HomologData
+from mrparse.mr_util import json_dumps
+
+NOBJECTS = 10000
+
+
+def reflective_static_dict(obj):
+    """The original dir() based implementation of static_dict used as a reference"""
+    d = {k: v for k, v in obj.__dict__.items() if k not in obj.OBJECT_ATTRIBUTES}
+    for name in dir(obj.__class__):
+        prop = getattr(obj.__class__, name)
+        if name != 'static_dict' and isinstance(prop, property):
+            d[name] = prop.__get__(obj, obj.__class__)
+    d['range'] = "{}-{}".format(*obj.range)
+    return d
+
+
+def make_hit(i):
+    hit = SequenceHit()
+    hit.name = f"{i:04d}_A_1"
+    hit.pdb_id = f"{i:04d}"
+    hit.chain_id = 'A'
+    hit.score = 100.0 + i
+    hit.query_start = i % 50
+    hit.query_stop = hit.query_start + 120
+    hit.local_sequence_identity = 42.0
+    return hit
+
+
+def make_objects(cls, n=NOBJECTS):
+    objects = []
+    for i in range(n):
+        obj = cls()
+        obj.hit = make_hit(i)
+        obj.molecular_weight = 12000 + i
+        objects.append(obj)
+    return objects
+
+
+@pytest.fixture(scope="module", params=[HomologData, ModelData], ids=['homologs', 'models'])
+def objects(request):
+    return make_objects(request.param)
+
+
+def test_static_dict_matches_reflection(objects):
+    for obj in objects[:100]:
+        assert obj.static_dict == reflective_static_dict(obj)
+
+
+def test_bench_static_dict(benchmark, objects):
+    benchmark(lambda: [o.static_dict for o in objects])
+
+
+def test_bench_reflective_static_dict(benchmark, objects):
+    benchmark(lambda: [reflective_static_dict(o) for o in objects])
+
+
+def test_bench_json_dumps(benchmark, objects):
+    dicts = [o.static_dict for o in objects]
+    benchmark(json_dumps, dicts)
+
+
+def test_bench_stdlib_json_dumps(benchmark, objects):
+    dicts = [o.static_dict for o in objects]
+    benchmark(json.dumps, dicts)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
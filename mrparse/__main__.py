@@ -25,6 +25,8 @@ def main():
                               search_engine=args.search_engine,
                               deeptmhmm_exe=args.deeptmhmm_exe,
                               deepcoil_exe=args.deepcoil_exe,
+                              deepcoil_in_process=args.deepcoil_in_process,
+                              deeptmhmm_pybiolib=args.deeptmhmm_pybiolib,
                               hhsearch_exe=args.hhsearch_exe,
                               hhsearch_db=args.hhsearch_db,
                               afdb_seqdb=args.afdb_seqdb,
@@ -33,7 +35,11 @@ def main():
                               use_api=args.use_api,
                               max_hits=args.max_hits,
                               database=args.database,
-                              nproc=args.nproc)
+                              nproc=args.nproc,
+                              prefilter=args.prefilter,
+                              no_cache=args.no_cache,
+                              pathology_method=args.pathology_method,
+                              profile=args.profile)
     except KeyboardInterrupt:
         sys.stderr.write("Interrupted by keyboard!")
         return 0
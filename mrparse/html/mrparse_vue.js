@@ -41,9 +41,15 @@ Vue.filter("decimalPlaces", (value, num = 2) => {
 Vue.component('pfam-graphics', {
     data: function () {
         return {
-            homologs: this.$root.homologs,
-            ss_pred: this.$root.ss_pred,
-            classification: this.$root.classification
+            homologs: this.$root.homologs
+        }
+    },
+    computed: {
+        ss_pred: function () {
+            return this.$root.ss_pred;
+        },
+        classification: function () {
+            return this.$root.classification;
         }
     },
     /* When the homolog table has been sorted, the homologs are put on the EventBus so we set this components
@@ -59,8 +65,11 @@ Vue.component('pfam-graphics', {
     <pfam-region v-for="homolog in homologs" :key="homolog.name" :id="homolog.name" :region="homolog._pfam_json"/>
     <div v-if="ss_pred || classification" id    ='classification'>
 	    <h2 style="font-size:15px;color:#3b3b3dff;font-weight:normal;">Sequence Based Predictions</h2>
-	    <pfam-region :id="'ss_pred'" :region="ss_pred"/>
-	    <pfam-region :id="'classification'" :region="classification"/>
+	    <pfam-region v-if="ss_pred" :id="'ss_pred'" :region="ss_pred"/>
+	    <pfam-region v-if="classification" :id="'classification'" :region="classification"/>
+	</div>
+	<div v-else-if="$root.pending.classification" id='classification'>
+	    <h3>** Sequence Based Predictions are still running - they will be shown here when they have finished **</h3>
 	</div>
 	<div v-else id='classification'>
 	    <h3>** Sequence Based Prediction step was skipped: append <tt>--do_classify</tt> argument to run **</h3>
@@ -114,9 +123,9 @@ Vue.component('model-pfam-region', {
 
 
 Vue.component('hkl-info-table', {
-    data: function () {
-        return {
-            hklinfo: this.$root.hklinfo
+    computed: {
+        hklinfo: function () {
+            return this.$root.hklinfo;
         }
     },
     template: `<div v-if="hklinfo" id="hkl_info">
@@ -141,9 +150,9 @@ Vue.component('hkl-info-table', {
     </td>
     <td>{{ hklinfo.resolution | decimalPlaces }}</td>
     <td>{{ hklinfo.space_group }}</td>
-    <td>{{ hklinfo.has_ncs }}</td>
-    <td>{{ hklinfo.has_twinning }}</td>
-    <td>{{ hklinfo.has_anisotropy }}</td>
+    <td>{{ $root.pending.hkl_info ? 'Running...' : hklinfo.has_ncs }}</td>
+    <td>{{ $root.pending.hkl_info ? 'Running...' : hklinfo.has_twinning }}</td>
+    <td>{{ $root.pending.hkl_info ? 'Running...' : hklinfo.has_anisotropy }}</td>
   </tr>
 </tbody>
 </table>
@@ -152,6 +161,47 @@ Vue.component('hkl-info-table', {
 });
 
 
+Vue.component('timings-panel', {
+    computed: {
+        timings: function () {
+            return this.$root.timings;
+        }
+    },
+    methods: {
+        megabytes: function (nbytes) {
+            return nbytes ? (nbytes / 1048576).toFixed(1) : '-';
+        }
+    },
+    template: `<div v-if="timings && timings.length" id="timings">
+<details>
+<summary>Timings</summary>
+<table>
+<thead>
+  <tr style="text-align: right;">
+    <th title='The stage of MrParse'>Stage</th>
+    <th title='The number of times the stage was run'>Calls</th>
+    <th title='The total elapsed time of the stage in seconds'>Wall Time (s)</th>
+    <th title='The total CPU time used by MrParse in the stage in seconds (excluding external programs)'>CPU Time (s)</th>
+    <th title='The data downloaded during the stage'>Downloaded (MB)</th>
+    <th title='The peak memory use of the process, or of any program it ran, during the stage'>Peak Memory (MB)</th>
+  </tr>
+</thead>
+<tbody>
+  <tr v-for="stage in timings" :key="stage.name">
+    <td>{{ stage.name }}</td>
+    <td>{{ stage.count }}</td>
+    <td>{{ stage.wall_time | decimalPlaces }}</td>
+    <td>{{ stage.cpu_time | decimalPlaces }}</td>
+    <td>{{ megabytes(stage.bytes_downloaded) }}</td>
+    <td>{{ megabytes(stage.peak_rss) }}</td>
+  </tr>
+</tbody>
+</table>
+</details>
+</div>`
+});
+
+
 Vue.component('homolog-table', {
     data: function () {
         return {
@@ -227,11 +277,19 @@ Vue.component('homolog-table', {
             return
         },
     },
+    created: function () {
+        /* Keep the current sort order when the homologs are updated from the data files */
+        this.$watch(() => this.$root.homologs, homologs => {
+            this.homologs = _.orderBy(homologs, this.sortKey, this.order);
+            EventBus1.$emit("sortedData1", this.homologs);
+        });
+    },
     mounted: function () {
         this.sortBy('seq_ident')
     },
     template: `
   <div class="homolog-table">
+  <p v-if="$root.pending.homologs" class="pending">Searching for homologs - the results will be shown as they become available...</p>
   <table id="homologs">
       <thead>
         <tr>
@@ -335,11 +393,19 @@ Vue.component('model-table', {
             return
         },
     },
+    created: function () {
+        /* Keep the current sort order when the models are updated from the data files */
+        this.$watch(() => this.$root.models, models => {
+            this.models = _.orderBy(models, this.sortKey, this.order);
+            EventBus2.$emit("sortedData2", this.models);
+        });
+    },
     mounted: function () {
         this.sortBy('seq_ident')
     },
     template: `
   <div class="model-table">
+  <p v-if="$root.pending.models" class="pending">Searching for models - the results will be shown as they become available...</p>
   <table id="models">
       <thead>
         <tr>
@@ -371,13 +437,74 @@ Vue.component('model-table', {
     `
 })
 
-new Vue({
+/* The results are written to a data file per stage as each stage of MrParse completes. The stages that
+   haven't finished yet are pending and their data files are reloaded until the whole run is complete. */
+const mrparse_stages = Object.keys(mrparse_config.data_files).filter(stage => stage != 'status');
+
+const mrparse_app = new Vue({
     el: '#app',
     data: {
-        homologs: mrparse_data.pfam.homologs,
-        ss_pred: mrparse_data.pfam.ss_pred,
-        classification: mrparse_data.pfam.classification,
-        hklinfo: mrparse_data.hkl_info,
-        models: mrparse_data.pfam.models,
+        homologs: [],
+        ss_pred: null,
+        classification: null,
+        hklinfo: null,
+        models: [],
+        timings: null,
+        pending: Object.fromEntries(mrparse_stages.map(stage => [stage, true])),
+        complete: false,
     },
 })
+
+/* Called by the data files when they are loaded */
+function mrparse_update(stage, finished, data) {
+    switch (stage) {
+        case 'status':
+            mrparse_app.complete = data.complete;
+            return;
+        case 'homologs':
+            if (data) mrparse_app.homologs = data;
+            break;
+        case 'models':
+            if (data) mrparse_app.models = data;
+            break;
+        case 'hkl_info':
+            if (data) mrparse_app.hklinfo = data;
+            break;
+        case 'classification':
+            if (data) {
+                mrparse_app.ss_pred = data.ss_pred || null;
+                mrparse_app.classification = data.classification || null;
+            }
+            break;
+        case 'timings':
+            if (data) mrparse_app.timings = data;
+            break;
+    }
+    mrparse_app.pending[stage] = !finished;
+}
+
+/* Data files are loaded with script tags as fetching JSON doesn't work when the report is opened from disk */
+function load_data_file(data_file) {
+    let script = document.createElement('script');
+    script.type = 'text/javascript';
+    script.src = data_file + '?t=' + Date.now();
+    script.onload = script.onerror = () => script.remove();
+    document.head.appendChild(script);
+}
+
+function load_results() {
+    for (const [stage, data_file] of Object.entries(mrparse_config.data_files)) {
+        if (stage == 'status' || mrparse_app.pending[stage]) {
+            load_data_file(data_file);
+        }
+    }
+}
+
+load_results();
+const mrparse_poll = setInterval(function () {
+    if (mrparse_app.complete && !Object.values(mrparse_app.pending).some(pending => pending)) {
+        clearInterval(mrparse_poll);
+        return;
+    }
+    load_results();
+}, mrparse_config.poll_interval);
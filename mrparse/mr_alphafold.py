@@ -17,6 +17,9 @@ from pkg_resources import parse_version
 import requests
 from simbad.util.pdb_util import PdbStructure
 
+from mrparse.mr_timing import add_bytes_downloaded, timed
+from mrparse.mr_util import static_properties
+
 
 class PdbModelException(Exception):
     pass
@@ -29,6 +32,7 @@ MODELS_DIR = Path('models')
 logger = logging.getLogger(__name__)
 
 
+@static_properties
 class ModelData(object):
     OBJECT_ATTRIBUTES = ['hit', 'region']
 
@@ -92,24 +96,17 @@ class ModelData(object):
     @property
     def static_dict(self):
         """Return a self representation with all properties resolved, suitable for JSON"""
-        d = {k: self.__dict__[k] for k in self.__dict__.keys() if k not in self.OBJECT_ATTRIBUTES}
-        # Get all properties
-        for name in dir(self.__class__):
-            obj = getattr(self.__class__, name)
-            if name != 'static_dict' and isinstance(obj, property):
-                val = obj.__get__(self, self.__class__)
-                d[name] = val
+        d = {k: v for k, v in self.__dict__.items() if k not in self.OBJECT_ATTRIBUTES}
+        # STATIC_PROPERTIES is set once for the class by the static_properties decorator
+        for name, fget in self.STATIC_PROPERTIES:
+            d[name] = fget(self)
         # Need to add in properties as these aren't included
         # FIX ONCE UPDATED JS TO HANDLE TWO INTS
         d['range'] = "{}-{}".format(*self.range)
         return d
 
     def _get_child_attr(self, child, attr):
-        if hasattr(self, child):
-            child = getattr(self, child)
-            if hasattr(child, attr):
-                return getattr(child, attr)
-        return None
+        return getattr(getattr(self, child, None), attr, None)
 
     def __str__(self):
         attrs = [k for k in self.__dict__.keys() if not k.startswith('_')]
@@ -143,13 +140,16 @@ def models_from_hits(hits, plddt_cutoff):
     return models
 
 
+@timed('download', source='afdb')
 def download_model(pdb_name):
     """Download AlphaFold2 model"""
     url = 'https://alphafold.ebi.ac.uk/files/' + pdb_name
     query = requests.get(url)
+    add_bytes_downloaded(len(query.content))
     return query.text
 
 
+@timed('prepare_model')
 def prepare_pdb(hit, plddt_cutoff, database_version):
     """
     Download pdb or take file from cache
@@ -217,6 +217,7 @@ def calculate_quality_h_score(struct):
     return score
 
 
+@timed('metadata')
 def get_afdb_version():
     """Query the FTP site to find the latest version of the AFDB"""
     try:
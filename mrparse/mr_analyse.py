@@ -1,18 +1,21 @@
-import json
 import multiprocessing
 import os
 from pathlib import Path
+import shutil
 import subprocess
 import sys
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from mrparse.mr_log import setup_logging
-from mrparse.mr_util import make_workdir, now
+from mrparse.mr_util import json_dumps, make_workdir, now
 from mrparse.mr_hkl import HklInfo
 from mrparse.mr_search_model import SearchModelFinder
 from mrparse.mr_sequence import Sequence, MultipleSequenceException, merge_multiple_sequences
 from mrparse.mr_classify import MrClassifier
+from mrparse.mr_output import HOMOLOGS_JS, MODELS_JS, ResultsWriter
+from mrparse.mr_profile import PROFILE_DIR, merge_profiles, profiled, profiling
+from mrparse.mr_timing import enable_timings, gather_timings, span, timings_dir
 from mrparse.mr_version import __version__
 
 THIS_DIR = Path(__file__).parent.resolve()
@@ -21,8 +24,8 @@ HTML_TEMPLATE_ALL = HTML_DIR.joinpath('mrparse_all.html.jinja2')
 HTML_TEMPLATE_PDB = HTML_DIR.joinpath('mrparse_pdb.html.jinja2')
 HTML_TEMPLATE_AFDB = HTML_DIR.joinpath('mrparse_afdb.html.jinja2')
 HTML_OUT = 'mrparse.html'
-HOMOLOGS_JS = 'homologs.json'
-MODELS_JS = 'models.json'
+
+_TEMPLATE_ENVIRONMENTS = {}
 
 logger = None
 
@@ -39,6 +42,8 @@ def run(seqin, **kwargs):
     search_engine = kwargs.get('search_engine', 'phmmer')
     deeptmhmm_exe = kwargs.get('deeptmhmm_exe', None)
     deepcoil_exe = kwargs.get('deepcoil_exe', None)
+    deepcoil_in_process = kwargs.get('deepcoil_in_process', False)
+    deeptmhmm_pybiolib = kwargs.get('deeptmhmm_pybiolib', False)
     hhsearch_exe = kwargs.get('hhsearch_exe', None)
     hhsearch_db = kwargs.get('hhsearch_db', None)
     afdb_seqdb = kwargs.get('afdb_seqdb', None)
@@ -48,73 +53,118 @@ def run(seqin, **kwargs):
     max_hits = kwargs.get('max_hits', 10)
     database = kwargs.get('database', 'all')
     nproc = kwargs.get('nproc', 1)
+    prefilter = kwargs.get('prefilter', None)
+    no_cache = kwargs.get('no_cache', False)
+    pathology_method = kwargs.get('pathology_method', 'ctruncate')
+    profile = kwargs.get('profile', None)
 
     # Need to make a work directory first as all logs go into there
     work_dir = make_workdir()
     os.chdir(work_dir)
     global logger
     logger = setup_logging()
+    enable_timings(Path(work_dir).joinpath('timings'))
     program_name = Path(sys.argv[0]).parent
     logger.info(f"Running: {program_name}")
     logger.info(f"Version: {__version__}")
     logger.info(f"Program started at: {now()}")
     logger.info(f"Running from directory: {work_dir}")
 
-    if not (seqin and Path(seqin).exists()):
-        raise RuntimeError(f"Cannot find seqin file: {seqin}")
-    logger.info(f"Running with seqin {Path(seqin).resolve()}")
+    profile_dir = Path(work_dir).joinpath(PROFILE_DIR)
+    with profiling('mrparse', profile, profile_dir):
+        if not (seqin and Path(seqin).exists()):
+            raise RuntimeError(f"Cannot find seqin file: {seqin}")
+        logger.info(f"Running with seqin {Path(seqin).resolve()}")
 
-    try:
-        seq_info = Sequence(seqin)
-    except MultipleSequenceException:
-        logger.info(f"Multiple sequences found seqin: {seqin}\n\nAttempting to merge sequences")
-        seq_info = merge_multiple_sequences(seqin)
-        logger.info(f"Merged sequence file: {seq_info.sequence_file}")
+        try:
+            seq_info = Sequence(seqin)
+        except MultipleSequenceException:
+            logger.info(f"Multiple sequences found seqin: {seqin}\n\nAttempting to merge sequences")
+            seq_info = merge_multiple_sequences(seqin)
+            logger.info(f"Merged sequence file: {seq_info.sequence_file}")
 
-    hkl_info = None
-    if hklin:
-        if not os.path.isfile(hklin):
-            raise RuntimeError(f"Cannot find hklin file: {hklin}")
-        logger.info(f"Running with hklin {Path(hklin).resolve()}")
-        hkl_info = HklInfo(hklin, seq_info=seq_info)
-
-    if search_engine == "hhsearch":
-        if not hhsearch_exe:
-            raise RuntimeError("HHSearch executable needs to be defined with --hhsearch_exe")
-        elif not hhsearch_db:
-            raise RuntimeError("HHSearch database needs to be defined with --hhsearch_db")
-
-    search_model_finder = SearchModelFinder(seq_info, hkl_info=hkl_info, pdb_dir=pdb_dir, phmmer_dblvl=phmmer_dblvl,
-                                            plddt_cutoff=plddt_cutoff, search_engine=search_engine, hhsearch_exe=hhsearch_exe, 
-                                            hhsearch_db=hhsearch_db, afdb_seqdb=afdb_seqdb, pdb_seqdb=pdb_seqdb,
-                                            use_api=use_api, max_hits=max_hits, database=database, nproc=nproc, pdb_local=pdb_local)
-
-    classifier = None
-    if do_classify:
-        classifier = MrClassifier(seq_info=seq_info, deeptmhmm_exe=deeptmhmm_exe, deepcoil_exe=deepcoil_exe)
+        results_writer = ResultsWriter(stages=report_stages(database, hklin=hklin, do_classify=do_classify),
+                                       ccp4cloud=ccp4cloud)
 
-    if run_serial:
-        run_analyse_serial(search_model_finder, classifier, hkl_info, do_classify)
-    else:
-        search_model_finder, classifier, hkl_info = run_analyse_parallel(search_model_finder,
-                                                                         classifier,
-                                                                         hkl_info,
-                                                                         do_classify)
+        hkl_info = None
+        if hklin:
+            if not os.path.isfile(hklin):
+                raise RuntimeError(f"Cannot find hklin file: {hklin}")
+            logger.info(f"Running with hklin {Path(hklin).resolve()}")
+            hkl_info = HklInfo(hklin, seq_info=seq_info, results_writer=results_writer, use_cache=not no_cache,
+                               pathology_method=pathology_method)
 
-    html_out = write_output_files(search_model_finder, hkl_info=hkl_info, classifier=classifier, ccp4cloud=ccp4cloud, database=database)
-    logger.info(f"Wrote MrParse output file: {html_out}")
+        if search_engine == "hhsearch":
+            if not hhsearch_exe:
+                raise RuntimeError("HHSearch executable needs to be defined with --hhsearch_exe")
+            elif not hhsearch_db:
+                raise RuntimeError("HHSearch database needs to be defined with --hhsearch_db")
+
+        search_model_finder = SearchModelFinder(seq_info, hkl_info=hkl_info, pdb_dir=pdb_dir, phmmer_dblvl=phmmer_dblvl,
+                                                plddt_cutoff=plddt_cutoff, search_engine=search_engine, hhsearch_exe=hhsearch_exe, 
+                                                hhsearch_db=hhsearch_db, afdb_seqdb=afdb_seqdb, pdb_seqdb=pdb_seqdb,
+                                                use_api=use_api, max_hits=max_hits, database=database, nproc=nproc, prefilter=prefilter,
+                                                pdb_local=pdb_local, use_cache=not no_cache, results_writer=results_writer)
+
+        classifier = None
+        if do_classify:
+            classifier = MrClassifier(seq_info=seq_info, deeptmhmm_exe=deeptmhmm_exe, deepcoil_exe=deepcoil_exe,
+                                      nproc=nproc, use_cache=not no_cache, results_writer=results_writer,
+                                      deepcoil_in_process=deepcoil_in_process, deeptmhmm_pybiolib=deeptmhmm_pybiolib)
 
-    if not ccp4cloud:
-        opencmd = None
-        if sys.platform.lower().startswith('linux'):
-            opencmd = 'xdg-open'
-        elif sys.platform.lower().startswith('darwin'):
-            opencmd = 'open'
-        if opencmd:
-            subprocess.Popen([opencmd, html_out])
+        # Write the report straight away so that results can be viewed as each stage completes
+        results_writer.initialise()
+        if hkl_info:
+            results_writer.write_hkl_info(hkl_info, finished=False)
+        html_out = write_html_report(results_writer, database=database)
+        logger.info(f"MrParse results will be written to: {html_out}")
+        if not ccp4cloud:
+            open_html_report(html_out)
+
+        if run_serial:
+            run_analyse_serial(search_model_finder, classifier, hkl_info, do_classify)
+        else:
+            search_model_finder, classifier, hkl_info = run_analyse_parallel(search_model_finder,
+                                                                             classifier,
+                                                                             hkl_info,
+                                                                             do_classify,
+                                                                             profile=profile,
+                                                                             profile_dir=profile_dir)
+
+        html_out = write_output_files(search_model_finder, hkl_info=hkl_info, classifier=classifier, ccp4cloud=ccp4cloud,
+                                      database=database, results_writer=results_writer)
+    if profile:
+        logger.info(f"Wrote profile summary: {merge_profiles(profile_dir)}")
+    logger.info(f"Wrote MrParse output file: {html_out}")
     return 0
 
 
+def report_stages(database, hklin=None, do_classify=None):
+    """Return the stages of the run that write results to the HTML report"""
+    stages = []
+    if database in ["all", "pdb"]:
+        stages.append('homologs')
+    if database in ["all", "afdb"]:
+        stages.append('models')
+    if hklin:
+        stages.append('hkl_info')
+    if do_classify:
+        stages.append('classification')
+    if timings_dir():
+        stages.append('timings')
+    return stages
+
+
+def open_html_report(html_out):
+    opencmd = None
+    if sys.platform.lower().startswith('linux'):
+        opencmd = 'xdg-open'
+    elif sys.platform.lower().startswith('darwin'):
+        opencmd = 'open'
+    if opencmd:
+        subprocess.Popen([opencmd, str(html_out)])
+
+
 def run_analyse_serial(search_model_finder, classifier, hkl_info, do_classify):
     try:
         search_model_finder()
@@ -135,25 +185,34 @@ def run_analyse_serial(search_model_finder, classifier, hkl_info, do_classify):
             logger.debug("Traceback is:", exc_info=sys.exc_info())
 
 
-def run_analyse_parallel(search_model_finder, classifier, hkl_info, do_classify):
+def run_analyse_parallel(search_model_finder, classifier, hkl_info, do_classify, profile=None,
+                         profile_dir=PROFILE_DIR):
     nproc = 3 if hkl_info else 2
     logger.info(f"Running on {nproc} processors.")
+    # The pool workers cannot start the eLLG worker processes, so parallel eLLG calculations are run in this process
+    search_model_finder.defer_ellg = search_model_finder.nproc > 1
     pool = multiprocessing.Pool(nproc)
-    smf_result = pool.apply_async(search_model_finder)
+    smf_result = pool.apply_async(profiled(search_model_finder, 'search_model_finder', profile, profile_dir))
 
     if do_classify:
-        mrc_result = pool.apply_async(classifier)
+        mrc_result = pool.apply_async(profiled(classifier, 'classifier', profile, profile_dir))
     if hkl_info:
-        hklin_result = pool.apply_async(hkl_info)
+        hklin_result = pool.apply_async(profiled(hkl_info, 'hkl_info', profile, profile_dir))
     pool.close()
-    logger.debug("Pool waiting")
-    pool.join()
-    logger.debug("Pool finished")
     try:
         search_model_finder = smf_result.get()
     except Exception as e:
         logger.critical(f'SearchModelFinder failed: {e}')
         logger.debug("Traceback is:", exc_info=sys.exc_info())
+    # Calculate any deferred eLLGs while the classifier and HklInfo are still running in the pool
+    try:
+        search_model_finder.calculate_ellg()
+    except Exception as e:
+        logger.critical(f'eLLG calculation failed: {e}')
+        logger.debug("Traceback is:", exc_info=sys.exc_info())
+    logger.debug("Pool waiting")
+    pool.join()
+    logger.debug("Pool finished")
     if do_classify:
         try:
             classifier = mrc_result.get()
@@ -169,44 +228,48 @@ def run_analyse_parallel(search_model_finder, classifier, hkl_info, do_classify)
     return search_model_finder, classifier, hkl_info
 
 
-def write_output_files(search_model_finder, hkl_info=None, classifier=None, ccp4cloud=None, database="all"):
-    # write out homologs for CCP4cloud
-    # This code should be updated to separate the storing of homologs from the PFAM directives
+def write_output_files(search_model_finder, hkl_info=None, classifier=None, ccp4cloud=None, database="all",
+                       results_writer=None):
+    """Write the final results data files and the HTML report"""
+    if results_writer is None:
+        results_writer = ResultsWriter(stages=report_stages(database, hklin=hkl_info, do_classify=classifier),
+                                       ccp4cloud=ccp4cloud)
+    with span('output'):
+        # This code should be updated to separate the storing of homologs from the PFAM directives
+        results_writer.write_homologs(search_model_finder)
+        results_writer.write_models(search_model_finder)
+        if hkl_info:
+            results_writer.write_hkl_info(hkl_info)
+        if classifier:
+            results_writer.write_classification(classifier)
+    if timings_dir():
+        results_writer.write_timings(gather_timings())
+    results_writer.write_status(complete=True)
+    return write_html_report(results_writer, database=database)
 
-    homologs_pfam = {}
-    try:
-        homologs = search_model_finder.homologs_as_dicts()
-        with open(HOMOLOGS_JS, 'w') as w:
-            w.write(json.dumps(homologs))
-        homologs_pfam = search_model_finder.homologs_with_graphics()
-        if ccp4cloud:
-            for homolog in homologs_pfam:
-                del homolog['pdb_file']
-    except RuntimeError:
-        logger.debug('No homologues found')
-
-    models_pfam = {}
-    try:
-        models = search_model_finder.models_as_dicts()
-        models_js_out = Path(MODELS_JS).resolve()
-        with open(models_js_out, 'w') as w:
-            w.write(json.dumps(models))
-        models_pfam = search_model_finder.models_with_graphics()
-        if ccp4cloud:
-            for model in models_pfam:
-                del model['pdb_file']
-    except RuntimeError:
-        logger.debug('No models found')
-
-    results_dict = {'pfam': {'homologs': homologs_pfam, 'models': models_pfam}}
-    if classifier:
-        results_dict['pfam'].update(classifier.pfam_dict())
-    if hkl_info:
-        results_dict['hkl_info'] = hkl_info.as_dict()
-        if ccp4cloud:
-            del results_dict['hkl_info']['hklin']
-    results_json = json.dumps(results_dict)
 
+def write_html_report(results_writer, database="all"):
+    return write_html_reports([(HTML_OUT, results_writer)], database=database)[0]
+
+
+def write_html_reports(reports, database="all", assets_dir=None):
+    """Write the HTML reports for a batch of targets, compiling the template only once
+
+    Parameters
+    ----------
+    reports : iterable
+       (html_out, results_writer) tuples of the path of each report and the ResultsWriter of its results
+    database : str
+       The database searched, which selects the template
+    assets_dir : str
+       If set, the static files used by the reports are copied to this directory once and shared by all the
+       reports, rather than each linking into the installation
+
+    Returns
+    -------
+    list
+       The paths of the reports
+    """
     if "all" in database:
         HTML_TEMPLATE=HTML_TEMPLATE_ALL
     elif "pdb" in database:
@@ -214,13 +277,37 @@ def write_output_files(search_model_finder, hkl_info=None, classifier=None, ccp4
     elif "afdb" in database:
         HTML_TEMPLATE=HTML_TEMPLATE_AFDB
 
-    html_out = Path(HTML_OUT).resolve()
-    render_template(HTML_TEMPLATE, html_out,
-                    # kwargs appear as variables in the template
-                    mrparse_html_dir=HTML_DIR,
-                    results_json=results_json,
-                    version=__version__)
-    return html_out
+    html_dir = copy_html_assets(assets_dir) if assets_dir else HTML_DIR
+    targets = []
+    for html_out, results_writer in reports:
+        targets.append((Path(html_out).resolve(),
+                        # kwargs appear as variables in the template
+                        dict(mrparse_html_dir=html_dir,
+                             report_config=json_dumps(results_writer.report_config()),
+                             version=__version__)))
+    render_templates(HTML_TEMPLATE, targets)
+    return [html_out for html_out, _ in targets]
+
+
+def template_environment(template_dir=HTML_DIR):
+    """Return the Jinja2 environment for templates in template_dir
+
+    The environment is created once per directory and kept for the life of the process so each template is
+    only compiled once, and the compiled bytecode is cached on disk so that it is shared between processes.
+    """
+    template_dir = str(template_dir)
+    if template_dir not in _TEMPLATE_ENVIRONMENTS:
+        _TEMPLATE_ENVIRONMENTS[template_dir] = Environment(loader=FileSystemLoader(template_dir),
+                                                           bytecode_cache=FileSystemBytecodeCache(),
+                                                           auto_reload=False,
+                                                           keep_trailing_newline=True)
+    return _TEMPLATE_ENVIRONMENTS[template_dir]
+
+
+def get_template(in_file_path):
+    """Return the compiled template for the given path"""
+    in_file_path = Path(in_file_path)
+    return template_environment(in_file_path.parent).get_template(in_file_path.name)
 
 
 def render_template(in_file_path, out_file_path, **kwargs):
@@ -236,8 +323,43 @@ def render_template(in_file_path, out_file_path, **kwargs):
     **kwargs : dict
        Variables to use in templating
     """
-    env = Environment(loader=FileSystemLoader(in_file_path.parent), keep_trailing_newline=True)
-    template = env.get_template(in_file_path.name)
-    output = template.render(**kwargs)
-    with open(str(out_file_path), "w") as f:
-        f.write(output)
+    render_templates(in_file_path, [(out_file_path, kwargs)])
+
+
+def render_templates(in_file_path, targets):
+    """
+    Template the given file for many targets, compiling the template only once.
+
+    Parameters
+    ----------
+    in_file_path : Path
+       The path to the template
+    targets : iterable
+       (out_file_path, kwargs) tuples of the path to output each templated file and the variables to use in templating it
+    """
+    template = get_template(in_file_path)
+    for out_file_path, kwargs in targets:
+        with open(str(out_file_path), "w") as f:
+            for chunk in template.generate(**kwargs):
+                f.write(chunk)
+
+
+def copy_html_assets(out_dir):
+    """Copy the static files used by the HTML reports (javascript libraries, css and images) into out_dir
+
+    The files are only copied if they aren't there already, so a batch of reports shares a single copy.
+
+    Parameters
+    ----------
+    out_dir : str
+       The directory to copy the files to
+
+    Returns
+    -------
+    html_dir : Path
+       The directory containing the copied files
+    """
+    html_dir = Path(out_dir).resolve().joinpath('html')
+    if not html_dir.exists():
+        shutil.copytree(str(HTML_DIR), str(html_dir), ignore=shutil.ignore_patterns('*.jinja2'))
+    return html_dir
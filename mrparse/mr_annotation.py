@@ -5,6 +5,8 @@ Created on 23 Nov 2018
 """
 import copy
 
+import numpy as np
+
 
 class AnnotationSymbol(object):
     def __init__(self, name=None, symbol=None, stype=None):
@@ -42,19 +44,56 @@ NULL_ANNOTATION.source = 'null'
 
 
 class SequenceAnnotation(object):
+    """Per-residue annotation of a sequence
+
+    The annotation symbols are stored as an array of their (ASCII) character codes and the scores as an
+    array of floats so that operations over the whole sequence can be vectorised. The annotation and
+    scores attributes can still be set and read as a string and a sequence of numbers.
+    """
     def __init__(self, null_symbol=NULL_ANNOTATION.symbol):
         __slots__ = ('source', 'scores', 'annotation', 'annotation_library', 'null_symbol')
         self.source = None
-        self.scores = []
-        self.annotation = '' # list of annotation symbols
+        self._codes = np.zeros(0, dtype=np.uint8)
+        self._scores = np.zeros(0, dtype=float)
+        self._annotation = ''
         self.annotation_library = dict()
         self.null_symbol = null_symbol
 
+    @property
+    def annotation(self):
+        """The annotation as a string of symbols"""
+        if self._annotation is None:
+            self._annotation = self._codes.tobytes().decode('ascii')
+        return self._annotation
+
+    @annotation.setter
+    def annotation(self, annotation):
+        self._codes = symbol_codes("".join(annotation))
+        self._annotation = None
+
+    @property
+    def codes(self):
+        """The annotation as an array of symbol character codes"""
+        return self._codes
+
+    @codes.setter
+    def codes(self, codes):
+        self._codes = np.asarray(codes, dtype=np.uint8)
+        self._annotation = None
+
+    @property
+    def scores(self):
+        return self._scores
+
+    @scores.setter
+    def scores(self, scores):
+        self._scores = np.asarray(scores, dtype=float)
+
     def add_annotation(self, annotation):
         if annotation != NULL_ANNOTATION:
             assert self.annotation_is_significant(annotation), f"Cannot find: {annotation}"
-        self.annotation += annotation.symbol
-        self.scores.append(annotation.score)
+        self.codes = np.append(self._codes, symbol_codes(annotation.symbol))
+        self.scores = np.append(self._scores, annotation.score)
 
     def annotation_is_significant(self, annotation):
         return annotation is not NULL_ANNOTATION and annotation in self.annotation_library.values()
@@ -67,6 +106,32 @@ class SequenceAnnotation(object):
         annotation.source = self.source
         self.annotation_library[annotation.symbol] = annotation
 
+    def to_dict(self):
+        """Return the annotation as a JSON-serialisable dictionary"""
+        return {'source': self.source,
+                'null_symbol': self.null_symbol,
+                'annotation': self.annotation,
+                'scores': self.scores.tolist(),
+                'annotation_library': [{'name': a.name, 'symbol': a.symbol, 'stype': a.stype, 'source': a.source}
+                                       for a in self.annotation_library.values()]}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Create an annotation from a dictionary created by to_dict"""
+        ann = cls(null_symbol=d['null_symbol'])
+        ann.source = d['source']
+        for a in d['annotation_library']:
+            symbol = AnnotationSymbol(name=a['name'], symbol=a['symbol'], stype=a['stype'])
+            symbol.source = a['source']
+            ann.annotation_library[symbol.symbol] = symbol
+        ann.annotation = d['annotation']
+        ann.scores = d['scores']
+        return ann
+
+    def significant_mask(self):
+        """Return a boolean array that is True where the annotation is a symbol in the annotation library"""
+        return np.isin(self._codes, symbol_codes("".join(self.annotation_library.keys())))
+
     def __getitem__(self, idx):
         symbol = self.annotation[idx]
         if self.has_annotation_symbol(symbol):
@@ -89,19 +154,18 @@ class SequenceAnnotation(object):
         ca.annotation_library = dict(self.annotation_library, **other.annotation_library)
 
         # For now just use prediction and leave probabiltiies
-        for i in range(len(self)):
-            if self.annotation_is_significant(self[i]) and other.annotation_is_significant(other[i]):
-                ca.add_annotation(NULL_ANNOTATION)
-            elif self.annotation_is_significant(self[i]):
-                ca.add_annotation(self[i])
-            elif other.annotation_is_significant(other[i]):
-                ca.add_annotation(other[i])
-            else:
-                ca.add_annotation(NULL_ANNOTATION)
+        # Where both or neither annotations are significant the consensus is null
+        self_significant = self.significant_mask()
+        other_significant = other.significant_mask()
+        self_only = self_significant & ~other_significant
+        other_only = other_significant & ~self_significant
+        null_code = symbol_codes(NULL_ANNOTATION.symbol)[0]
+        ca.codes = np.where(self_only, self._codes, np.where(other_only, other._codes, null_code))
+        ca.scores = np.where(self_only, self._scores, np.where(other_only, other._scores, NULL_ANNOTATION.score))
         return ca
 
     def __len__(self):
-        return len(self.annotation)
+        return len(self._codes)
 
     def __str__(self):
         attrs = [k for k in self.__dict__.keys() if not k.startswith('_')]
@@ -127,22 +191,37 @@ class AnnotationChunk(object):
         return out_str
 
 
+def symbol_codes(symbols):
+    """Return a string of annotation symbols as an array of character codes"""
+    return np.frombuffer(symbols.encode('ascii'), dtype=np.uint8).copy()
+
+
 def get_annotation_chunks(annotation):
+    """Return the runs of significant annotation symbols as AnnotationChunks
+
+    The chunks are found by run-length encoding the annotation: consecutive symbols of the same
+    type form a single chunk. Chunk ends are exclusive and, as before, a chunk that runs to the end
+    of the sequence is not included.
+    """
     if annotation is None:
         return None
+    # Symbols are equal if they are of the same type, so map each code to an index of its type (0 for null)
+    stypes = []
+    type_index = np.zeros(256, dtype=np.int64)
+    for symbol, a in annotation.annotation_library.items():
+        if a.stype == NULL_ANNOTATION.stype:
+            continue
+        if a.stype not in stypes:
+            stypes.append(a.stype)
+        type_index[symbol_codes(symbol)[0]] = stypes.index(a.stype) + 1
+    types = type_index[annotation.codes]
+    if not len(types):
+        return []
+    # Start of each run of identical types and the index after its end
+    starts = np.flatnonzero(np.diff(types, prepend=-1))
+    ends = np.append(starts[1:], len(types))
     chunks = []
-    chunk = None
-    for i, a in enumerate(annotation):
-        if a != NULL_ANNOTATION:
-            if not chunk:
-                chunk = AnnotationChunk(start=i, annotation=a)
-            elif chunk.annotation != a:
-                chunk.end = i
-                chunks.append(chunk)
-                chunk = AnnotationChunk(start=i, annotation=a)
-        else:
-            if chunk:
-                chunk.end = i
-                chunks.append(chunk)
-                chunk = None
-    return chunks
\ No newline at end of file
+    for start, end in zip(starts, ends):
+        if types[start] and end < len(types):
+            chunks.append(AnnotationChunk(start=int(start), end=int(end), annotation=annotation[int(start)]))
+    return chunks
@@ -0,0 +1,110 @@
+"""
+Created on 19 Oct 2026
+
+Read files from the results archives returned by the prediction servers without extracting them to disk.
+
+Members are read one at a time from the compressed stream, so only the member being read is held in memory.
+Members whose names would be unsafe to extract (absolute paths or paths containing '..') are rejected, as
+they would be by the checks made before extracting an archive.
+"""
+import fnmatch
+import io
+import logging
+from pathlib import PurePosixPath
+import tarfile
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+
+class UnsafeArchiveError(RuntimeError):
+    pass
+
+
+class _StreamReader(io.RawIOBase):
+    """Read-only, non-seekable view of a member of a tar file opened in stream mode
+
+    The file objects tarfile returns in stream mode raise an AttributeError rather than returning False
+    when asked if they are seekable, which io.TextIOWrapper does.
+    """
+
+    def __init__(self, fh):
+        self._fh = fh
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._fh.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def check_member_name(name):
+    """Raise an UnsafeArchiveError if an archive member name points outside the archive"""
+    path = PurePosixPath(name.replace('\\', '/'))
+    if path.is_absolute() or '..' in path.parts or (path.parts and path.parts[0].endswith(':')):
+        raise UnsafeArchiveError(f"Attempted path traversal in archive member: {name}")
+    return str(path)
+
+
+def _matches(name, pattern):
+    return fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(PurePosixPath(name).name, pattern)
+
+
+def iter_archive_members(archive, pattern='*', encoding='utf-8'):
+    """Iterate over the regular files in a tar or zip archive that match a pattern
+
+    Parameters
+    ----------
+    archive : str
+       The path to a (possibly compressed) tar file or a zip file
+    pattern : str
+       A glob pattern matched against either the full member name or its basename
+    encoding : str
+       The encoding of the members (None to return binary file objects)
+
+    Yields
+    ------
+    (name, file object) for each matching member. The file object is only valid until the next member
+    is requested.
+    """
+    archive = str(archive)
+    if zipfile.is_zipfile(archive):
+        members = _iter_zip_members(archive, pattern)
+    elif tarfile.is_tarfile(archive):
+        members = _iter_tar_members(archive, pattern)
+    else:
+        raise RuntimeError(f"File is not a valid tar or zip archive: {archive}")
+    nmembers = 0
+    for name, fh in members:
+        nmembers += 1
+        yield name, (io.TextIOWrapper(fh, encoding=encoding) if encoding else fh)
+    if not nmembers:
+        logger.debug(f"No members matching {pattern} in archive: {archive}")
+
+
+def _iter_tar_members(archive, pattern):
+    # Stream mode reads the archive sequentially so the whole (decompressed) archive is never held in memory
+    with tarfile.open(archive, 'r|*') as tf:
+        for member in tf:
+            name = check_member_name(member.name)
+            if member.isfile() and _matches(name, pattern):
+                yield name, io.BufferedReader(_StreamReader(tf.extractfile(member)))
+
+
+def _iter_zip_members(archive, pattern):
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = check_member_name(info.filename)
+            if not info.is_dir() and _matches(name, pattern):
+                with zf.open(info) as fh:
+                    yield name, fh
+
+
+def read_archive_member(archive, pattern, parser, encoding='utf-8'):
+    """Return the result of calling parser on the file object of the first member matching pattern"""
+    for name, fh in iter_archive_members(archive, pattern, encoding=encoding):
+        logger.debug(f"Reading {name} from archive: {archive}")
+        return parser(fh)
+    raise RuntimeError(f"Cannot find file matching {pattern} in archive: {archive}")
@@ -35,11 +35,16 @@ def mrparse_argparse(parser):
     sg.add_argument('--run_serial', action='store_true', help='Run on a single processor')
     sg.add_argument('-seq', '--seqin', action=FilePathAction, help='Sequence file')
     sg.add_argument('--search_engine', help="Select search engine", default="phmmer",
-                    choices=['phmmer', 'hhsearch'])
+                    choices=['phmmer', 'hhsearch', 'fastprefilter'])
     sg.add_argument('--deeptmhmm_exe', action=FilePathAction,
                     help="Location of DeepTMHMM executable for transmembrane classification")
     sg.add_argument('--deepcoil_exe', action=FilePathAction,
                     help="Location of Deepcoil executable for coiled-coil classification")
+    sg.add_argument('--deepcoil_in_process', action='store_true',
+                    help="Run Deepcoil in-process with the deepcoil python package instead of --deepcoil_exe")
+    sg.add_argument('--deeptmhmm_pybiolib', action='store_true',
+                    help="Submit DeepTMHMM jobs through the pybiolib python API instead of running --deeptmhmm_exe. "
+                         "The prediction is still run by BioLib.")
     sg.add_argument('--hhsearch_exe', action=FilePathAction,
                     help="Location of hhsearch executable")
     sg.add_argument('--hhsearch_db', help="Location of hhsearch database")
@@ -49,6 +54,18 @@ def mrparse_argparse(parser):
     sg.add_argument('--use_api', action='store_true', help='Run alphafold database search using EBI API database search')
     sg.add_argument('--max_hits', required=False, type=int, choices=range(1,101), metavar="[1-100]", default=10, help='Maximum number of models to download and prepare for each database search')
     sg.add_argument('--nproc', required=False, type=int, default=1, help='Number of cores to use in phmmer search')
+    sg.add_argument('--prefilter', type=int, metavar='N',
+                    help='Only search the N sequences of the alphafold sequence database that share the most k-mers with '
+                         'the target sequence. The k-mer index of the database is built the first time it is searched. '
+                         'With --search_engine fastprefilter, the number of sequences with the best ungapped alignments '
+                         'that are searched with phmmer (default 5000).')
+    sg.add_argument('--no_cache', action='store_true',
+                    help='Do not use or store cached secondary structure, coiled-coil and transmembrane predictions or reflection data analyses')
+    sg.add_argument('--pathology_method', default='ctruncate', choices=['ctruncate', 'native'],
+                    help='Check the reflection data for crystal pathologies with ctruncate or in-process with gemmi')
+    sg.add_argument('--profile', choices=['cpu', 'mem', 'both'],
+                    help='Profile the CPU time (cProfile) and/or memory use (tracemalloc) of each process, writing the '
+                         'profiles and a merged summary to the profiles directory of the work directory')
     sg.add_argument('--database', help='Database to search', default='all', choices=['all', 'pdb', 'afdb'])
     sg.add_argument('-v', '--version', action='version', version='%(prog)s version: ' + __version__)
 
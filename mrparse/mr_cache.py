@@ -0,0 +1,160 @@
+"""
+Created on 19 Oct 2026
+
+A simple persistent cache of JSON-serialisable results, stored as one file per entry on disk.
+
+The cache lives under $MRPARSE_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/mrparse (~/.cache/mrparse).
+Entries expire after a time-to-live and the least recently used entries are removed when a namespace
+holds more than a maximum number of entries.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import time
+
+from mrparse.mr_output import AtomicFile
+from mrparse.mr_util import json_dumps
+
+CACHE_DIR_ENV = 'MRPARSE_CACHE_DIR'
+DEFAULT_TTL = 30 * 24 * 60 * 60  # 30 days in seconds
+DEFAULT_MAX_ENTRIES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home().joinpath('.cache')
+    return Path(cache_home).joinpath('mrparse')
+
+
+def sequence_hash(sequence):
+    """Return a hash identifying a protein sequence"""
+    return hashlib.sha256(str(sequence).strip().upper().encode('ascii')).hexdigest()
+
+
+def file_hash(fpath, blocksize=1 << 20):
+    """Return a hash of the contents of a file"""
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as fh:
+        for block in iter(lambda: fh.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DiskCache(object):
+    """A cache of JSON-serialisable values stored on disk
+
+    Parameters
+    ----------
+    namespace : str
+       The name of the subdirectory of the cache directory holding the entries
+    cache_dir : str
+       The top-level cache directory [default_cache_dir()]
+    ttl : float
+       The number of seconds after which entries expire (None for no expiry)
+    max_entries : int
+       The maximum number of entries kept in the namespace (None for no limit)
+
+    Examples
+    --------
+    >>> cache = DiskCache('predictions')
+    >>> key = cache.key(sequence_hash(seq_info.sequence), 'jpred', 1)
+    >>> prediction = cache.get(key)
+    >>> if prediction is None:
+    ...     cache.set(key, run_prediction())
+    """
+    SUFFIX = '.json'
+
+    def __init__(self, namespace, cache_dir=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.directory = Path(cache_dir or default_cache_dir()).joinpath(namespace)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(*parts):
+        """Return a key for the entry identified by parts"""
+        return hashlib.sha256("\0".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return self.directory.joinpath(f'{key}{self.SUFFIX}')
+
+    def _load(self, fh):
+        return json.load(fh)
+
+    def _dump(self, entry):
+        return json_dumps(entry)
+
+    def get(self, key, default=None):
+        """Return the value stored under key, or default if there isn't one or it has expired"""
+        fpath = self.path(key)
+        try:
+            with open(fpath) as fh:
+                entry = self._load(fh)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            logger.debug(f"Ignoring unreadable cache entry {fpath}: {e}")
+            return default
+        if self.ttl is not None and time.time() - entry.get('created', 0) > self.ttl:
+            logger.debug(f"Cache entry {fpath} has expired")
+            self._remove(fpath)
+            return default
+        try:
+            os.utime(fpath)  # Record use for eviction
+        except OSError:
+            pass
+        return entry.get('value', default)
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries if the cache is full"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fpath = self.path(key)
+        with AtomicFile(fpath) as w:
+            w.write(self._dump({'created': time.time(), 'value': value}))
+        self.evict()
+        return fpath
+
+    def delete(self, key):
+        self._remove(self.path(key))
+
+    def entries(self):
+        if not self.directory.is_dir():
+            return []
+        return list(self.directory.glob(f'*{self.SUFFIX}'))
+
+    def evict(self):
+        """Remove expired entries and the least recently used entries over max_entries"""
+        entries = []
+        now = time.time()
+        for fpath in self.entries():
+            try:
+                mtime = fpath.stat().st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, fpath))
+        entries.sort(reverse=True)
+        for i, (mtime, fpath) in enumerate(entries):
+            # Entries are only ever touched after they are created, so an entry whose mtime is older than
+            # the ttl has definitely expired
+            if (self.max_entries is not None and i >= self.max_entries) or \
+                    (self.ttl is not None and now - mtime > self.ttl):
+                self._remove(fpath)
+
+    def clear(self):
+        for fpath in self.entries():
+            self._remove(fpath)
+
+    @staticmethod
+    def _remove(fpath):
+        try:
+            Path(fpath).unlink()
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.entries())
+
@@ -7,14 +7,39 @@ import logging
 import threading
 import sys
 
+from mrparse.mr_annotation import SequenceAnnotation
+from mrparse.mr_cache import DiskCache, sequence_hash
 from mrparse.mr_deepcoil import CCPred
 from mrparse.mr_deeptmhmm import TMPred
 from mrparse.mr_jpred import JPred
+from mrparse.mr_output import write_progress
 from mrparse.mr_pfam import pfam_dict_from_annotation
+from mrparse.mr_poll import Deadline
+from mrparse.mr_timing import span
+from mrparse.mr_topcons import TMPred as TopConsPred
+
+PREDICTION_CACHE = 'predictions'
+CLASSIFY_MAX_RUNTIME = 60 * 60  # seconds for all the predictors of a run
 
 logger = logging.getLogger(__name__)
 
 
+def prediction_cache_key(sequence, predictor_class):
+    """Return the key for the cached prediction of a sequence
+
+    Predictions are identified by the sequence, the predictor class and its CACHE_VERSION, which is
+    incremented whenever a change to the predictor means that previously cached predictions are invalid.
+    """
+    name = f"{predictor_class.__module__}.{predictor_class.__name__}"
+    return DiskCache.key(sequence_hash(sequence), name, predictor_class.CACHE_VERSION)
+
+
+def predictor_span_name(predictor):
+    """Return the name of the timing span of a predictor, e.g. classify.mr_deepcoil.CCPred"""
+    module = predictor.__class__.__module__.rsplit('.', 1)[-1]
+    return f"classify.{module}.{predictor.__class__.__name__}"
+
+
 class PredictorThread(threading.Thread):
     def __init__(self, classifier):
         super(PredictorThread, self).__init__()
@@ -24,7 +49,23 @@ class PredictorThread(threading.Thread):
 
     def run(self):
         try:
-            self.classifier.get_prediction()
+            with span(predictor_span_name(self.classifier)):
+                self.classifier.get_prediction()
+        except Exception as e:
+            self.exc_info = sys.exc_info()
+            self.exception = e
+
+
+class BatchPredictorThread(PredictorThread):
+    def __init__(self, predictor, sequences):
+        super(BatchPredictorThread, self).__init__(predictor)
+        self.sequences = sequences
+        self.predictions = {}
+
+    def run(self):
+        try:
+            with span(predictor_span_name(self.classifier), nsequences=len(self.sequences)):
+                self.predictions = self.classifier.batch_predictions(self.sequences)
         except Exception as e:
             self.exc_info = sys.exc_info()
             self.exception = e
@@ -32,13 +73,21 @@ class PredictorThread(threading.Thread):
 
 class MrClassifier(object):
     def __init__(self, seq_info, do_ss_predictor=True, do_cc_predictor=True, do_tm_predictor=True, deeptmhmm_exe=None,
-                 deepcoil_exe=None):
+                 deepcoil_exe=None, nproc=1, use_cache=True, results_writer=None, deepcoil_in_process=False,
+                 deeptmhmm_pybiolib=False, max_runtime=CLASSIFY_MAX_RUNTIME):
         self.seq_info = seq_info
         self.do_ss_predictor = do_ss_predictor
         self.do_cc_predictor = do_cc_predictor
         self.do_tm_predictor = do_tm_predictor
         self.deeptmhmm_exe = deeptmhmm_exe
         self.deepcoil_exe = deepcoil_exe
+        self.deepcoil_in_process = deepcoil_in_process
+        self.deeptmhmm_pybiolib = deeptmhmm_pybiolib
+        self.nproc = nproc
+        self.use_cache = use_cache
+        self.results_writer = results_writer
+        self.max_runtime = max_runtime
+        self.deadline = None
         self.ss_prediction = None
         self.classification_prediction = None
 
@@ -47,7 +96,10 @@ class MrClassifier(object):
         to the pool and instance methods don't work, so we add the object to the pool and define __call__
         https://stackoverflow.com/questions/1816958/cant-pickle-type-instancemethod-when-using-multiprocessing-pool-map/6975654#6975654
         """
-        self.get_prediction()
+        with span('classify'):
+            self.get_prediction()
+        if self.results_writer:
+            write_progress(self.results_writer.write_classification, self)
         return self
 
     @staticmethod
@@ -62,41 +114,77 @@ class MrClassifier(object):
             consensus = consensus + a
         return consensus
 
+    def prediction_cache_key(self, predictor):
+        return prediction_cache_key(self.seq_info.sequence, predictor.__class__)
+
+    def load_cached_prediction(self, predictor, cache):
+        """Set the prediction of predictor from the cache, returning True if it was found"""
+        if cache is None:
+            return False
+        cached = cache.get(self.prediction_cache_key(predictor))
+        if cached is None:
+            return False
+        try:
+            predictor.prediction = SequenceAnnotation.from_dict(cached)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.debug(f"Ignoring invalid cached prediction for {predictor.__class__.__name__}: {e}")
+            return False
+        logger.info(f"Using cached prediction for {predictor.__class__.__name__}")
+        return True
+
+    def cache_prediction(self, predictor, cache):
+        if cache is None or predictor.prediction is None:
+            return
+        try:
+            cache.set(self.prediction_cache_key(predictor), predictor.prediction.to_dict())
+        except Exception as e:
+            logger.warning(f"Could not cache prediction for {predictor.__class__.__name__}: {e}")
+
+    def run_predictor(self, predictor, cache, description):
+        """Set the prediction of predictor from the cache or by running it, returning False if it failed
+
+        The predictor is not started once the deadline of the run has passed.
+        """
+        if self.load_cached_prediction(predictor, cache):
+            return True
+        if self.deadline.expired():
+            logger.warning(f"{description} predictor not run as the classification deadline of "
+                           f"{self.deadline.budget}s has passed")
+            return False
+        thread = PredictorThread(predictor)
+        thread.start()
+        thread.join()
+        if thread.exception:
+            logger.warning(f"{description} predictor raised an exception: {thread.exception}")
+            logger.debug("Traceback is:", exc_info=thread.exc_info)
+            return False
+        self.cache_prediction(predictor, cache)
+        return True
+
     def get_prediction(self):
+        """Run the predictors one after another
+
+        All the predictors share a single deadline of max_runtime seconds: the servers polled by JPred and TopCons
+        are given up on when it passes and predictors that haven't started by then are skipped.
+        """
         cc_predictor = None
         tm_predictor = None
         ss_predictor = None
+        cache = DiskCache(PREDICTION_CACHE) if self.use_cache else None
+        self.deadline = Deadline(self.max_runtime)
 
         if self.do_cc_predictor:
-            cc_predictor = CCPred(self.seq_info, self.deepcoil_exe)
-            cc_thread = PredictorThread(cc_predictor)
-            cc_thread.start()
-            cc_thread.join()
-            if cc_thread.exception:
-                logger.warning(f"Coiled-Coil predictor raised an exception: {cc_thread.exception}")
-                logger.debug("Traceback is:", exc_info=cc_thread.exc_info)
-                self.do_cc_predictor = False
+            cc_predictor = CCPred(self.seq_info, self.deepcoil_exe, nproc=self.nproc, in_process=self.deepcoil_in_process)
+            self.do_cc_predictor = self.run_predictor(cc_predictor, cache, 'Coiled-Coil')
             logger.info('Coiled-Coil predictor finished')
 
         if self.do_tm_predictor:
-            tm_predictor = TMPred(self.seq_info, self.deeptmhmm_exe)
-            tm_thread = PredictorThread(tm_predictor)
-            tm_thread.start()
-            tm_thread.join()
-            if tm_thread.exception:
-                logger.warning(f"Transmembrane predictor raised an exception: {tm_thread.exception}")
-                logger.debug("Traceback is:", exc_info=tm_thread.exc_info)
-                self.do_tm_predictor = False
+            tm_predictor = TMPred(self.seq_info, self.deeptmhmm_exe, use_pybiolib=self.deeptmhmm_pybiolib)
+            self.do_tm_predictor = self.run_predictor(tm_predictor, cache, 'Transmembrane')
             logger.info('TM predictor finished')
         if self.do_ss_predictor:
-            ss_predictor = JPred(seq_info=self.seq_info)
-            ss_thread = PredictorThread(ss_predictor)
-            ss_thread.start()
-            ss_thread.join()
-            if ss_thread.exception:
-                logger.warning(f"JPred predictor raised error: {ss_thread.exception}")
-                logger.debug("Traceback is:", exc_info=ss_thread.exc_info)
-                self.do_ss_predictor = False
+            ss_predictor = JPred(seq_info=self.seq_info, deadline=self.deadline)
+            self.do_ss_predictor = self.run_predictor(ss_predictor, cache, 'JPred')
             logger.info('SS predictor finished')
 
         # Determine pediction
@@ -118,3 +206,85 @@ class MrClassifier(object):
         if self.ss_prediction:
             d['ss_pred'] = pfam_dict_from_annotation(self.ss_prediction)
         return d
+
+
+def classify_batch(sequences, do_ss_predictor=True, do_tm_predictor=True, do_cc_predictor=False, deepcoil_exe=None,
+                   use_cache=True, deepcoil_in_process=False, deeptmhmm_pybiolib=False,
+                   max_runtime=CLASSIFY_MAX_RUNTIME):
+    """Predict the secondary structure, transmembrane and coiled-coil regions of many sequences
+
+    The sequences without a cached prediction are sent to the JPred and TopCons servers as batches, which
+    are run at the same time, rather than as one job per sequence. With deeptmhmm_pybiolib, transmembrane
+    regions are predicted by a single DeepTMHMM job submitted through the biolib python API instead of TopCons.
+    With deepcoil_in_process, the DeepCoil model is loaded once in this process for all the sequences instead of
+    running deepcoil_exe for each one.
+
+    Parameters
+    ----------
+    sequences : dict
+       Sequences keyed by name
+    do_ss_predictor : bool
+       Predict the secondary structure with JPred
+    do_tm_predictor : bool
+       Predict transmembrane regions with DeepTMHMM or TopCons
+    do_cc_predictor : bool
+       Predict coiled-coils with DeepCoil
+    deepcoil_exe : str
+       The DeepCoil script, used unless deepcoil_in_process is set
+    use_cache : bool
+       Use and store cached predictions
+    deepcoil_in_process : bool
+       Run DeepCoil with the deepcoil python package
+    deeptmhmm_pybiolib : bool
+       Predict transmembrane regions with DeepTMHMM through the biolib python API rather than with TopCons
+    max_runtime : float
+       The number of seconds the JPred and TopCons jobs are polled for, shared between them
+
+    Returns
+    -------
+    dict
+       A dictionary for each name with the 'ss_prediction', 'tm_prediction' and 'cc_prediction' annotations
+       (None if there is no prediction)
+    """
+    cache = DiskCache(PREDICTION_CACHE) if use_cache else None
+    deadline = Deadline(max_runtime)
+    predictors = {}
+    if do_ss_predictor:
+        predictors['ss_prediction'] = JPred(deadline=deadline)
+    if do_tm_predictor:
+        if deeptmhmm_pybiolib:
+            predictors['tm_prediction'] = TMPred(None, use_pybiolib=True)
+        else:
+            predictors['tm_prediction'] = TopConsPred(None, deadline=deadline)
+    if do_cc_predictor:
+        predictors['cc_prediction'] = CCPred(None, deepcoil_exe, in_process=deepcoil_in_process)
+
+    results = {name: {'ss_prediction': None, 'tm_prediction': None, 'cc_prediction': None} for name in sequences}
+    to_run = {}
+    for key, predictor in predictors.items():
+        to_run[key] = {}
+        for name, sequence in sequences.items():
+            cached = cache.get(prediction_cache_key(sequence, predictor.__class__)) if cache is not None else None
+            if cached is None:
+                to_run[key][name] = sequence
+            else:
+                results[name][key] = SequenceAnnotation.from_dict(cached)
+        logger.info(f"{predictor.__class__.__name__}: {len(sequences) - len(to_run[key])} cached predictions, "
+                    f"{len(to_run[key])} to run")
+
+    threads = {}
+    for key, predictor in predictors.items():
+        if to_run[key]:
+            threads[key] = BatchPredictorThread(predictor, to_run[key])
+            threads[key].start()
+    for key, thread in threads.items():
+        thread.join()
+        if thread.exception:
+            logger.warning(f"{predictors[key].__class__.__name__} batch raised an exception: {thread.exception}")
+            logger.debug("Traceback is:", exc_info=thread.exc_info)
+            continue
+        for name, annotation in thread.predictions.items():
+            results[name][key] = annotation
+            if cache is not None:
+                cache.set(prediction_cache_key(sequences[name], predictors[key].__class__), annotation.to_dict())
+    return results
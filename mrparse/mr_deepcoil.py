@@ -5,14 +5,26 @@ Created on 18 Oct 2018
 
 """
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation, NULL_ANNOTATION
-from mrparse.mr_util import now, is_exe, run_cmd
+
+import numpy as np
+
+try:
+    from deepcoil import DeepCoil
+except ImportError:
+    DeepCoil = None
+
+from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation, NULL_ANNOTATION, symbol_codes
+from mrparse.mr_sequence import Sequence
+from mrparse.mr_process import run_process
+from mrparse.mr_util import now, is_exe
 
 
 THRESHOLD_PROBABILITY = 0.6
 DEEPCOIL_MIN_RESIDUES = 30
 DEEPCOIL_MAX_RESIDUES = 500
+DEEPCOIL_WINDOW_OVERLAP = 50
 
 CC = AnnotationSymbol()
 CC.symbol = 'C'
@@ -21,63 +33,197 @@ CC.name = 'CC'
 
 logger = logging.getLogger(__name__)
 
+_DEEPCOIL_MODEL = None
+
 
 class CCPred(object):
     """Class to run Coiled-coil prediction using Deepcoil: https://github.com/labstructbioinf/DeepCoil
     
-    As Deepcoil has a length limit of 30 < 500 residues, anything over 500 we need to split into chunks
-    
-    Notes:
-    The sequence code should be numpified
+    As Deepcoil has a length limit of 30 < 500 residues, anything over 500 residues is split into overlapping
+    windows that are run in parallel, and the probabilities are averaged where the windows overlap.
+
+    With in_process, the model from the deepcoil python package is run within the process (on the CPU) instead
+    of with the deepcoil_exe script. The model is only loaded once per process and all the windows (and sequences
+    for batch_predictions) are predicted together.
     """
+    CACHE_VERSION = 1
     
-    def __init__(self, seq_info, deepcoil_exe):
+    def __init__(self, seq_info, deepcoil_exe, nproc=1, in_process=False):
         self.seq_info = seq_info
         self.deepcoil_exe = deepcoil_exe
+        self.nproc = nproc
+        self.in_process = in_process
         self.prediction = None
         
     def get_prediction(self):
         logger.debug(f"CCPred starting prediction at: {now()}")
-        if not is_exe(self.deepcoil_exe):
-            raise RuntimeError(f"Cannot find or execute required Deepcoil script: {self.deepcoil_exe}")
-        if self.seq_info.nresidues < DEEPCOIL_MIN_RESIDUES or self.seq_info.nresidues > DEEPCOIL_MAX_RESIDUES:
-            raise RuntimeError(
-                f"Cannot run Deepcoils as sequence length of {self.seq_info.nresidues} "
-                f"is outside Deepoil limits of {DEEPCOIL_MIN_RESIDUES} < {DEEPCOIL_MAX_RESIDUES}")
-        scores = probabilites_from_sequence(self.seq_info, self.deepcoil_exe)
+        check_sequence_length(self.seq_info.sequence)
+        if self.in_process:
+            scores = probabilities_in_process({'query': self.seq_info.sequence})['query']
+        else:
+            if not is_exe(self.deepcoil_exe):
+                raise RuntimeError(f"Cannot find or execute required Deepcoil script: {self.deepcoil_exe}")
+            scores = probabilites_from_sequence(self.seq_info, self.deepcoil_exe, nproc=self.nproc)
+        self.prediction = self.create_annotation(scores)
+        logger.debug(f"CCPred finished prediction at: {now()}")
+
+    def batch_predictions(self, sequences):
+        """Predict coiled-coils for several sequences
+
+        Parameters
+        ----------
+        sequences : dict
+           Sequences keyed by name
+
+        Returns
+        -------
+        dict
+           The predicted annotation for each name (sequences that couldn't be predicted are missing)
+        """
+        valid = {}
+        for name, sequence in sequences.items():
+            try:
+                check_sequence_length(sequence)
+                valid[name] = sequence
+            except RuntimeError as e:
+                logger.warning(f"Skipping {name}: {e}")
+        if self.in_process:
+            probabilities = probabilities_in_process(valid)
+        else:
+            if not is_exe(self.deepcoil_exe):
+                raise RuntimeError(f"Cannot find or execute required Deepcoil script: {self.deepcoil_exe}")
+            probabilities = {name: probabilites_from_sequence(Sequence(sequence=sequence), self.deepcoil_exe,
+                                                              nproc=self.nproc)
+                             for name, sequence in valid.items()}
+        return {name: self.create_annotation(scores) for name, scores in probabilities.items()}
+
+    @staticmethod
+    def create_annotation(scores):
         ann = SequenceAnnotation()
         ann.source = 'Deepcoil localhost'
         ann.library_add_annotation(CC)
         ann.scores = scores
-        ann.annotation = "".join([CC.symbol if float(p) > THRESHOLD_PROBABILITY else NULL_ANNOTATION.symbol
-                                  for p in scores])
-        logger.debug(f"CCPred finished prediction at: {now()}")
-        self.prediction = ann
+        ann.codes = np.where(ann.scores > THRESHOLD_PROBABILITY,
+                             symbol_codes(CC.symbol), symbol_codes(NULL_ANNOTATION.symbol))
+        return ann
+
+
+def check_sequence_length(sequence):
+    if len(sequence) < DEEPCOIL_MIN_RESIDUES:
+        raise RuntimeError(
+            f"Cannot run Deepcoils as sequence length of {len(sequence)} "
+            f"is less than the Deepcoil minimum of {DEEPCOIL_MIN_RESIDUES}")
+
+
+def deepcoil_model():
+    """Return the DeepCoil model, loading it the first time it is needed in this process"""
+    global _DEEPCOIL_MODEL
+    if DeepCoil is None:
+        raise RuntimeError("The deepcoil python package is not installed")
+    if _DEEPCOIL_MODEL is None:
+        logger.debug("Loading DeepCoil model")
+        _DEEPCOIL_MODEL = DeepCoil(use_gpu=False)
+    return _DEEPCOIL_MODEL
+
 
+def probabilities_in_process(sequences):
+    """Return the DeepCoil probabilities for each residue of each sequence using the in-process model
 
-def probabilites_from_sequence(seq_info, deepcoil_exe):
-    output = run_deepcoil(seq_info, deepcoil_exe)
-    aa, probabilities = parse_deepcoil(output)
+    Every window of every sequence is passed to the model in a single call so that they are predicted in
+    batches.
+
+    Parameters
+    ----------
+    sequences : dict
+       Sequences keyed by name
+
+    Returns
+    -------
+    dict
+       An array of probabilities for each name
+    """
+    windows = {name: deepcoil_windows(len(sequence)) for name, sequence in sequences.items()}
+    inputs = {f'{i}_{j}': sequence[start:end]
+              for i, (name, sequence) in enumerate(sequences.items())
+              for j, (start, end) in enumerate(windows[name])}
+    if not inputs:
+        return {}
+    results = deepcoil_model().predict(inputs)
+    probabilities = {}
+    for i, (name, sequence) in enumerate(sequences.items()):
+        window_probabilities = [np.asarray(results[f'{i}_{j}']['cc'], dtype=float).ravel()
+                                for j in range(len(windows[name]))]
+        probabilities[name] = stitch_probabilities(len(sequence), windows[name], window_probabilities)
     return probabilities
 
 
-def run_deepcoil(seq_info, deepcoil_exe):
+def probabilites_from_sequence(seq_info, deepcoil_exe, nproc=1):
+    """Return the Deepcoil probabilities for each residue in seq_info
+
+    Sequences longer than DEEPCOIL_MAX_RESIDUES are split into overlapping windows that are run in parallel
+    on up to nproc processors.
+    """
+    windows = deepcoil_windows(seq_info.nresidues)
+    if len(windows) == 1:
+        output = run_deepcoil(seq_info, deepcoil_exe)
+        aa, probabilities = parse_deepcoil(output)
+        return np.asarray(probabilities, dtype=float)
+
+    logger.info(f"Splitting sequence of {seq_info.nresidues} residues into {len(windows)} windows for Deepcoil")
+
+    def run_window(i):
+        start, end = windows[i]
+        window_seq = Sequence(sequence=seq_info.sequence[start:end])
+        output = run_deepcoil(window_seq, deepcoil_exe, name=f'deepcoil_input_{i}')
+        aa, probabilities = parse_deepcoil(output)
+        return np.asarray(probabilities, dtype=float)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(nproc, len(windows)))) as executor:
+        window_probabilities = list(executor.map(run_window, range(len(windows))))
+    return stitch_probabilities(seq_info.nresidues, windows, window_probabilities)
+
+
+def deepcoil_windows(nresidues, max_residues=DEEPCOIL_MAX_RESIDUES, overlap=DEEPCOIL_WINDOW_OVERLAP):
+    """Return the (start, end) indices of the windows needed to cover a sequence of nresidues
+
+    The windows are at most max_residues long, spaced evenly and overlap by at least overlap residues.
+    """
+    if nresidues <= max_residues:
+        return [(0, nresidues)]
+    nwindows = int(np.ceil((nresidues - overlap) / (max_residues - overlap)))
+    starts = np.linspace(0, nresidues - max_residues, nwindows).round().astype(int)
+    return [(int(start), int(start) + max_residues) for start in starts]
+
+
+def stitch_probabilities(nresidues, windows, window_probabilities):
+    """Combine the probabilities from overlapping windows, averaging where they overlap"""
+    totals = np.zeros(nresidues, dtype=float)
+    counts = np.zeros(nresidues, dtype=int)
+    for (start, end), probabilities in zip(windows, window_probabilities):
+        if len(probabilities) != end - start:
+            raise RuntimeError(f"Deepcoil returned {len(probabilities)} probabilities for window of "
+                               f"{end - start} residues ({start}-{end})")
+        totals[start:end] += probabilities
+        counts[start:end] += 1
+    return totals / counts
+
+
+def run_deepcoil(seq_info, deepcoil_exe, name='deepcoil_input'):
     """run deepcoil and return the ouptut file
     
     Currently the deepcoil script has no argument to specify the filename and automatically takes it
     from the header of the fasta. As it will mangle the name to ensure a valid filename is produced,
     it makes it hard to know what the file will be called. We therefore write out our own fasta file
-    with a set header so we know what the file will be called.
+    with a set header so we know what the file will be called. Concurrent runs need to use different names.
     """
-    name = 'deepcoil_input'
     input_fasta = f'{name}.fasta'
     seq_info.write(input_fasta, 'fasta', description=name)
     cmd = [deepcoil_exe,
            '-i',
            input_fasta]
-    run_cmd(cmd)
+    run_process(cmd)
     out_file = f'{name}.out'
-    if not Path(out_file).exists:
+    if not Path(out_file).exists():
         logger.debug(f"Could not find named deepcoil output file: {out_file}")
     Path(input_fasta).unlink()
     return out_file
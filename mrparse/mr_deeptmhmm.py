@@ -4,10 +4,17 @@ Created on 18 Dec 2020
 @author: hlasimpk
 """
 import logging
-from pyjob import cexec
 import glob
+from pathlib import Path
+import tempfile
+
+try:
+    import biolib
+except ImportError:
+    biolib = None
 
 from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation
+from mrparse.mr_process import run_process
 from mrparse.mr_util import now
 
 TM_alpha = AnnotationSymbol()
@@ -20,13 +27,43 @@ TM_beta.symbol = 'B'
 TM_beta.name = 'TM'
 TM_beta.stype = 'Transmembrane Beta Sheet'
 
+DEEPTMHMM_APP = 'DTU/DeepTMHMM'
+DEEPTMHMM_OUTPUT = 'predicted_topologies.3line'
+
 logger = logging.getLogger(__name__)
 
+_DEEPTMHMM_APP = None
+
+
+def deeptmhmm_app():
+    """Return the handle to the DeepTMHMM application from the biolib python API
+
+    The application is looked up on BioLib the first time it is needed in this process. Jobs started with it
+    still run wherever biolib runs them (on BioLib or in its local container), not in this process.
+    """
+    global _DEEPTMHMM_APP
+    if biolib is None:
+        raise RuntimeError("The pybiolib python package is not installed")
+    if _DEEPTMHMM_APP is None:
+        logger.debug(f"Loading biolib application {DEEPTMHMM_APP}")
+        _DEEPTMHMM_APP = biolib.load(DEEPTMHMM_APP)
+    return _DEEPTMHMM_APP
+
 
 class TMPred(object):
-    def __init__(self, seq_info, deeptmhmm_exe="biolib"):
+    """Class to run transmembrane prediction using DeepTMHMM
+
+    By default DeepTMHMM is run with the deeptmhmm_exe (biolib) command. With use_pybiolib, the job is submitted
+    through the biolib python API instead, so no subprocess is started, all the sequences of a batch go in one
+    job and the results are read from a temporary directory rather than searched for in the working directory.
+    The prediction itself is still run by biolib, not in this process.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, seq_info, deeptmhmm_exe="biolib", use_pybiolib=False):
         self.seq_info = seq_info
         self.deeptmhmm_exe = deeptmhmm_exe
+        self.use_pybiolib = use_pybiolib
         self.prediction = None
 
     @staticmethod
@@ -51,6 +88,63 @@ class TMPred(object):
                 line = fh.readline()
         return prediction
 
+    @staticmethod
+    def parse_deeptmhmm_records(fh):
+        """Parse the topology of each sequence in a DeepTMHMM .3line file
+
+        Yields
+        ------
+        (name, topology) for each sequence
+        """
+        name = None
+        lines = []
+        for line in fh:
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None and len(lines) > 1:
+                    yield name, "".join(lines[1:])
+                name = line[1:].split('|')[0].strip()
+                lines = []
+            elif line:
+                lines.append(line)
+        if name is not None and len(lines) > 1:
+            yield name, "".join(lines[1:])
+
+    def run_pybiolib(self, sequences):
+        """Run DeepTMHMM on all the sequences in a single biolib job and return the topology for each name"""
+        names = list(sequences)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            seqin = Path(tmpdir, 'query.fasta')
+            with open(seqin, 'w') as w:
+                for i, name in enumerate(names):
+                    w.write(f">seq_{i}\n{sequences[name]}\n")
+            job = deeptmhmm_app().cli(args=f'--fasta {seqin}')
+            output_dir = Path(tmpdir, 'output')
+            job.save_files(str(output_dir))
+            output_files = list(output_dir.rglob(DEEPTMHMM_OUTPUT))
+            if not output_files:
+                raise RuntimeError(f"DeepTMHMM did not produce {DEEPTMHMM_OUTPUT}")
+            with open(output_files[0]) as fh:
+                topologies = dict(self.parse_deeptmhmm_records(fh))
+        return {name: topologies[f'seq_{i}'] for i, name in enumerate(names) if f'seq_{i}' in topologies}
+
+    def batch_predictions(self, sequences):
+        """Predict transmembrane regions for several sequences
+
+        Parameters
+        ----------
+        sequences : dict
+           Sequences keyed by name
+
+        Returns
+        -------
+        dict
+           The predicted annotation for each name (sequences without a prediction are missing)
+        """
+        if not self.use_pybiolib:
+            raise RuntimeError("Batch DeepTMHMM predictions are only run through the pybiolib python API")
+        return {name: self.create_annotation(topology) for name, topology in self.run_pybiolib(sequences).items()}
+
     def create_annotation(self, annotation):
         ann = SequenceAnnotation()
         ann.source = 'DeepTMHMM'
@@ -62,11 +156,18 @@ class TMPred(object):
 
     def run_job(self, seqin):
         cmd = [self.deeptmhmm_exe, 'run', 'DTU/DeepTMHMM', '--fasta', seqin]
-        cexec(cmd)
+        run_process(cmd)
         return
 
     def get_prediction(self):
         logger.debug(f"DeepTMHMM starting prediction at: {now()}")
+        if self.use_pybiolib:
+            topologies = self.run_pybiolib({'query': self.seq_info.sequence})
+            if 'query' not in topologies:
+                raise RuntimeError("DeepTMHMM did not return a prediction")
+            self.prediction = self.create_annotation(topologies['query'])
+            logger.debug(f"DeepTMHMM finished prediction at: {now()}")
+            return
         self.prepare_seqin(self.seq_info.sequence_file)
         self.run_job(self.seq_info.sequence_file)
         annotation_file = glob.glob("*/*.3line")[0]
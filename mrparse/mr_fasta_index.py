@@ -0,0 +1,290 @@
+"""
+Created on 19 Oct 2026
+
+An offset index of a FASTA sequence database, giving random access to any sequence by its accession without
+reading the database into memory.
+
+Sequence databases such as the full AlphaFold sequences.fasta (tens of GB) are only streamed through phmmer,
+so without an index any later lookup of a hit sequence means rescanning the file. The index is built once,
+stored next to the database (or in the MrParse cache directory if the database directory is read-only) and
+memory-mapped when it is used. It records, for each sequence, a 64-bit hash of its accession, the byte range
+of the record and the sequence length, sorted by hash so that an accession is found with a binary search of
+the memory-mapped hashes and its sequence read directly from the memory-mapped database.
+
+The accession of a sequence is the first word of its header, without any database prefix such as 'AFDB:',
+e.g. AF-A0A000-F1 for '>AFDB:AF-A0A000-F1 Putative uncharacterized protein' and 101m_A for
+'>101m_A mol:protein length:154  MYOGLOBIN'.
+"""
+import array
+import hashlib
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+
+from mrparse.mr_cache import default_cache_dir
+from mrparse.mr_output import AtomicFile
+
+INDEX_SUFFIX = '.mrpidx.npy'
+INDEX_VERSION = 1
+INDEX_CACHE = 'fasta_index'
+READ_SIZE = 64 * 1024 * 1024
+# Columns of the index array
+HASH, OFFSET, END, LENGTH = range(4)
+
+logger = logging.getLogger(__name__)
+
+
+def accession(header):
+    """Return the accession of a FASTA header line (bytes or str)"""
+    if isinstance(header, bytes):
+        header = header.decode('ascii', errors='replace')
+    words = header.lstrip('>').split(maxsplit=1)
+    if not words:
+        return ''
+    return words[0].split(':', 1)[-1]
+
+
+def accession_hash(key):
+    """Return the 64-bit hash of an accession"""
+    return int.from_bytes(hashlib.blake2b(key.encode('ascii', errors='replace'), digest_size=8).digest(), 'little')
+
+
+def index_paths(fasta, suffix=INDEX_SUFFIX):
+    """Return the possible paths of an index of a FASTA file: next to it, or in the cache directory"""
+    fasta = Path(fasta).resolve()
+    cached = hashlib.sha256(str(fasta).encode()).hexdigest()[:16] + suffix
+    return [fasta.with_name(fasta.name + suffix), default_cache_dir().joinpath(INDEX_CACHE, cached)]
+
+
+def _metadata_path(index_path):
+    return Path(str(index_path)[:-len('.npy')] + '.json')
+
+
+def fasta_metadata(fasta, version=INDEX_VERSION):
+    """Return the properties of a FASTA file that are stored with an index to detect when it is out of date"""
+    stat = os.stat(fasta)
+    return {'version': version, 'fasta': str(Path(fasta).resolve()), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def scan_fasta(fasta, read_size=READ_SIZE):
+    """Yield the (accession, offset, end, length) of each record of a FASTA file
+
+    offset and end are the byte range of the record (including the header) and length the number of residues.
+    The file is read in large blocks and only the headers are decoded, so this runs at close to disk speed.
+    """
+    with open(fasta, 'rb') as fh:
+        position = 0  # File offset of the start of buf
+        buf = b''
+        eof = False
+        while not eof:
+            block = fh.read(read_size)
+            eof = not block
+            buf += block
+            starts = [0] if buf.startswith(b'>') else []
+            i = buf.find(b'\n>')
+            while i != -1:
+                starts.append(i + 1)
+                i = buf.find(b'\n>', i + 1)
+            if not eof:
+                # The last record may continue in the next block
+                if len(starts) < 2:
+                    continue
+                starts, carry = starts[:-1], starts[-1]
+            else:
+                carry = len(buf)
+            starts.append(carry)
+            for start, end in zip(starts[:-1], starts[1:]):
+                header_end = buf.find(b'\n', start, end)
+                if header_end == -1:
+                    header_end = end
+                nbytes = end - header_end
+                length = nbytes - buf.count(b'\n', header_end, end) - buf.count(b'\r', header_end, end)
+                yield accession(buf[start:header_end]), position + start, position + end, length
+            buf = buf[carry:]
+            position += carry
+
+
+class FastaIndex(object):
+    """Random access to the sequences of a FASTA file by accession
+
+    Examples
+    --------
+    >>> index = FastaIndex.open('sequences.fasta')
+    >>> index.sequence('AF-A0A000-F1')
+    'MSKGEELFTGV...'
+    >>> index.validate_range('AF-A0A000-F1', 10, 120)
+    True
+    """
+
+    def __init__(self, fasta, index_path):
+        self.fasta = str(fasta)
+        self.index_path = str(index_path)
+        self._entries = np.load(self.index_path, mmap_mode='r')
+        self._hashes = self._entries[:, HASH]
+        self._fh = None
+        self._mmap = None
+
+    @classmethod
+    def build(cls, fasta, index_path=None):
+        """Index fasta, writing the index to index_path or the first writable location of index_paths"""
+        candidates = [Path(index_path)] if index_path else index_paths(fasta)
+        logger.info(f"Indexing sequence database {fasta}")
+        columns = [array.array('Q') for _ in range(4)]
+        for key, offset, end, length in scan_fasta(fasta):
+            for column, value in zip(columns, (accession_hash(key), offset, end, length)):
+                column.append(value)
+        entries = np.empty((len(columns[0]), 4), dtype=np.uint64, order='F')
+        for i, column in enumerate(columns):
+            entries[:, i] = np.frombuffer(column, dtype=np.uint64) if len(column) else []
+        del columns
+        entries = np.asfortranarray(entries[np.argsort(entries[:, HASH], kind='stable')])
+
+        for path in candidates:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with AtomicFile(path, mode='wb') as w:
+                    np.save(w, entries)
+                with AtomicFile(_metadata_path(path)) as w:
+                    w.write(json.dumps(dict(fasta_metadata(fasta), nsequences=len(entries))))
+            except OSError as e:
+                logger.debug(f"Cannot write sequence database index to {path}: {e}")
+                continue
+            logger.info(f"Indexed {len(entries)} sequences of {fasta} in {path}")
+            return cls(fasta, path)
+        raise RuntimeError(f"Cannot write an index for sequence database: {fasta}")
+
+    @classmethod
+    def load(cls, fasta):
+        """Return the index of fasta, or None if it hasn't been indexed or has changed since it was indexed"""
+        metadata = fasta_metadata(fasta)
+        for path in index_paths(fasta):
+            try:
+                with open(_metadata_path(path)) as fh:
+                    stored = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            if all(stored.get(k) == v for k, v in metadata.items()) and path.exists():
+                return cls(fasta, path)
+            logger.debug(f"Ignoring out of date sequence database index {path}")
+        return None
+
+    @classmethod
+    def open(cls, fasta, build=True):
+        """Return the index of fasta, building it if it doesn't exist (and build is set)"""
+        index = cls.load(fasta)
+        if index is None and build:
+            index = cls.build(fasta)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._fh.close()
+            self._mmap = self._fh = None
+
+    @property
+    def data(self):
+        """The memory-mapped FASTA file"""
+        if self._mmap is None:
+            self._fh = open(self.fasta, 'rb')
+            self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _find(self, key):
+        """Return the row of the index of accession key, or None"""
+        h = np.uint64(accession_hash(key))
+        i = int(np.searchsorted(self._hashes, h))
+        # Check the accession in the file in case different accessions have the same hash
+        while i < len(self._hashes) and self._hashes[i] == h:
+            offset, end = int(self._entries[i, OFFSET]), int(self._entries[i, END])
+            header_end = self.data.find(b'\n', offset, end)
+            if accession(self.data[offset:header_end if header_end != -1 else end]) == key:
+                return i
+            i += 1
+        return None
+
+    def length(self, key):
+        """Return the length of the sequence with accession key, or None if it isn't in the database"""
+        i = self._find(key)
+        return None if i is None else int(self._entries[i, LENGTH])
+
+    def header(self, key):
+        i = self._find(key)
+        if i is None:
+            raise KeyError(key)
+        offset, end = int(self._entries[i, OFFSET]), int(self._entries[i, END])
+        return self.data[offset:end].split(b'\n', 1)[0].rstrip(b'\r').decode('ascii', errors='replace')
+
+    def sequence(self, key, start=None, stop=None):
+        """Return the sequence with accession key, or the residues start to stop (1-based and inclusive)
+
+        Raises
+        ------
+        KeyError
+           If the accession is not in the database
+        """
+        i = self._find(key)
+        if i is None:
+            raise KeyError(key)
+        offset, end = int(self._entries[i, OFFSET]), int(self._entries[i, END])
+        record = self.data[offset:end]
+        sequence = b''.join(record.split(b'\n', 1)[1:]).translate(None, b'\r\n').decode('ascii')
+        if start is not None or stop is not None:
+            sequence = sequence[(start or 1) - 1:stop]
+        return sequence
+
+    def validate_range(self, key, start, stop):
+        """Return True if the residues start to stop (1-based and inclusive) are within the sequence key"""
+        length = self.length(key)
+        return length is not None and 1 <= start <= stop <= length
+
+    def shard_ranges(self, nshards):
+        """Split the database into up to nshards byte ranges of whole records with similar sizes"""
+        offsets = np.sort(self._entries[:, OFFSET])
+        if not len(offsets):
+            return []
+        size = os.path.getsize(self.fasta)
+        first = int(offsets[0])
+        bounds = np.linspace(first, size, nshards + 1)[1:-1]
+        # Move each boundary to the start of the record it falls in
+        cuts = np.unique(offsets[np.searchsorted(offsets, bounds, side='right') - 1])
+        edges = [first] + [int(c) for c in cuts if c > first] + [size]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def write_shard(self, start, end, fpath):
+        """Write the records in the byte range start to end (from shard_ranges) to a new FASTA file"""
+        with AtomicFile(fpath, mode='wb') as w:
+            for i in range(start, end, READ_SIZE):
+                w.write(self.data[i:min(i + READ_SIZE, end)])
+        return fpath
+
+    def write_sequences(self, keys, fpath):
+        """Write the records with the accessions keys to a new FASTA file, returning the number written"""
+        nwritten = 0
+        with AtomicFile(fpath, mode='wb') as w:
+            for key in keys:
+                i = self._find(key)
+                if i is None:
+                    logger.debug(f"Sequence {key} is not in {self.fasta}")
+                    continue
+                record = self.data[int(self._entries[i, OFFSET]):int(self._entries[i, END])]
+                w.write(record if record.endswith(b'\n') else record + b'\n')
+                nwritten += 1
+        return nwritten
@@ -0,0 +1,159 @@
+"""
+Created on 19 Oct 2026
+
+Support for HHsearch searches: staging the ffindex database and streaming the alignments of the .hhr output.
+
+A HHsearch database is a directory of ffindex files (<name>_a3m.ffdata, <name>_a3m.ffindex, <name>_hhm.ffdata ...)
+that HHsearch memory-maps on every run. When $MRPARSE_HHSEARCH_DB_CACHE is set (e.g. to a directory in /dev/shm or
+on local SSD), the database is copied there the first time it is used and the copy is searched by every later run,
+so a batch of MrParse runs or a service running MrParse keeps the database warm instead of reading it from (often
+network) storage each time.
+"""
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+
+from mrparse.mr_timing import span
+
+HHSEARCH_DB_CACHE_ENV = 'MRPARSE_HHSEARCH_DB_CACHE'
+
+logger = logging.getLogger(__name__)
+
+_RE_ALIGNMENT_START = re.compile(r"^No +(\d+)\s*$")
+_RE_ALIGNMENT_SEQ = re.compile(r"^([QT]) (\S+)\s+(\d+) ([A-Za-z-]+)\s+(\d+) \(\d+\)\s*$")
+
+
+class HhrAlignment(object):
+    """An alignment of the query to a template in a .hhr file
+
+    The query and template ranges are 0-based and end exclusive, like those of Bio.SearchIO.
+    """
+
+    __slots__ = ('index', 'hit_id', 'description', 'prob', 'evalue', 'score', 'query_start', 'query_end',
+                 'hit_start', 'hit_end', 'query_seq', 'hit_seq')
+
+    def __init__(self, index, hit_id, description):
+        self.index = index
+        self.hit_id = hit_id
+        self.description = description
+        self.prob = self.evalue = self.score = None
+        self.query_start = self.query_end = self.hit_start = self.hit_end = None
+        self.query_seq = ''
+        self.hit_seq = ''
+
+
+def database_prefix(hhsearch_db):
+    """Return the prefix of the ffindex files of a HHsearch database directory, as given to hhsearch -d
+
+    If $MRPARSE_HHSEARCH_DB_CACHE is set, the database is staged in the cache directory first.
+    """
+    hhsearch_db = Path(hhsearch_db)
+    cache_dir = os.environ.get(HHSEARCH_DB_CACHE_ENV)
+    if cache_dir:
+        try:
+            hhsearch_db = stage_database(hhsearch_db, cache_dir)
+        except OSError as e:
+            logger.warning(f"Cannot copy HHsearch database {hhsearch_db} to {cache_dir}: {e}")
+    return str(hhsearch_db.joinpath(hhsearch_db.stem))
+
+
+def stage_database(hhsearch_db, cache_dir):
+    """Copy the files of a HHsearch database to cache_dir, unless an up to date copy is already there
+
+    Returns
+    -------
+    :obj:`pathlib.Path`
+       The directory of the copy
+    """
+    hhsearch_db = Path(hhsearch_db).resolve()
+    staged = Path(cache_dir).joinpath(hhsearch_db.name)
+    if staged.resolve() == hhsearch_db:
+        return hhsearch_db
+    staged.mkdir(parents=True, exist_ok=True)
+    with span('stage_hhsearch_db'):
+        for source in sorted(hhsearch_db.glob(f"{hhsearch_db.stem}*")):
+            if not source.is_file():
+                continue
+            target = staged.joinpath(source.name)
+            stat = source.stat()
+            if target.exists() and target.stat().st_size == stat.st_size and \
+                    target.stat().st_mtime_ns == stat.st_mtime_ns:
+                continue
+            logger.info(f"Copying {source} to {target}")
+            tmp_target = staged.joinpath(f"{source.name}.{os.getpid()}.tmp")
+            shutil.copy2(source, tmp_target)
+            os.replace(tmp_target, target)
+    return staged
+
+
+def iter_hhr_alignments(fh):
+    """Yield the alignments of a .hhr file in order, reading only as far as the caller iterates
+
+    Parameters
+    ----------
+    fh : file
+       An open .hhr file
+    """
+    alignment = None
+    for line in fh:
+        match = _RE_ALIGNMENT_START.match(line)
+        if match:
+            if alignment is not None:
+                yield alignment
+            header = next(fh, '').rstrip('\n')
+            hit_id, _, description = header.lstrip('>').partition(' ')
+            alignment = HhrAlignment(int(match.group(1)) - 1, hit_id, description.strip().lstrip(';').strip())
+            _parse_scores(next(fh, ''), alignment)
+            continue
+        if alignment is None or not line.startswith(('Q ', 'T ')):
+            continue
+        match = _RE_ALIGNMENT_SEQ.match(line)
+        if not match or match.group(2) in ('Consensus', 'ss_pred', 'ss_dssp', 'ss_conf'):
+            continue
+        seq_type, start, seq, end = match.group(1), int(match.group(3)), match.group(4), int(match.group(5))
+        if seq_type == 'Q':
+            alignment.query_seq += seq
+            if alignment.query_start is None:
+                alignment.query_start = start - 1
+            alignment.query_end = end
+        else:
+            alignment.hit_seq += seq
+            if alignment.hit_start is None:
+                alignment.hit_start = start - 1
+            alignment.hit_end = end
+    if alignment is not None:
+        yield alignment
+
+
+def _parse_scores(line, alignment):
+    """Set the scores of an alignment from a line such as
+    Probab=99.95  E-value=3.7e-34  Score=210.31  Aligned_cols=171  Identities=100%  Similarity=2.050  Sum_probs=166.9
+    """
+    for item in line.split():
+        key, _, value = item.partition('=')
+        attr = {'Probab': 'prob', 'E-value': 'evalue', 'Score': 'score'}.get(key)
+        if attr:
+            try:
+                setattr(alignment, attr, float(value))
+            except ValueError:
+                logger.warning(f"Cannot read {key} from HHsearch alignment {alignment.index + 1}: {line.strip()}")
+
+
+def iter_hhr_hits(fh, max_hits=None):
+    """Yield the (rank, hit score, alignment) of each alignment of a .hhr file
+
+    The rank of a template is the order in which its first alignment appears, and its score is the score of that
+    alignment. Reading stops at the first alignment of template max_hits + 1, so alignments of better ranked
+    templates that come after it are not included.
+    """
+    ranks = {}
+    scores = {}
+    for alignment in iter_hhr_alignments(fh):
+        if alignment.hit_id not in ranks:
+            if max_hits is not None and len(ranks) >= max_hits:
+                return
+            ranks[alignment.hit_id] = len(ranks) + 1
+            scores[alignment.hit_id] = alignment.score
+        yield ranks[alignment.hit_id], scores[alignment.hit_id], alignment
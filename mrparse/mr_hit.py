@@ -3,7 +3,6 @@ Created on 18 Oct 2018
 
 @author: jmht & hlasimpk & rmk65
 """
-from Bio import SearchIO
 from collections import OrderedDict
 import json
 import logging
@@ -11,16 +10,21 @@ import numpy as np
 import os
 from pathlib import Path
 from pyjob.script import EXE_EXT
-import requests
-import uuid
+import shutil
 import time, random
 
-from mrparse.mr_util import run_cmd
-from mrbump.seq_align.simpleSeqID import simpleSeqID
-from mrbump.tools import makeSeqDB
+from mrparse.mr_fasta_index import FastaIndex
+from mrparse.mr_hhsearch import database_prefix, iter_hhr_hits
+from mrparse import mr_hmmer_api
+from mrparse.mr_kmer import prefilter_database
+from mrparse.mr_prefilter import DEFAULT_CANDIDATES, ungapped_prefilter
+from mrparse.mr_seqid import batch_identity
+from mrparse.mr_process import run_process
+from mrparse.mr_timing import span, timed
 
 PHMMER = 'phmmer'
 HHSEARCH = 'hhsearch'
+FASTPREFILTER = 'fastprefilter'
 
 logger = logging.getLogger(__name__)
 
@@ -100,7 +104,8 @@ class SequenceHit:
         return out_str
 
 
-def find_hits(seq_info, search_engine=PHMMER, hhsearch_exe=None, hhsearch_db=None, afdb_seqdb=None, pdb_seqdb=None, phmmer_dblvl=95, use_api=False, max_hits=10, nproc=1):
+def find_hits(seq_info, search_engine=PHMMER, hhsearch_exe=None, hhsearch_db=None, afdb_seqdb=None, pdb_seqdb=None, phmmer_dblvl=95, use_api=False, max_hits=10, nproc=1, prefilter=None,
+              api_search=None, use_cache=True):
     target_sequence = seq_info.sequence
     af2 = False
     dbtype = None
@@ -109,11 +114,12 @@ def find_hits(seq_info, search_engine=PHMMER, hhsearch_exe=None, hhsearch_db=Non
             if phmmer_dblvl == "af2":
                 logger.info("Attempting to run phmmer alphafold database search through EBI API..")
                 try:
-                    json_file = run_phmmer_alphafold_api(seq_info, max_hits=max_hits)
-                    hits = _find_json_hits(json_file, target_sequence=seq_info, max_hits=max_hits)
+                    json_file = run_phmmer_alphafold_api(seq_info, max_hits=max_hits, api_search=api_search,
+                                                         use_cache=use_cache)
+                    hits = _find_json_hits(json_file, target_sequence=target_sequence, max_hits=max_hits)
                     return hits
-                except json.JSONDecodeError:
-                    logger.debug("Phmmer API unavailable, running local phmmer search of AFDB")
+                except mr_hmmer_api.HmmerApiError as e:
+                    logger.warning(f"{e} - running local phmmer search of AFDB")
                     af2 = True
         else:
             if phmmer_dblvl == "af2":
@@ -129,16 +135,55 @@ def find_hits(seq_info, search_engine=PHMMER, hhsearch_exe=None, hhsearch_db=Non
                     logger.info("Database file: %s" % pdb_seqdb)
                 else:
                     logger.info("Using CCP4 pdb sequence file..")
-        logfile, dbtype = run_phmmer(seq_info, afdb_seqdb=afdb_seqdb, pdb_seqdb=pdb_seqdb, dblvl=phmmer_dblvl, nproc=nproc)
+        logfile, dbtype = run_phmmer(seq_info, afdb_seqdb=afdb_seqdb, pdb_seqdb=pdb_seqdb, dblvl=phmmer_dblvl, nproc=nproc,
+                                     prefilter=prefilter)
+        searchio_type = 'hmmer3-text'
+    elif search_engine == FASTPREFILTER:
+        logger.info("Running ungapped prefilter and phmmer search locally..")
+        af2 = phmmer_dblvl == "af2"
+        logfile, dbtype = run_phmmer(seq_info, afdb_seqdb=afdb_seqdb, pdb_seqdb=pdb_seqdb, dblvl=phmmer_dblvl, nproc=nproc,
+                                     prefilter=prefilter or DEFAULT_CANDIDATES, prefilter_method=FASTPREFILTER)
         searchio_type = 'hmmer3-text'
     elif search_engine == HHSEARCH:
         searchio_type = 'hhsuite2-text'
-        logfile = run_hhsearch(seq_info, hhsearch_exe, hhsearch_db)
+        logfile = run_hhsearch(seq_info, hhsearch_exe, hhsearch_db, nproc=nproc, max_hits=max_hits)
     else:
         raise RuntimeError(f"Unrecognised search_engine: {search_engine}")
-    return _find_hits(logfile=logfile, searchio_type=searchio_type, target_sequence=target_sequence, af2=af2, max_hits=max_hits, dbtype=dbtype)
-
-
+    hits = _find_hits(logfile=logfile, searchio_type=searchio_type, target_sequence=target_sequence, af2=af2, max_hits=max_hits, dbtype=dbtype)
+    seqdb = afdb_seqdb if af2 else pdb_seqdb
+    if search_engine in (PHMMER, FASTPREFILTER) and seqdb is not None:
+        hits = validate_hit_ranges(hits, seqdb)
+    return hits
+
+
+def validate_hit_ranges(hits, seqdb):
+    """Remove any hits whose aligned residues lie outside the sequence of the hit in the sequence database
+
+    The sequences are looked up in an existing index of seqdb, built with FastaIndex.build. Indexing a large
+    database takes a long time, so it is not done here and the hits are not checked if there is no index.
+    """
+    try:
+        index = FastaIndex.open(seqdb, build=False)
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.warning(f"Cannot open the index of sequence database {seqdb} to check the hits: {e}")
+        return hits
+    if index is None:
+        logger.debug(f"Not checking the hit ranges as sequence database {seqdb} has not been indexed")
+        return hits
+    with index:
+        for name, hit in list(hits.items()):
+            key = hit.pdb_id if hit.chain_id is None else f"{hit.pdb_id}_{hit.chain_id}"
+            length = index.length(key)
+            if length is None:
+                logger.debug(f"Hit {name} is not in the index of {seqdb}")
+            elif not index.validate_range(key, hit.hit_start, hit.hit_stop):
+                logger.warning(f"Removing hit {name}: residues {hit.hit_start}-{hit.hit_stop} are outside its "
+                               f"sequence of {length} residues in {seqdb}")
+                del hits[name]
+    return hits
+
+
+@timed('parse')
 def _find_hits(logfile=None, searchio_type=None, target_sequence=None, af2=False, max_hits=10, dbtype=None):
     assert logfile and searchio_type and target_sequence
 
@@ -146,22 +191,21 @@ def _find_hits(logfile=None, searchio_type=None, target_sequence=None, af2=False
         #startT=time.time()
         # Read in the header meta data from the PDB ALL database file
         from mrbump.tools import MRBUMP_utils
-        gr = MRBUMP_utils.getPDBres()
-        seqMetaDB=gr.readPDBALL()
+        with span('metadata'):
+            gr = MRBUMP_utils.getPDBres()
+            seqMetaDB=gr.readPDBALL()
         #print("Time to read sequence meta data: %.2lf seconds" % (time.time()-startT))
 
     hitDict = OrderedDict()
     if af2 or searchio_type == "hmmer3-text":
-        if af2:
-            fix_af_phmmer_log(logfile, "phmmer_af2_fixed.log")
-            logfile = "phmmer_af2_fixed.log"
-    
         # Read logfile with searchDB
         from mrparse.searchDB import phmmer  
     
-        plog = open(logfile, "r")
-        phmmerALNLog = plog.readlines()
-        plog.close()
+        with open(logfile, "r") as plog:
+            if af2:
+                phmmerALNLog = list(fix_af_phmmer_lines(plog))
+            else:
+                phmmerALNLog = plog.readlines()
     
         phr=phmmer()
         phr.logfile=logfile
@@ -211,55 +255,55 @@ def _find_hits(logfile=None, searchio_type=None, target_sequence=None, af2=False
                 hitDict[hit_name] = sh
         
     else:
-        try:
-            io = SearchIO.read(logfile, searchio_type)
-        except ValueError:
-            logger.exception("ValueError while running Biopython")
-            raise RuntimeError('Problem running Biopython SearchIO - you may need to update your version of Biopython.')
-        except:
-            logger.exception("Unexpected error while running Biopython")
-            raise
-    
-        included = io.hit_filter(lambda x: x.is_included)
-        for i, hit in enumerate(included):
-            rank = i + 1
-            for hsp in hit.hsps:
+        # Stream the alignments of the .hhr file, stopping at the first alignment of a template beyond max_hits
+        aligned_hits = []
+        with open(logfile) as fh:
+            for rank, score, aln in iter_hhr_hits(fh, max_hits=max_hits):
                 sh = SequenceHit()
                 sh.rank = rank
                 if af2:
-                    sh.pdb_id = hsp.hit_id.split("-")[1]
+                    sh.pdb_id = aln.hit_id.split("-")[1]
                 else:
-                    sh.pdb_id, sh.chain_id = hsp.hit_id.split('_')
-                sh.evalue = hsp.evalue  # is i-Evalue - possibly evalue_cond in later BioPython
-                hstart = hsp.hit_start
-                hstop = hsp.hit_end
-                qstart, qstop = hsp.query_range
-                seq_ali = zip(range(qstart, qstop), hsp.hit.seq)
+                    sh.pdb_id, sh.chain_id = aln.hit_id.split('_')
+                sh.evalue = aln.evalue
+                qstart, qstop = aln.query_start, aln.query_end
+                seq_ali = zip(range(qstart, qstop), aln.hit_seq)
                 sh.seq_ali = [x[0] for x in seq_ali if x[1] != '-']
                 sh.query_start = qstart
                 sh.query_stop = qstop
-                sh.hit_start = hstart
-                sh.hit_stop = hstop
-                target_alignment = "".join(hsp.aln[0].upper())  # assume the first Sequence is always the target
+                sh.hit_start = aln.hit_start
+                sh.hit_stop = aln.hit_end
+                target_alignment = aln.query_seq.upper()
                 sh.target_alignment = target_alignment
-                alignment = "".join(hsp.aln[1].upper())  # assume the first Sequence is always the target
+                alignment = aln.hit_seq.upper()
                 sh.alignment = alignment
-                local, overall = simpleSeqID().getPercent(alignment, target_alignment, target_sequence)
-                sh.local_sequence_identity = np.round(local)
-                sh.overall_sequence_identity = np.round(overall)
-    
-                sh.score = hit.score
-                hit_name = hit.id + "_" + str(hsp.output_index)
+
+                sh.score = score
+                hit_name = aln.hit_id + "_" + str(aln.index)
                 sh.search_engine = "hhsearch"
                 sh.name = hit_name
-                if sh.rank <= max_hits:
-                    hitDict[hit_name] = sh
+                hitDict[hit_name] = sh
+                aligned_hits.append((sh, alignment, target_alignment))
+        _set_sequence_identities(aligned_hits, target_sequence)
 
     return hitDict
 
 
+def _set_sequence_identities(aligned_hits, target_sequence):
+    """Set the sequence identities of a list of (hit, alignment, target_alignment) tuples in one batch"""
+    if not aligned_hits:
+        return
+    hits, alignments, target_alignments = zip(*aligned_hits)
+    local, overall = batch_identity(alignments, target_alignments, target_sequence)
+    for sh, l, o in zip(hits, local, overall):
+        sh.local_sequence_identity = np.round(l)
+        sh.overall_sequence_identity = np.round(o)
+
+
+@timed('parse')
 def _find_json_hits(json_file, target_sequence, max_hits=10):
     hitDict = OrderedDict()
+    aligned_hits = []
     with open(json_file, 'r') as f_in:
         data = json.load(f_in)
         for i, hit in enumerate(data['results']['hits']):
@@ -282,9 +326,6 @@ def _find_json_hits(json_file, target_sequence, max_hits=10):
                 target_alignment = alignment_info['alimodel'].upper()
                 sh.target_alignment = alignment
                 sh.alignment = target_alignment
-                local, overall = simpleSeqID().getPercent(alignment, target_alignment, target_sequence)
-                sh.local_sequence_identity = np.round(local)
-                sh.overall_sequence_identity = np.round(overall)
 
                 sh.score = hit['score']
                 hit_name = hit['name'].split("_")[0] + "_" + str(hit['ndom'])
@@ -292,26 +333,32 @@ def _find_json_hits(json_file, target_sequence, max_hits=10):
                 sh.search_engine = "phmmer"
                 if sh.rank <= max_hits:
                     hitDict[hit_name] = sh
+                    aligned_hits.append((sh, alignment, target_alignment))
             except Exception:
                 logger.debug(f"Issue with target {hit['name']}")
+    _set_sequence_identities(aligned_hits, target_sequence)
     return hitDict
 
 
-def fix_af_phmmer_log(input_log, output_log):
-    """Function to fix locally run alphafold phmmer results when there are duplicate entries"""
-    last_entry = ""
-    with open(output_log, 'w') as f_out:
-        with open(input_log, 'r') as f_in:
-            line = f_in.readline()
-            while line:
-                if "AFDB release_date" in line:
-                    entry = line.split()[8]
-                    if entry != last_entry:
-                        last_entry = entry
-                    else:
-                        line = line.replace(entry, f"{entry}_{uuid.uuid4()}")
-                f_out.write(line)
-                line = f_in.readline()
+def fix_af_phmmer_lines(lines):
+    """Yield the lines of a locally run alphafold phmmer log, renaming consecutive duplicate entries
+
+    Repeats of an entry are renamed <entry>_2, <entry>_3 ... so the parser doesn't merge them into one hit and the
+    names are the same every time the log is read.
+    """
+    last_entry = None
+    repeats = 0
+    for line in lines:
+        if "AFDB release_date" in line:
+            fields = line.split()
+            entry = fields[8] if len(fields) > 8 else None
+            if entry is not None and entry == last_entry:
+                repeats += 1
+                line = line.replace(entry, f"{entry}_{repeats + 1}", 1)
+            else:
+                last_entry = entry
+                repeats = 0
+        yield line
 
 
 def sort_hits_by_size(hits, ascending=False):
@@ -319,7 +366,15 @@ def sort_hits_by_size(hits, ascending=False):
     return OrderedDict(sorted(hits.items(), key=lambda x: x[1].length, reverse=reverse))
 
 
-def run_phmmer(seq_info, afdb_seqdb=None, pdb_seqdb=None, dblvl=95, nproc=1):
+@timed('search', engine='phmmer')
+def run_phmmer(seq_info, afdb_seqdb=None, pdb_seqdb=None, dblvl=95, nproc=1, prefilter=None, prefilter_method=None):
+    """Run phmmer against a sequence database
+
+    If prefilter is set, the AlphaFold database search is limited to the prefilter sequences that share the most
+    k-mers with the target sequence (see mr_kmer), with the E-values calculated for the size of the full database.
+    If prefilter_method is FASTPREFILTER, the search of any database is limited to the prefilter sequences with the
+    best ungapped alignments to the target sequence (see mr_prefilter).
+    """
     logfile = f"phmmer_{dblvl}.log"
     alnfile = f"phmmerAlignment_{dblvl}.log"
     phmmerTblout = f"phmmerTblout_{dblvl}.log"
@@ -335,6 +390,7 @@ def run_phmmer(seq_info, afdb_seqdb=None, pdb_seqdb=None, dblvl=95, nproc=1):
             seqdb = Path(os.environ["CCP4"], "share", "mrbump", "data", "afdb.fasta")
             dbtype= "AFCCP4"
     else:
+        from mrbump.tools import makeSeqDB
         sb = makeSeqDB.sequenceDatabase()
         if pdb_seqdb is not None:
             seq_protein_file=Path(os.environ["CCP4_SCR"], "pdb_seqres_protein_%s.txt" % random.randint(0, 9999999)) 
@@ -351,31 +407,43 @@ def run_phmmer(seq_info, afdb_seqdb=None, pdb_seqdb=None, dblvl=95, nproc=1):
             dbtype= "PDBCCP4"
             delete_db = True
 
+    dbsize = []
+    if prefilter and (prefilter_method == FASTPREFILTER or dblvl == "af2"):
+        candidates_db = Path(f"prefilter_{dblvl}.fasta")
+        if prefilter_method == FASTPREFILTER:
+            # There's no point keeping a packed copy of a sequence file that is only used for this search
+            nsequences = ungapped_prefilter(seq_info.sequence, seqdb, candidates_db, ncandidates=prefilter, nproc=nproc,
+                                            cache=not delete_db)
+        else:
+            nsequences = prefilter_database(seq_info.sequence, seqdb, prefilter, candidates_db)
+        if delete_db:
+            seqdb.unlink()
+        seqdb, delete_db = candidates_db, True
+        dbsize = ['-Z', str(nsequences)]
+
     if afdb_seqdb is not None and dblvl == "af2":
         cmd = [str(phmmerEXE) + EXE_EXT,
+           '-o', logfile,
            '--notextw',
            '--tblout', phmmerTblout,
            '--domtblout', phmmerDomTblout,
            '--F1', '1e-15',
            '--F2', '1e-15',
            '--cpu', str(nproc),
-           '-A', alnfile,
+           '-A', alnfile] + dbsize + [
            str(seq_info.sequence_file), str(seqdb)]
     else:
         cmd = [str(phmmerEXE) + EXE_EXT,
+           '-o', logfile,
            '--notextw',
            '--tblout', phmmerTblout,
            '--domtblout', phmmerDomTblout,
            '--cpu', str(nproc),
-           '-A', alnfile,
+           '-A', alnfile] + dbsize + [
            str(seq_info.sequence_file), str(seqdb)]
-    stdout = run_cmd(cmd)
+    run_process(cmd)
     if os.name == 'nt':
-        lines = stdout.split('\n')
-        lines[0] = "# phmmer :: search a protein sequence against a protein database"
-        stdout = "\n".join(lines)
-    with open(logfile, 'w') as f_out:
-        f_out.write(stdout)
+        fix_phmmer_log_header(logfile)
 
     if delete_db:
         seqdb.unlink()
@@ -383,41 +451,42 @@ def run_phmmer(seq_info, afdb_seqdb=None, pdb_seqdb=None, dblvl=95, nproc=1):
     return logfile, dbtype
 
 
-def run_hhsearch(seq_info, hhsearch_exe, hhsearch_db):
+def fix_phmmer_log_header(logfile):
+    """Replace the first line of a phmmer log, which contains the Windows path to the executable"""
+    tmpfile = f"{logfile}.tmp"
+    with open(logfile) as fh, open(tmpfile, 'w') as w:
+        fh.readline()
+        w.write("# phmmer :: search a protein sequence against a protein database\n")
+        shutil.copyfileobj(fh, w)
+    os.replace(tmpfile, logfile)
+
+
+@timed('search', engine='hhsearch')
+def run_hhsearch(seq_info, hhsearch_exe, hhsearch_db, nproc=1, max_hits=10):
+    """Run hhsearch, only writing the max_hits best hits and their alignments to the log"""
     logfile = "hhsearch.log"
-    hhsearch_db = Path(hhsearch_db)
     cmd = [hhsearch_exe,
            '-i', seq_info.sequence_file,
-           '-d', str(hhsearch_db.joinpath(hhsearch_db.stem)),
-           '-o', logfile]
-    run_cmd(cmd)
+           '-d', database_prefix(hhsearch_db),
+           '-o', logfile,
+           '-cpu', str(nproc),
+           '-Z', str(max_hits),
+           '-B', str(max_hits)]
+    run_process(cmd)
     return logfile
 
 
-        #'seqdb': 'alphafold',
-def run_phmmer_alphafold_api(seq_info, max_hits=10):
-    params = {
-        'seqdb': 'uniprotkb',
-        'seq': f'>Seq\n{seq_info.sequence}'
-    }
-
-    # post the seqrch request to the server
-    results_url = requests.post(url='https://www.ebi.ac.uk/Tools/hmmer/search/phmmer', data=params).url
-
-    # modify the range, format and presence of alignments in your results here
-    res_params = {
-        'output': 'json',
-        'range': '1,%d' % max_hits
-    }
+def run_phmmer_alphafold_api(seq_info, max_hits=10, api_search=None, use_cache=True):
+    """Search the AlphaFold database with the EBI HMMER API and write the results to phmmer_afdb.json
 
-    # send a GET request to the server
-    data = requests.get(results_url, params=res_params)
-
-    logfile = "phmmer_afdb.json"
-    with open(logfile, 'w') as f_out:
-        f_out.write(data.text)
+    api_search is the future of a search already started with mr_hmmer_api.start_search, if there is one.
+    """
+    if api_search is not None:
+        data = api_search.result()
+    else:
+        data = mr_hmmer_api.search(seq_info.sequence, max_hits=max_hits, use_cache=use_cache)
+    return mr_hmmer_api.write_results(data)
 
-    return logfile
 
 def get_seqres_protein(pdbseqfile, outfile):
     """ extract the protein sequences from the full pdb_seqres.txt file """
@@ -12,27 +12,79 @@ from mmtbx.scaling.matthews import matthews_rupp
 from mrbump.ccp4.MRBUMP_ctruncate import Ctruncate
 from simbad.parsers import mtz_parser
 
+from mrparse.mr_cache import DiskCache, file_hash
+from mrparse.mr_output import write_progress
+from mrparse.mr_pathology import PathologyStatistics
+from mrparse.mr_timing import span
+
+HKL_CACHE = 'hkl_info'
+MTZ_COLUMNS = ['f', 'sigf', 'i', 'sigi', 'f_plus', 'sigf_plus', 'f_minus', 'sigf_minus',
+               'i_plus', 'sigi_plus', 'i_minus', 'sigi_minus', 'free']
+PATHOLOGIES = ['has_ncs', 'has_twinning', 'has_anisotropy']
+PATHOLOGY_METHODS = ['ctruncate', 'native']
+
 logger = logging.getLogger(__name__)
 
 
+class MtzColumns(object):
+    """The column labels selected from an MTZ file, used in place of the MtzParser when read from the cache"""
+
+    def __init__(self, **labels):
+        for label in MTZ_COLUMNS:
+            setattr(self, label, labels.get(label))
+
+    @classmethod
+    def from_parser(cls, mtz_obj):
+        return cls(**{label: getattr(mtz_obj, label, None) for label in MTZ_COLUMNS})
+
+    def as_dict(self):
+        return {label: getattr(self, label) for label in MTZ_COLUMNS}
+
+    def selection(self):
+        """Return a string identifying the selected columns"""
+        return ','.join(f"{label}={getattr(self, label)}" for label in MTZ_COLUMNS if getattr(self, label))
+
+
 class HklInfo(object):
-    def __init__(self, hklin, seq_info=None):
+    """Information about a reflection data file
+
+    The results of parsing the MTZ file and checking the crystal pathologies depend only on its contents, so
+    unless use_cache is False they are stored in the HKL_CACHE keyed by a hash of the file, with the pathologies
+    stored under the method and selection of columns they were calculated from. Only the sequence-dependent
+    Matthews calculation is repeated when the same file is analysed again.
+
+    The pathologies are checked with ctruncate, or in-process with mr_pathology if pathology_method is 'native'.
+    """
+
+    CACHE_VERSION = 1
+
+    def __init__(self, hklin, seq_info=None, results_writer=None, use_cache=True, pathology_method='ctruncate'):
+        if pathology_method not in PATHOLOGY_METHODS:
+            raise RuntimeError(f"Unknown pathology method {pathology_method} - must be one of {PATHOLOGY_METHODS}")
         self.hklin = hklin
+        self.pathology_method = pathology_method
+        self.pathology_statistics = None
         self.seq_info = seq_info
+        self.results_writer = results_writer
+        self.use_cache = use_cache
         if not Path(hklin).exists():
             raise RuntimeError(f"Cannot find hklin file: {hklin}")
         self.name = Path(hklin).stem
-        self.input_mtz_obj = mtz_parser.MtzParser(hklin)
-        self.input_mtz_obj.parse()
-        self.space_group = self.input_mtz_obj.spacegroup_symbol
-        self.resolution = self.input_mtz_obj.resolution
-        self.cell_parameters = self.input_mtz_obj.cell.parameters
         self.predicted_solvent_content = None
         self.predicted_ncopies = None
         self.molecular_weight = None
         self.has_ncs = False
         self.has_twinning = False
         self.has_anisotropy = False
+        self.pathologies_checked = False
+        self.cache_key = DiskCache.key(file_hash(hklin), self.CACHE_VERSION) if use_cache else None
+        if not self.load_cached_analysis():
+            self.input_mtz_obj = mtz_parser.MtzParser(hklin)
+            self.input_mtz_obj.parse()
+            self.space_group = self.input_mtz_obj.spacegroup_symbol
+            self.resolution = self.input_mtz_obj.resolution
+            self.cell_parameters = self.input_mtz_obj.cell.parameters
+            self.cache_analysis()
         if self.seq_info:
             self.molecular_weight = self.seq_info.molecular_weight
             self.calculate_matthews_probabilties()
@@ -42,9 +94,65 @@ class HklInfo(object):
         to the pool and instance methods don't work, so we add the object to the pool and define __call__
         https://stackoverflow.com/questions/1816958/cant-pickle-type-instancemethod-when-using-multiprocessing-pool-map/6975654#6975654
         """
-        self.check_pathologies()
+        if self.pathologies_checked:
+            logger.info(f"Using cached crystal pathologies for {self.hklin}")
+        else:
+            with span('pathology', method=self.pathology_method):
+                self.check_pathologies()
+            self.cache_analysis()
+        if self.results_writer:
+            write_progress(self.results_writer.write_hkl_info, self)
         return self
 
+    @property
+    def cache(self):
+        return DiskCache(HKL_CACHE) if self.use_cache else None
+
+    def load_cached_analysis(self):
+        """Set the MTZ metadata and any pathologies from the cache, returning True if they were found"""
+        cache = self.cache
+        if cache is None:
+            return False
+        cached = cache.get(self.cache_key)
+        if cached is None:
+            return False
+        try:
+            self.input_mtz_obj = MtzColumns(**cached['columns'])
+            self.space_group = cached['space_group']
+            self.resolution = float(cached['resolution'])
+            self.cell_parameters = tuple(cached['cell_parameters'])
+            pathologies = cached.get('pathologies', {}).get(self.pathology_cache_key(self.input_mtz_obj))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.debug(f"Ignoring invalid cached HKL analysis for {self.hklin}: {e}")
+            return False
+        if pathologies:
+            for attr in PATHOLOGIES:
+                setattr(self, attr, bool(pathologies[attr]))
+            self.pathologies_checked = True
+        logger.debug(f"Using cached HKL analysis for {self.hklin}")
+        return True
+
+    def cache_analysis(self):
+        cache = self.cache
+        if cache is None:
+            return
+        columns = MtzColumns.from_parser(self.input_mtz_obj)
+        entry = cache.get(self.cache_key) or {}
+        entry.update(columns=columns.as_dict(),
+                     space_group=self.space_group,
+                     resolution=self.resolution,
+                     cell_parameters=list(self.cell_parameters))
+        if self.pathologies_checked:
+            entry.setdefault('pathologies', {})[self.pathology_cache_key(columns)] = {attr: getattr(self, attr)
+                                                                                      for attr in PATHOLOGIES}
+        try:
+            cache.set(self.cache_key, entry)
+        except Exception as e:
+            logger.warning(f"Could not cache HKL analysis for {self.hklin}: {e}")
+
+    def pathology_cache_key(self, columns):
+        return f"{self.pathology_method}:{columns.selection()}"
+
     def calculate_matthews_probabilties(self):
         crystal_symmetry = symmetry(unit_cell=self.cell_parameters, space_group_symbol=self.space_group)
         result = matthews_rupp(crystal_symmetry, n_residues=self.seq_info.nresidues)
@@ -53,6 +161,8 @@ class HklInfo(object):
 
     def check_pathologies(self):
         """Function to check crystal pathologies"""
+        if self.pathology_method == 'native':
+            return self.check_pathologies_native()
         hklin = self.hklin
         hklout = filename_append(filename=hklin, directory=Path.cwd(), astr='fixcols')
         ctr_colin = None
@@ -108,9 +218,20 @@ class HklInfo(object):
         self.has_ncs = ctr.NCS
         self.has_twinning = ctr.TWIN
         self.has_anisotropy = ctr.ANISO
+        self.pathologies_checked = True
         Path(hklout).unlink()
         return
 
+    def check_pathologies_native(self):
+        """Check crystal pathologies in-process without writing an output MTZ file"""
+        stats = PathologyStatistics.from_mtz(self.hklin, self.input_mtz_obj)
+        logger.debug(f"Crystal pathology statistics for {self.hklin}:\n{stats}")
+        self.pathology_statistics = stats
+        self.has_ncs = stats.has_ncs
+        self.has_twinning = stats.has_twinning
+        self.has_anisotropy = stats.has_anisotropy
+        self.pathologies_checked = True
+
     def as_dict(self):
         attrs = ['hklin', 'name', 'space_group', 'resolution', 'cell_parameters', 'has_ncs', 'has_twinning',
                  'has_anisotropy']
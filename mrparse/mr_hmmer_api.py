@@ -0,0 +1,141 @@
+"""
+Created on 19 Oct 2026
+
+Client for the EBI HMMER web API (https://www.ebi.ac.uk/Tools/hmmer), used for phmmer searches of the AlphaFold
+database when --use_api is set.
+
+A search is submitted without waiting for it to finish and its results URL polled with mr_poll, so the search can run
+in a background thread (see start_search) while the local PDB search is running. The results are cached by the hash of
+the sequence, the database and the number of hits, so repeated runs on the same sequence don't resubmit the search.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from mrparse.mr_cache import DiskCache, sequence_hash
+from mrparse.mr_poll import Backoff, Deadline, wait_for_job, FAILED, FINISHED, RUNNING
+from mrparse.mr_timing import add_bytes_downloaded, span
+
+HMMER_API_URL = 'https://www.ebi.ac.uk/Tools/hmmer'
+HMMER_SEQDB = 'uniprotkb'
+HMMER_REQUEST_TIMEOUT = 60  # seconds
+HMMER_MAX_RUNTIME = 30 * 60  # seconds
+HMMER_API_CACHE = 'hmmer_api'
+HMMER_API_LOGFILE = 'phmmer_afdb.json'
+CACHE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+class HmmerApiError(RuntimeError):
+    pass
+
+
+def hmmer_session(retries=3, pool_size=4):
+    """Return a requests session that reuses connections and retries requests that fail transiently"""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept'] = 'application/json'
+    return session
+
+
+class HmmerApiClient(object):
+    """Submit phmmer searches to the HMMER web API and fetch their results"""
+
+    def __init__(self, url=HMMER_API_URL, timeout=HMMER_REQUEST_TIMEOUT, session=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = session or hmmer_session()
+
+    def submit(self, sequence, seqdb=HMMER_SEQDB):
+        """Submit a phmmer search of sequence and return the URL of its results"""
+        params = {'seqdb': seqdb, 'seq': f'>Seq\n{sequence}'}
+        response = self.session.post(f'{self.url}/search/phmmer', data=params, timeout=self.timeout,
+                                     allow_redirects=False)
+        response.raise_for_status()
+        # The server redirects to the results page, which may not be ready yet
+        location = response.headers.get('Location')
+        return urljoin(response.url, location) if location else response.url
+
+    def results(self, results_url, max_hits=10):
+        """Return the (state, results) of a search, where results are the parsed JSON once it has finished"""
+        response = self.session.get(results_url, params={'output': 'json', 'range': f'1,{max_hits}'},
+                                    timeout=self.timeout)
+        if 400 <= response.status_code < 500:
+            return FAILED, f"HTTP {response.status_code}: {response.text[:200]}"
+        response.raise_for_status()
+        if response.status_code == 202:
+            return RUNNING, None
+        try:
+            data = response.json()
+        except ValueError:
+            # The results page is returned before the search has finished
+            return RUNNING, None
+        if 'results' not in data:
+            return RUNNING, None
+        add_bytes_downloaded(len(response.content))
+        return FINISHED, data
+
+
+def search(sequence, max_hits=10, seqdb=HMMER_SEQDB, client=None, use_cache=True, deadline=None, backoff=None,
+           cancel=None):
+    """Run a phmmer search with the HMMER API and return its results, from the cache if they're there
+
+    Raises
+    ------
+    HmmerApiError
+       If the search could not be run
+    """
+    cache = DiskCache(HMMER_API_CACHE) if use_cache else None
+    key = DiskCache.key(sequence_hash(sequence), seqdb, max_hits, CACHE_VERSION)
+    if cache is not None:
+        data = cache.get(key)
+        if data is not None:
+            logger.info("Using cached HMMER API search results")
+            return data
+
+    client = client or HmmerApiClient()
+    with span('search', engine='phmmer_api'):
+        try:
+            results_url = client.submit(sequence, seqdb=seqdb)
+            logger.debug(f"HMMER API search submitted: {results_url}")
+            data = wait_for_job(lambda: client.results(results_url, max_hits=max_hits),
+                                backoff=backoff or Backoff(initial=2.0, maximum=30.0),
+                                deadline=deadline or Deadline(HMMER_MAX_RUNTIME), cancel=cancel,
+                                description='HMMER API search')
+        except (requests.RequestException, RuntimeError) as e:
+            raise HmmerApiError(f"HMMER API search failed: {e}") from e
+
+    if cache is not None:
+        try:
+            cache.set(key, data)
+        except OSError as e:
+            logger.warning(f"Could not cache HMMER API search results: {e}")
+    return data
+
+
+def write_results(data, logfile=HMMER_API_LOGFILE):
+    with open(logfile, 'w') as w:
+        json.dump(data, w)
+    return logfile
+
+
+def start_search(sequence, max_hits=10, **kwargs):
+    """Start a search in a background thread and return a :obj:`concurrent.futures.Future` of its results
+
+    See search for the arguments.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hmmer_api')
+    future = executor.submit(search, sequence, max_hits=max_hits, **kwargs)
+    # The thread carries on with the search; this only stops the executor accepting any more work
+    executor.shutdown(wait=False)
+    return future
@@ -4,14 +4,18 @@ Created on 18 Oct 2018
 @author: jmht
 """
 from collections import OrderedDict
-import copy
+from concurrent.futures import ProcessPoolExecutor
 import logging
+import multiprocessing
 import os, sys
 import gzip
 import shutil
 from pathlib import Path
 from simbad.util.pdb_util import PdbStructure
 
+from mrparse.mr_timing import add_bytes_downloaded, span, timed
+from mrparse.mr_util import static_properties
+
 
 class PdbModelException(Exception):
     pass
@@ -24,6 +28,7 @@ HOMOLOGS_DIR = Path('homologs')
 logger = logging.getLogger(__name__)
 
 
+@static_properties
 class HomologData(object):
     OBJECT_ATTRIBUTES = ['hit', 'region']
 
@@ -93,30 +98,17 @@ class HomologData(object):
     @property
     def static_dict(self):
         """Return a self representation with all properties resolved, suitable for JSON"""
-        d = copy.copy(self.__dict__)
-        for k in self.__dict__.keys():
-            if k in self.OBJECT_ATTRIBUTES:
-                d.pop(k)
-        # Get all properties
-        for name in dir(self.__class__):
-            obj = getattr(self.__class__, name)
-            if name == 'static_dict':
-                # Skip this property to avoid infinite recursion
-                continue
-            if isinstance(obj, property):
-                val = obj.__get__(self, self.__class__)
-                d[name] = val
+        d = {k: v for k, v in self.__dict__.items() if k not in self.OBJECT_ATTRIBUTES}
+        # STATIC_PROPERTIES is set once for the class by the static_properties decorator
+        for name, fget in self.STATIC_PROPERTIES:
+            d[name] = fget(self)
         # Need to add in properties as these aren't included
         # FIX ONCE UPDATED JS TO HANDLE TWO INTS
         d['range'] = "{}-{}".format(*self.range)
         return d
 
     def _get_child_attr(self, child, attr):
-        if hasattr(self, child):
-            child = getattr(self, child)
-            if hasattr(child, attr):
-                return getattr(child, attr)
-        return None
+        return getattr(getattr(self, child, None), attr, None)
 
     def __str__(self):
         attrs = [k for k in self.__dict__.keys() if not k.startswith('_')]
@@ -144,6 +136,7 @@ def homologs_from_hits(hits, pdb_dir=None, pdb_local=None):
     return homologs
 
 
+@timed('prepare_homolog')
 def prepare_pdb(hit, pdb_dir, pdb_local):
     """
     Download pdb or take file from cache or local PDB mirror
@@ -185,12 +178,15 @@ def prepare_pdb(hit, pdb_dir, pdb_local):
     if pdb_file.exists():
         pdb_struct = pdb_struct.from_file(str(pdb_file))
     else:
-        try:
-            pdb_struct = pdb_struct.from_pdb_code(hit.pdb_id)
-        except RuntimeError:
-            # SIMBAD currently raises an empty RuntimeError for download problems.
-            raise PdbModelException(f"Error downloading PDB file for: {hit.pdb_id}")
-        pdb_struct.save(pdb_file)
+        with span('download', source='pdb'):
+            try:
+                pdb_struct = pdb_struct.from_pdb_code(hit.pdb_id)
+            except RuntimeError:
+                # SIMBAD currently raises an empty RuntimeError for download problems.
+                raise PdbModelException(f"Error downloading PDB file for: {hit.pdb_id}")
+            pdb_struct.save(pdb_file)
+            # SIMBAD doesn't expose the downloaded data so use the size of the saved file
+            add_bytes_downloaded(pdb_file.stat().st_size)
 
     resolution = pdb_struct.structure.resolution
 
@@ -217,81 +213,171 @@ def prepare_pdb(hit, pdb_dir, pdb_local):
     return str(truncated_pdb_path), int(round(pdb_struct.molecular_weight)), resolution
 
 
-def calculate_ellg(homologs, hkl_info):
-    """Run PHASER to calculate the eLLG values and update the homolog data
-    
-    Sourced from: ccp4-src-2016-02-10/checkout/cctbx-phaser-dials-2015-12-22/phaser/phaser/CalcCCFromMRsolutions.py"""
+def mr_dat_labels(hkl_info):
+    """Return the type of the data columns to give to PHASER and their labels"""
+    mtz = hkl_info.input_mtz_obj
+    if mtz.i and mtz.sigi:
+        return 'I', (mtz.i, mtz.sigi)
+    elif mtz.f and mtz.sigf:
+        return 'F', (mtz.f, mtz.sigf)
+    msg = "No flags for intensities or amplitudes have been provided"
+    raise RuntimeError(msg)
 
-    if not (hkl_info.molecular_weight and hkl_info.predicted_ncopies):
-        raise RuntimeError("Cannot calculate eLLGs without molecular_weight and predicted ncopies")
+
+def run_mr_dat(hklin, labels):
+    """Run PHASER MR_DAT to read the reflection data from an MTZ file
+
+    Parameters
+    ----------
+    hklin : str
+       The MTZ file
+    labels : tuple
+       The (type, (column labels)) tuple returned by mr_dat_labels
+
+    Returns
+    -------
+    (space group Hall symbol, unit cell, reflection data)
+    """
+    label_type, columns = labels
     import phaser
     mrinput = phaser.InputMR_DAT()
-    mrinput.setHKLI(hkl_info.hklin)
+    mrinput.setHKLI(hklin)
     mrinput.setMUTE(True)
-    if hkl_info.input_mtz_obj.i and hkl_info.input_mtz_obj.sigi:
-        mrinput.setLABI_I_SIGI(hkl_info.input_mtz_obj.i, hkl_info.input_mtz_obj.sigi)
-    elif hkl_info.input_mtz_obj.f and hkl_info.input_mtz_obj.sigf:
-        mrinput.setLABI_F_SIGF(hkl_info.input_mtz_obj.f, hkl_info.input_mtz_obj.sigf)
+    if label_type == 'I':
+        mrinput.setLABI_I_SIGI(*columns)
     else:
-        msg = "No flags for intensities or amplitudes have been provided"
-        raise RuntimeError(msg)
-
+        mrinput.setLABI_F_SIGF(*columns)
     datrun = phaser.runMR_DAT(mrinput)
     if not datrun.Success():
         raise RuntimeError("Failed to initialise PHASER input.")
+    return datrun.getSpaceGroupHall(), datrun.getUnitCell(), datrun.getDATA()
+
+
+@timed('phaser_ellg')
+def run_mr_ellg(hklin, labels, molecular_weight, ncopies, ensembles):
+    """Run PHASER MR_ELLG for a list of (name, pdb_file, seq_ident) ensembles and return the parsed eLLG data
+
+    This is run in worker processes, so only takes and returns picklable data.
+    """
+    import phaser
+    spacegroup, cell, data = run_mr_dat(hklin, labels)
     ellginput = phaser.InputMR_ELLG()
-    ellginput.setSPAC_HALL(datrun.getSpaceGroupHall())
-    ellginput.setCELL6(datrun.getUnitCell())
-    ellginput.setREFL_DATA(datrun.getDATA())
+    ellginput.setSPAC_HALL(spacegroup)
+    ellginput.setCELL6(cell)
+    ellginput.setREFL_DATA(data)
     ellginput.setMUTE(True)
 
     # Should calculate MW without the search model so that the total MW will be correct when we add the search model
-    ellginput.addCOMP_PROT_MW_NUM(hkl_info.molecular_weight, hkl_info.predicted_ncopies)
-    search_models = []
+    ellginput.addCOMP_PROT_MW_NUM(molecular_weight, ncopies)
+    for name, pdb_file, seq_ident in ensembles:
+        ellginput.addENSE_PDB_ID(name, pdb_file, seq_ident)
+    ellginput.addSEAR_ENSE_OR_ENSE_NUM([e[0] for e in ensembles], 1)
+    runellg = phaser.runMR_ELLG(ellginput)
+    return parse_ellg_summary(runellg.summary().splitlines())
+
+
+@timed('ellg')
+def calculate_ellg(homologs, hkl_info, nproc=1):
+    """Run PHASER to calculate the eLLG values and update the homolog data
+
+    The eLLG of each ensemble is independent of the others, so the ensembles are split between up to nproc
+    worker processes. Processes cannot be started from a daemonic process (such as a multiprocessing.Pool
+    worker), in which case the ensembles are run serially, so when MrParse runs its stages in a pool with nproc > 1
+    the SearchModelFinder leaves the eLLGs to be calculated in the main process as soon as it has finished.
+
+    Sourced from: ccp4-src-2016-02-10/checkout/cctbx-phaser-dials-2015-12-22/phaser/phaser/CalcCCFromMRsolutions.py"""
+
+    if not (hkl_info.molecular_weight and hkl_info.predicted_ncopies):
+        raise RuntimeError("Cannot calculate eLLGs without molecular_weight and predicted ncopies")
+    labels = mr_dat_labels(hkl_info)
+    ensembles = []
     for hname, d in homologs.items():
         if d.pdb_file and d.seq_ident:
-            ellginput.addENSE_PDB_ID(hname, d.pdb_file, d.seq_ident)
-            search_models.append(hname)
+            ensembles.append((hname, d.pdb_file, d.seq_ident))
         else:
             d.ellg = -1  # Set to -1 so that sorting works properly
             logger.warning(f"Cannot calculate eLLG for homolog {hname} due to missing data.")
-    ellginput.addSEAR_ENSE_OR_ENSE_NUM(search_models, 1)
-    runellg = phaser.runMR_ELLG(ellginput)
+    if not ensembles:
+        return homologs
+
+    args = (hkl_info.hklin, labels, hkl_info.molecular_weight, hkl_info.predicted_ncopies)
+    nworkers = min(nproc or 1, len(ensembles))
+    if nworkers > 1 and multiprocessing.current_process().daemon:
+        logger.debug("Calculating eLLGs serially as processes cannot be started from a daemonic process")
+        nworkers = 1
+    if nworkers > 1:
+        chunks = [ensembles[i::nworkers] for i in range(nworkers)]
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = [executor.submit(run_mr_ellg, *args, chunk) for chunk in chunks]
+            results = [f.result() for f in futures]
+    else:
+        results = [run_mr_ellg(*args, ensembles)]
+    return apply_ellg_results(homologs, [e[0] for e in ensembles], results)
 
-    phaser_log = 'phaser1.log'
-    with open(phaser_log, 'w') as w:
-        w.write(runellg.summary())
-    ellg_data_from_phaser_log(phaser_log, homologs)
+
+def apply_ellg_results(homologs, names, results):
+    """Set the eLLG data parsed from one or more PHASER runs on the homologs
+
+    The results are applied in the order of names, so the outcome doesn't depend on how the ensembles were split
+    between the runs.
+
+    Parameters
+    ----------
+    homologs : dict
+       The HomologData keyed by name
+    names : list
+       The names of the homologs whose eLLGs were calculated
+    results : list
+       The dictionaries returned by parse_ellg_summary for each run
+    """
+    merged = {}
+    for result in results:
+        merged.update(result)
+    for hname in names:
+        if hname not in merged:
+            logger.warning(f"No eLLG data returned by PHASER for homolog {hname}")
+            continue
+        for attr, value in merged[hname].items():
+            setattr(homologs[hname], attr, value)
+    return homologs
+
+
+def parse_ellg_summary(lines):
+    """Parse the eLLG and number of copies of each ensemble from the lines of a PHASER MR_ELLG summary
+
+    Returns
+    -------
+    dict
+       A dictionary of homolog attributes keyed by ensemble name
+    """
+    data = {}
+    lines = iter(lines)
+    for line in lines:
+        # Get base homolog data
+        if line.strip().startswith('eLLG: eLLG of ensemble alone'):
+            next(lines, None)
+            for line in lines:
+                if not line.strip():
+                    break
+                eLLG, rmsd, frac_scat, name = line.strip().split()
+                data.setdefault(name, {}).update(ellg=float(eLLG), rmsd=float(rmsd), frac_scat=float(frac_scat))
+        # Get ncopies
+        elif line.strip().startswith('Number of copies for eLLG target'):
+            next(lines, None)
+            next(lines, None)
+            for line in lines:
+                if not line.strip():
+                    break
+                _, _, total_frac_scat_known, total_frac_scat, ncopies, homolog = line.strip().split()
+                data.setdefault(homolog, {}).update(total_frac_scat_known=float(total_frac_scat_known),
+                                                    total_frac_scat=float(total_frac_scat),
+                                                    ncopies=int(ncopies))
+    return data
 
 
 def ellg_data_from_phaser_log(fpath, homologs):
     with open(fpath) as fh:
-        line = fh.readline()
-        while line:
-            # Get base homolog data
-            if line.strip().startswith('eLLG: eLLG of ensemble alone'):
-                fh.readline()
-                while True:
-                    line = fh.readline()
-                    if not line.strip():
-                        break
-                    eLLG, rmsd, frac_scat, name = line.strip().split()
-                    h = homologs[name]
-                    h.ellg = float(eLLG)
-                    h.rmsd = float(rmsd)
-                    h.frac_scat = float(frac_scat)
-            # Get ncopies
-            if line.strip().startswith('Number of copies for eLLG target'):
-                fh.readline()
-                fh.readline()
-                while True:
-                    line = fh.readline()
-                    if not line.strip():
-                        break
-                    _, _, total_frac_scat_known, total_frac_scat, ncopies, homolog = line.strip().split()
-                    h = homologs[homolog]
-                    h.total_frac_scat_known = float(total_frac_scat_known)
-                    h.total_frac_scat = float(total_frac_scat)
-                    h.ncopies = int(ncopies)
-            line = fh.readline()
+        for name, attrs in parse_ellg_summary(fh).items():
+            for attr, value in attrs.items():
+                setattr(homologs[name], attr, value)
     return homologs
@@ -9,10 +9,19 @@ import re
 import shutil
 import tarfile
 
+import requests
+
 from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation
-from mrparse.mr_util import now, run_cmd
+from mrparse.mr_archive import check_member_name, read_archive_member
+from mrparse.mr_poll import Backoff, Deadline, wait_for_job, wait_for_jobs, QUEUED, RUNNING, FINISHED, FAILED
+from mrparse.mr_util import now
 
 JPRED_SUBMISSION_EMAIL = 'jens.thomas@liverpool.ac.uk'
+JPRED_URL = 'http://www.compbio.dundee.ac.uk/jpred4'
+JPRED_REST_URL = f'{JPRED_URL}/cgi-bin/rest'
+JPRED_PARAMETER_DELIMITER = '£€£€'  # Separates the job parameters in a submission
+JPRED_MAX_RUNTIME = 60 * 60  # seconds
+JPRED_REQUEST_TIMEOUT = 60  # seconds
 
 logger = logging.getLogger(__name__)
 
@@ -31,10 +40,82 @@ class OutOfTimeException(Exception):
     pass
 
 
+class JPredClient(object):
+    """Client for the JPred REST API: http://www.compbio.dundee.ac.uk/jpred4/api.shtml
+
+    This makes the same requests as the jpredapi.pl script, but from within the process.
+    """
+
+    def __init__(self, rest_url=JPRED_REST_URL, results_url=f'{JPRED_URL}/results', timeout=JPRED_REQUEST_TIMEOUT,
+                 session=None):
+        self.rest_url = rest_url
+        self.results_url = results_url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self._missing = {}
+
+    def submit(self, sequence, name='ccp4_mrparse_submission', mode='single', email=None):
+        """Submit a job and return its jobid
+
+        Parameters
+        ----------
+        sequence : str
+           The sequence(s) in FASTA format
+        mode : str
+           'single' for a single sequence or 'batch' for a multi-sequence FASTA file (requires email)
+        """
+        fmt = {'single': 'seq', 'batch': 'batch'}[mode]
+        params = ['skipPDB=on', f'name={name}', f'format={fmt}']
+        if email:
+            params.append(f'email={email}')
+        body = "".join(p + JPRED_PARAMETER_DELIMITER for p in params) + sequence
+        response = self.session.post(f'{self.rest_url}/job', data=body.encode('utf-8'),
+                                     headers={'Content-Type': 'text/txt'}, timeout=self.timeout,
+                                     allow_redirects=False)
+        response.raise_for_status()
+        location = response.headers.get('Location', '')
+        match = re.search(r'(jp_\S+)$', location)
+        if not match:
+            raise RuntimeError(f"Cannot get jobid from JPred submission response: {location} {response.text}")
+        return match.group(1)
+
+    def status(self, jobid):
+        """Return the (state, message) of a job"""
+        response = self.session.get(f'{self.rest_url}/job/id/{jobid}', timeout=self.timeout)
+        response.raise_for_status()
+        message = response.text
+        if 'finished' in message:
+            return FINISHED, message
+        elif 'malformed' in message or 'does not exist in the queue' in message:
+            return FAILED, message
+        elif 'No job of that ID' in message:
+            # The job may not have been registered yet so only give up if it's missing several times
+            self._missing[jobid] = self._missing.get(jobid, 0) + 1
+            return (FAILED if self._missing[jobid] > 2 else QUEUED), message
+        return RUNNING, message
+
+    def download(self, jobid, directory):
+        """Download the results archive for a job to directory and return its path"""
+        download_tgz = Path(directory, f'{jobid}.tar.gz')
+        download_tgz.parent.mkdir(parents=True, exist_ok=True)
+        with self.session.get(f'{self.results_url}/{jobid}/{jobid}.tar.gz', timeout=self.timeout,
+                              stream=True) as response:
+            response.raise_for_status()
+            with open(download_tgz, 'wb') as w:
+                for block in response.iter_content(chunk_size=1 << 16):
+                    w.write(block)
+        return download_tgz
+
+
 class JPred(object):
-    def __init__(self, seq_info=None):
+    CACHE_VERSION = 1
+
+    def __init__(self, seq_info=None, client=None, deadline=None, cancel=None, backoff=None):
         self.seq_info = seq_info
-        self.jpred_script = str(Path(__file__).parent.resolve().joinpath('scripts', 'jpredapi.pl'))
+        self.client = client or JPredClient()
+        self.deadline = deadline or Deadline(JPRED_MAX_RUNTIME)
+        self.cancel = cancel
+        self.backoff = backoff or Backoff(initial=10.0, maximum=120.0)
         self.prediction = None
         self.exception = None
 
@@ -47,24 +128,33 @@ class JPred(object):
 
     @staticmethod
     def parse_jpred_output(out_concise):
-        ss_pred = None
-        cc_28 = None
         logger.debug(f'Parsing JPRED concise output: {out_concise}')
         with open(out_concise) as f:
+            return JPred.parse_jpred_concise(f)
+
+    @staticmethod
+    def parse_jpred_concise(f):
+        ss_pred = None
+        cc_28 = None
+        line = f.readline()
+        while line:
+            prefix = 'Lupas_28:'
+            if line.startswith(prefix):
+                line = line.strip().replace(prefix, '')
+                cc_28 = "".join(line.split(","))
+            prefix = 'jnetpred:'
+            if line.startswith(prefix):
+                line = line.strip().replace(prefix, '')
+                ss_pred = "".join(line.split(","))
             line = f.readline()
-            while line:
-                prefix = 'Lupas_28:'
-                if line.startswith(prefix):
-                    line = line.strip().replace(prefix, '')
-                    cc_28 = "".join(line.split(","))
-                prefix = 'jnetpred:'
-                if line.startswith(prefix):
-                    line = line.strip().replace(prefix, '')
-                    ss_pred = "".join(line.split(","))
-                line = f.readline()
         assert ss_pred and cc_28
         return ss_pred, cc_28
 
+    @staticmethod
+    def parse_results_archive(download_tgz):
+        """Parse the .concise file straight from a JPred results archive without extracting it"""
+        return read_archive_member(download_tgz, '*.concise', JPred.parse_jpred_concise)
+
     @staticmethod
     def parse_results_output(output):
         """Parse directory path of JPRED
@@ -137,7 +227,6 @@ class JPred(object):
         cleanup : bool
            Delete the downloaded/unpacked results
         """
-        results_directory = None
         if not (download_tgz or jpred_output):  # for testing
             if not Path(self.seq_info.sequence_file).exists():
                 msg = f"Cannot find JPRED sequence file: {self.seq_info.sequence_file}"
@@ -150,16 +239,59 @@ class JPred(object):
                 logger.critical(e)
                 self.exception = e
                 raise e
-        if not jpred_output and not results_directory:
-            results_directory = self.unpack_results(download_tgz)
-            jpred_output = self.find_results_file(results_directory)
-        ss_pred, _ = self.parse_jpred_output(str(jpred_output))
-        if cleanup and results_directory.exists():
-            self.cleanup(results_directory)
+        if jpred_output:
+            ss_pred, _ = self.parse_jpred_output(str(jpred_output))
+        else:
+            ss_pred, _ = self.parse_results_archive(download_tgz)
+            if cleanup:
+                self.cleanup(Path(download_tgz).parent)
         self.prediction = self.create_annotation(ss_pred)
         logger.debug(f"JPred finished prediction at: {now()}")
         return self.prediction
 
+    def batch_predictions(self, sequences, cleanup=True):
+        """Calculate SS for several sequences with the JPred server
+
+        JPred's own batch mode only returns results by email, so each sequence is submitted as its own job
+        and all the jobs are tracked by a single poller using the same connection and deadline.
+
+        Parameters
+        ----------
+        sequences : dict
+           Sequences keyed by name
+
+        Returns
+        -------
+        dict
+           The predicted annotation for each name (sequences whose job failed are missing)
+        """
+        jobids = {}
+        for name, sequence in sequences.items():
+            try:
+                jobids[name] = self.client.submit(f">query\n{sequence}\n")
+            except Exception as e:
+                logger.warning(f"Error submitting JPred job for {name}: {e}")
+        logger.info(f"Submitted {len(jobids)} JPred jobs")
+        checks = {name: (lambda jobid=jobid: self.client.status(jobid)) for name, jobid in jobids.items()}
+        results = wait_for_jobs(checks, backoff=self.backoff, deadline=self.deadline, cancel=self.cancel,
+                                description='JPred job')
+        predictions = {}
+        for name, jobid in jobids.items():
+            if isinstance(results[name], Exception):
+                logger.warning(f"JPred job {jobid} for {name} failed: {results[name]}")
+                continue
+            try:
+                download_tgz = self.client.download(jobid, Path(jobid))
+                ss_pred, _ = self.parse_results_archive(download_tgz)
+            except Exception as e:
+                logger.warning(f"Error retrieving results of JPred job {jobid} for {name}: {e}")
+                continue
+            finally:
+                if cleanup:
+                    self.cleanup(jobid)
+            predictions[name] = self.create_annotation(ss_pred)
+        return predictions
+
     def run_jpred(self, seqin):
         logger.debug(f"JPred starting prediction at: {now()}")
         jobid = self.submit_job(seqin)
@@ -167,59 +299,35 @@ class JPred(object):
         return download_tgz
 
     def submit_job(self, seqin):
-        cmd = [self.jpred_script,
-               'submit',
-               f'file={seqin}',
-               'mode=single',
-               'format=fasta',
-               'name=ccp4_mrparse_submission',
-               'skipPDB=on']
-        out = run_cmd(cmd)
-        jobid, status_url = self.parse_status_url(out)
+        with open(seqin) as fh:
+            sequence = fh.read()
+        jobid = self.client.submit(sequence)
+        status_url = f'{JPRED_URL}/cgi-bin/chklog?{jobid}'
         logger.info(f"*** Submitted JPRED job with id {jobid} - check its progress here: {status_url}")
         return jobid
 
     def get_results(self, jobid):
-        """Check results and download from the server"""
-        cmd = [self.jpred_script,
-               'status',
-               f'jobid={jobid}',
-               'getResults=yes',
-               'checkEvery=10']
-        out = run_cmd(cmd)
-        download_tgz = self.parse_results_output(out)
-        download_tgz = Path(download_tgz).resolve()
+        """Wait for the job to finish and download the results from the server"""
+        wait_for_job(lambda: self.client.status(jobid), backoff=self.backoff, deadline=self.deadline,
+                     cancel=self.cancel, description=f'JPred job {jobid}')
+        download_tgz = self.client.download(jobid, Path(jobid)).resolve()
         logger.debug(f"JPred results downloaded to: {download_tgz}")
         return download_tgz
 
     def unpack_results(self, download_tgz):
+        """Extract a results archive to the directory containing it
+
+        The results are now parsed straight from the archive (see parse_results_archive), so this is only
+        needed to keep all the JPred output files.
+        """
         job_directory = Path(download_tgz).parent
         with tarfile.open(download_tgz, 'r:*') as tf:
-            if not tf.getmembers():
+            members = tf.getmembers()
+            if not members:
                 raise RuntimeError(f'Empty archive: {download_tgz}')
-            
-            import os
-            
-            def is_within_directory(directory, target):
-                
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-            
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-                
-                return prefix == abs_directory
-            
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-            
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
-            
-                tar.extractall(path, members, numeric_owner=numeric_owner) 
-                
-            
-            safe_extract(tf, path=job_directory)
+            for member in members:
+                check_member_name(member.name)
+            tf.extractall(job_directory, members)
         logger.debug(f'Extracted jpred files to: {job_directory}')
         return job_directory
 
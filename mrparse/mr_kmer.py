@@ -0,0 +1,246 @@
+"""
+Created on 19 Oct 2026
+
+A k-mer inverted index of a FASTA sequence database, used to select the sequences that are worth searching with
+phmmer.
+
+Most of the sequences in a database the size of the AlphaFold database share no significant similarity with the
+query, but phmmer still has to score every one of them. The index maps each k-mer to the sequences that contain it,
+so the sequences sharing the most k-mers with the query can be found without reading the database. Those candidates
+are written to a small FASTA file, which phmmer searches with -Z set to the size of the full database so that the
+E-values are the same as for a search of the whole database.
+
+The k-mers are taken from a reduced alphabet that groups similar amino acids (Murphy et al., 2000, Protein Eng.
+13, 149-152), so distant homologues still share k-mers. The index is stored in the same places as the offset index
+of mr_fasta_index, as a directory of memory-mapped numpy arrays:
+
+* offsets.npy - for each k-mer, the start of its sequences in postings.npy
+* postings.npy - the numbers of the sequences containing each k-mer (about 4 bytes per residue of the database)
+* records.npy - the byte range of each sequence in the database
+"""
+import json
+import logging
+import mmap
+from pathlib import Path
+
+import numpy as np
+
+from mrparse.mr_fasta_index import fasta_metadata, index_paths, scan_fasta
+from mrparse.mr_output import AtomicFile
+from mrparse.mr_timing import span
+
+KMER_SUFFIX = '.mrpkmer'
+KMER_VERSION = 1
+DEFAULT_K = 6
+CHUNK_RESIDUES = 32 * 1024 * 1024
+# Murphy 10 letter alphabet: LVIM, C, A, G, ST, P, FYW, EDNQ, KR, H
+REDUCED_ALPHABET = ('LVIM', 'C', 'A', 'G', 'ST', 'P', 'FYW', 'EDNQ', 'KR', 'H')
+INVALID = 255
+
+logger = logging.getLogger(__name__)
+
+_CODES = np.full(256, INVALID, dtype=np.uint8)
+for _code, _letters in enumerate(REDUCED_ALPHABET):
+    for _aa in _letters:
+        _CODES[ord(_aa)] = _CODES[ord(_aa.lower())] = _code
+
+
+def encode(sequence):
+    """Return the reduced alphabet codes of a sequence (str or bytes), with INVALID for any other characters"""
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', errors='replace')
+    return _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def kmers(codes, k=DEFAULT_K):
+    """Return the k-mers of an array of codes as integers, and a mask of the k-mers without INVALID codes
+
+    Element i of the arrays is the k-mer starting at codes[i].
+    """
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+    values = np.zeros(n, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    for j in range(k):
+        window = codes[j:j + n]
+        values = values * len(REDUCED_ALPHABET) + window
+        valid &= window != INVALID
+    return values, valid
+
+
+def _chunks(fasta, k):
+    """Yield the records of fasta in chunks of about CHUNK_RESIDUES residues
+
+    Each chunk is (first, records, pairs): the number of its first sequence, an (n, 2) array of the byte ranges of
+    its n sequences and a sorted array of the distinct (sequence number - first) * nkmers + k-mer of the chunk.
+    """
+    nkmers = len(REDUCED_ALPHABET) ** k
+    first = 0
+    with open(fasta, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        records, sequences, nresidues = [], [], 0
+        for _, offset, end, length in scan_fasta(fasta):
+            record = data[offset:end]
+            sequences.append(b''.join(record.split(b'\n', 1)[1:]).translate(None, b'\r\n'))
+            records.append((offset, end))
+            nresidues += length + 1
+            if nresidues >= CHUNK_RESIDUES:
+                yield first, np.array(records, dtype=np.uint64), _distinct_kmers(sequences, k, nkmers)
+                first += len(records)
+                records, sequences, nresidues = [], [], 0
+        if records:
+            yield first, np.array(records, dtype=np.uint64), _distinct_kmers(sequences, k, nkmers)
+
+
+def _distinct_kmers(sequences, k, nkmers):
+    # Separate the sequences with an invalid character so that no k-mer spans two of them
+    codes = encode(b'*'.join(sequences))
+    numbers = np.repeat(np.arange(len(sequences), dtype=np.int64), [len(s) + 1 for s in sequences])
+    values, valid = kmers(codes, k)
+    pairs = np.sort(numbers[:len(values)][valid] * nkmers + values[valid])
+    return pairs[np.r_[True, pairs[1:] != pairs[:-1]]] if len(pairs) else pairs
+
+
+class KmerIndex(object):
+    """Find the sequences of a FASTA database that share the most k-mers with a query
+
+    Examples
+    --------
+    >>> index = KmerIndex.open('sequences.fasta')
+    >>> nsequences = index.write_candidates(index.candidates(query, 5000), 'candidates.fasta')
+    """
+
+    def __init__(self, fasta, directory, k):
+        self.fasta = str(fasta)
+        self.directory = Path(directory)
+        self.k = k
+        self._offsets = np.load(self.directory.joinpath('offsets.npy'), mmap_mode='r')
+        self._postings = np.load(self.directory.joinpath('postings.npy'), mmap_mode='r')
+        self._records = np.load(self.directory.joinpath('records.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self._records)
+
+    @classmethod
+    def build(cls, fasta, k=DEFAULT_K, directory=None):
+        """Index fasta, writing the index to directory or the first writable location of index_paths"""
+        candidates = [Path(directory)] if directory else index_paths(fasta, suffix=KMER_SUFFIX)
+        for path in candidates:
+            try:
+                path.mkdir(parents=True, exist_ok=True)
+                return cls._build(fasta, k, path)
+            except OSError as e:
+                logger.debug(f"Cannot write k-mer index to {path}: {e}")
+        raise RuntimeError(f"Cannot write a k-mer index for sequence database: {fasta}")
+
+    @classmethod
+    def _build(cls, fasta, k, path):
+        logger.info(f"Building {k}-mer index of sequence database {fasta}")
+        nkmers = len(REDUCED_ALPHABET) ** k
+        # The first pass counts the sequences containing each k-mer, which gives the layout of the postings
+        counts = np.zeros(nkmers, dtype=np.int64)
+        records = []
+        for _, chunk_records, pairs in _chunks(fasta, k):
+            counts += np.bincount(pairs % nkmers, minlength=nkmers)
+            records.append(chunk_records)
+        records = np.concatenate(records) if records else np.empty((0, 2), dtype=np.uint64)
+        if len(records) >= np.iinfo(np.uint32).max:
+            raise RuntimeError(f"Too many sequences to index in {fasta}: {len(records)}")
+        offsets = np.zeros(nkmers + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # The second pass fills in the postings of each k-mer, in the order of the sequences
+        postings_path = path.joinpath('postings.npy')
+        with AtomicFile(postings_path, mode='wb') as w:
+            postings = np.lib.format.open_memmap(w.tmp_path, mode='w+', dtype=np.uint32, shape=(int(offsets[-1]),))
+            cursor = offsets[:-1].copy()
+            for first, _, pairs in _chunks(fasta, k):
+                if not len(pairs):
+                    continue
+                values = pairs % nkmers
+                order = np.argsort(values, kind='stable')
+                values = values[order]
+                numbers = (pairs[order] // nkmers + first).astype(np.uint32)
+                # The position of each pair within the run of pairs with the same k-mer
+                run_start = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+                rank = np.arange(len(values)) - np.repeat(run_start, np.diff(np.r_[run_start, len(values)]))
+                postings[cursor[values] + rank] = numbers
+                cursor[values[run_start]] += np.diff(np.r_[run_start, len(values)])
+            postings.flush()
+            del postings
+
+        for name, array in (('offsets.npy', offsets), ('records.npy', records)):
+            with AtomicFile(path.joinpath(name), mode='wb') as w:
+                np.save(w, array)
+        # The metadata is written last, so an interrupted build is never used
+        with AtomicFile(path.joinpath('metadata.json')) as w:
+            w.write(json.dumps(dict(fasta_metadata(fasta, version=KMER_VERSION), k=k, nsequences=len(records))))
+        logger.info(f"Indexed the {k}-mers of {len(records)} sequences of {fasta} in {path}")
+        return cls(fasta, path, k)
+
+    @classmethod
+    def load(cls, fasta, k=DEFAULT_K):
+        """Return the k-mer index of fasta, or None if it hasn't been indexed or has changed since it was indexed"""
+        metadata = dict(fasta_metadata(fasta, version=KMER_VERSION), k=k)
+        for path in index_paths(fasta, suffix=KMER_SUFFIX):
+            try:
+                with open(path.joinpath('metadata.json')) as fh:
+                    stored = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            if all(stored.get(key) == value for key, value in metadata.items()):
+                return cls(fasta, path, k)
+            logger.debug(f"Ignoring out of date k-mer index {path}")
+        return None
+
+    @classmethod
+    def open(cls, fasta, k=DEFAULT_K, build=True):
+        """Return the k-mer index of fasta, building it if it doesn't exist (and build is set)"""
+        index = cls.load(fasta, k=k)
+        if index is None and build:
+            index = cls.build(fasta, k=k)
+        return index
+
+    def shared_kmers(self, sequence):
+        """Return the numbers of the sequences sharing k-mers with sequence, and the number of k-mers they share"""
+        values, valid = kmers(encode(sequence), self.k)
+        query = np.unique(values[valid])
+        if not len(query):
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+        postings = [self._postings[self._offsets[v]:self._offsets[v + 1]] for v in query]
+        return np.unique(np.concatenate(postings), return_counts=True)
+
+    def candidates(self, sequence, ncandidates):
+        """Return the numbers of the ncandidates sequences sharing the most k-mers with sequence, best first"""
+        numbers, shared = self.shared_kmers(sequence)
+        if len(numbers) > ncandidates:
+            top = np.argpartition(-shared, ncandidates - 1)[:ncandidates]
+            numbers, shared = numbers[top], shared[top]
+        return numbers[np.argsort(-shared, kind='stable')]
+
+    def write_candidates(self, numbers, fpath):
+        """Write the sequences with the given numbers to a new FASTA file, returning the number written"""
+        with open(self.fasta, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                AtomicFile(fpath, mode='wb') as w:
+            # Read the database in order
+            for offset, end in self._records[np.sort(numbers)]:
+                record = data[int(offset):int(end)]
+                w.write(record if record.endswith(b'\n') else record + b'\n')
+        return len(numbers)
+
+
+def prefilter_database(sequence, fasta, ncandidates, fpath, k=DEFAULT_K):
+    """Write the ncandidates sequences of fasta most similar to sequence to fpath
+
+    Returns
+    -------
+    nsequences : int
+       The number of sequences in fasta, which should be given to phmmer with -Z
+    """
+    with span('prefilter', candidates=ncandidates):
+        index = KmerIndex.open(fasta, k=k)
+        numbers = index.candidates(sequence, ncandidates)
+        index.write_candidates(numbers, fpath)
+    logger.info(f"Selected {len(numbers)} of the {len(index)} sequences of {fasta} that share the most {k}-mers "
+                f"with the target sequence")
+    return len(index)
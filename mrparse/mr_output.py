@@ -0,0 +1,250 @@
+"""
+Created on 19 Oct 2026
+
+Writers for the MrParse JSON output files and the data file used by the HTML report.
+
+Records are written to disk as they are produced so that the full set of results never needs
+to be held in memory as a single string.
+"""
+import logging
+import os
+import types
+
+from mrparse.mr_util import json_dumps
+
+HOMOLOGS_JS = 'homologs.json'
+MODELS_JS = 'models.json'
+TIMINGS_JSON = 'timings.json'
+STAGES = ('homologs', 'models', 'hkl_info', 'classification', 'timings')
+STATUS = 'status'
+POLL_INTERVAL = 5000  # milliseconds between the HTML report reloading unfinished data files
+
+logger = logging.getLogger(__name__)
+
+
+class AtomicFile(object):
+    """A file that is written to a temporary path and renamed into place when it is closed
+
+    Other processes (or the browser displaying the HTML report) therefore never see a partially
+    written file.
+    """
+
+    def __init__(self, fpath, mode='w'):
+        self.fpath = str(fpath)
+        self.tmp_path = f"{self.fpath}.{os.getpid()}.tmp"
+        self._fh = open(self.tmp_path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(discard=exc_type is not None)
+
+    def write(self, data):
+        self._fh.write(data)
+
+    def close(self, discard=False):
+        self._fh.close()
+        if discard:
+            os.unlink(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, self.fpath)
+
+
+class JsonArrayWriter(object):
+    """Write a JSON array to a file one record at a time
+
+    Examples
+    --------
+    >>> with JsonArrayWriter('homologs.json') as writer:
+    ...     for homolog in homologs.values():
+    ...         writer.write(homolog.static_dict)
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.nrecords = 0
+        self._fh = None
+
+    def __enter__(self):
+        self._fh = AtomicFile(self.fpath)
+        self._fh.write('[')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._fh.write(']')
+        self._fh.close(discard=exc_type is not None)
+        self._fh = None
+
+    def write(self, record):
+        if self.nrecords:
+            self._fh.write(', ')
+        self._fh.write(json_dumps(record))
+        self.nrecords += 1
+
+
+def iterencode(obj):
+    """Encode obj as JSON, yielding the output in chunks
+
+    Dictionaries are encoded key by key and generators are encoded as arrays, one item at a time,
+    so any generators in obj are only consumed as the output is written. All other values are
+    encoded in one go with json_dumps.
+    """
+    if isinstance(obj, dict):
+        yield '{'
+        for i, (k, v) in enumerate(obj.items()):
+            if i:
+                yield ', '
+            yield json_dumps(str(k)) + ': '
+            yield from iterencode(v)
+        yield '}'
+    elif isinstance(obj, (types.GeneratorType, map, filter)):
+        yield '['
+        for i, item in enumerate(obj):
+            if i:
+                yield ', '
+            yield json_dumps(item)
+        yield ']'
+    else:
+        yield json_dumps(obj)
+
+
+def write_stage_js(fpath, stage, data, finished=True):
+    """Write the results for a stage as a javascript data file that can be loaded by the HTML report
+
+    The data is written as a javascript file that calls mrparse_update (defined in mrparse_vue.js)
+    rather than as plain JSON so that it can be loaded with a <script> tag, which (unlike fetching a
+    JSON file) also works when the report is opened from disk.
+
+    Parameters
+    ----------
+    fpath : str
+       The path to the output file
+    stage : str
+       The name of the stage
+    data : object
+       The results for the stage - any generators within it are streamed to the file
+    finished : bool
+       Whether the stage has finished
+    """
+    with AtomicFile(fpath) as w:
+        w.write(f'mrparse_update({json_dumps(stage)}, {json_dumps(finished)}, ')
+        for chunk in iterencode(data):
+            w.write(chunk)
+        w.write(');\n')
+    return fpath
+
+
+def stream_records(records, json_out, exclude_keys=None, strip_keys=None):
+    """Write records to a JSON file as they are generated and pass them on
+
+    Parameters
+    ----------
+    records : iterable
+       The dictionaries to write
+    json_out : str
+       The JSON file to write the records to
+    exclude_keys : list
+       Keys that are not written to json_out but are kept in the yielded records
+    strip_keys : list
+       Keys that are written to json_out but removed from the yielded records
+    """
+    exclude_keys = exclude_keys or []
+    strip_keys = strip_keys or []
+    with JsonArrayWriter(json_out) as writer:
+        for record in records:
+            excluded = {k: record.pop(k) for k in exclude_keys if k in record}
+            writer.write(record)
+            record.update(excluded)
+            for k in strip_keys:
+                record.pop(k, None)
+            yield record
+    logger.debug(f"Wrote {writer.nrecords} records to {json_out}")
+
+
+class ResultsWriter(object):
+    """Write the data files for the HTML report as each stage of the analysis completes
+
+    The stages are run in separate processes so each stage writes its own data file and
+    the HTML report reloads the files of any unfinished stages until the run is complete.
+    The object only stores the output settings so can be passed to the multiprocessing pool.
+    """
+
+    def __init__(self, stages=STAGES, ccp4cloud=False):
+        self.stages = tuple(stages)
+        self.ccp4cloud = ccp4cloud
+
+    @staticmethod
+    def stage_file(stage):
+        return f'mrparse_{stage}.js'
+
+    @property
+    def data_files(self):
+        return {stage: self.stage_file(stage) for stage in self.stages + (STATUS,)}
+
+    def report_config(self):
+        """Return the configuration used by the HTML report to load the data files"""
+        return {'data_files': self.data_files, 'poll_interval': POLL_INTERVAL}
+
+    def initialise(self):
+        """Write placeholder data files for all stages so the report can be displayed straight away"""
+        for stage in self.stages:
+            self.write_stage(stage, None, finished=False)
+        self.write_status(complete=False)
+
+    def write_stage(self, stage, data, finished=True):
+        if stage not in self.stages:
+            return None
+        return write_stage_js(self.stage_file(stage), stage, data, finished=finished)
+
+    def write_status(self, complete=True):
+        return write_stage_js(self.stage_file(STATUS), STATUS, {'complete': complete})
+
+    def write_homologs(self, search_model_finder, finished=True):
+        try:
+            records = stream_records(search_model_finder.iter_homologs_with_graphics(), HOMOLOGS_JS,
+                                     exclude_keys=['_pfam_json'], strip_keys=self._strip_keys)
+        except RuntimeError:
+            logger.debug('No homologues found')
+            records = []
+        return self.write_stage('homologs', records, finished=finished)
+
+    def write_models(self, search_model_finder, finished=True):
+        try:
+            records = stream_records(search_model_finder.iter_models_with_graphics(), MODELS_JS,
+                                     exclude_keys=['_pfam_json'], strip_keys=self._strip_keys)
+        except RuntimeError:
+            logger.debug('No models found')
+            records = []
+        return self.write_stage('models', records, finished=finished)
+
+    def write_hkl_info(self, hkl_info, finished=True):
+        d = hkl_info.as_dict()
+        if self.ccp4cloud:
+            del d['hklin']
+        return self.write_stage('hkl_info', d, finished=finished)
+
+    def write_classification(self, classifier, finished=True):
+        return self.write_stage('classification', classifier.pfam_dict(), finished=finished)
+
+    def write_timings(self, timings, finished=True):
+        """Write the timings gathered by mr_timing.gather_timings to TIMINGS_JSON and the summary to the report"""
+        with AtomicFile(TIMINGS_JSON) as w:
+            w.write(json_dumps(timings))
+        return self.write_stage('timings', timings['summary'], finished=finished)
+
+    @property
+    def _strip_keys(self):
+        return ['pdb_file'] if self.ccp4cloud else None
+
+
+def write_progress(write, *args, **kwargs):
+    """Call a ResultsWriter method to report progress, logging rather than raising any errors
+
+    Progress updates are only informative so shouldn't stop the stage that is reporting them.
+    """
+    try:
+        write(*args, **kwargs)
+    except Exception as e:
+        logger.warning(f'Error writing progress data: {e}')
+        logger.debug("Traceback is:", exc_info=True)
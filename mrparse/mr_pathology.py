@@ -0,0 +1,298 @@
+"""
+Created on 19 Oct 2026
+
+Screening of reflection data for translational NCS, twinning and anisotropy in-process with gemmi and NumPy,
+as an alternative to running ctruncate.
+
+All three checks work on arrays of every reflection at once:
+
+* translational NCS - the highest peak in the Patterson function away from the origin (and any lattice
+  centring vectors), as a fraction of the origin peak
+* twinning - the L-test of Padilla & Yeates (2003) on pairs of acentric reflections whose indices differ by
+  two, which unlike the intensity moments is not affected by translational NCS. The second moment of the
+  normalised intensities is also reported.
+* anisotropy - the spread of the eigenvalues of an anisotropic B-factor fitted to the intensities in resolution
+  shells
+
+Intensities are used in preference to amplitudes when the MTZ file has both, as they are by ctruncate. The
+amplitudes of deposited data may have been corrected or truncated (the FP column of 5lm4 gives quite different
+L-test and anisotropy statistics to its intensities), so the two can disagree for data close to the thresholds.
+"""
+import logging
+
+import numpy as np
+
+try:
+    import gemmi
+except ImportError:
+    gemmi = None
+
+LTEST_TWINNED = 0.44  # <|L|> is 0.5 for untwinned and 0.375 for perfectly twinned data
+LTEST_OFFSETS = np.array([[2, 0, 0], [0, 2, 0], [0, 0, 2]])
+MOMENT_SHELLS = 20
+ANISOTROPY_DELTA_B = 10.0  # A^2
+ANISOTROPY_SHELLS = 10
+TNCS_PEAK_FRACTION = 0.2
+TNCS_MIN_DISTANCE = 14.0  # A
+PATTERSON_RESOLUTION = (10.0, 4.0)  # A
+
+logger = logging.getLogger(__name__)
+
+
+class ReflectionData(object):
+    """Miller indices and intensities of the reflections in an MTZ file
+
+    Parameters
+    ----------
+    hkl : :obj:`numpy.ndarray`
+       The (n, 3) Miller indices
+    intensity : :obj:`numpy.ndarray`
+       The intensities
+    sigma : :obj:`numpy.ndarray`
+       The standard deviations of the intensities
+    cell : :obj:`gemmi.UnitCell`
+    spacegroup : :obj:`gemmi.SpaceGroup`
+    """
+
+    def __init__(self, hkl, intensity, sigma, cell, spacegroup):
+        self.hkl = hkl
+        self.intensity = intensity
+        self.sigma = sigma
+        self.cell = cell
+        self.spacegroup = spacegroup
+        self.ops = spacegroup.operations()
+        self.centric = self.ops.centric_flag_array(hkl).astype(bool)
+        self.epsilon = self.ops.epsilon_factor_array(hkl).astype(float)
+        self.d_star_sq = np.einsum('ij,ij->i', self.reciprocal_vectors(), self.reciprocal_vectors())
+
+    @classmethod
+    def from_mtz(cls, hklin, columns):
+        """Read the intensities (or squared amplitudes) selected by columns from an MTZ file
+
+        columns is an object with the MtzParser column label attributes (i, sigi, f, sigf, i_plus etc.)
+        """
+        if gemmi is None:
+            raise RuntimeError("gemmi is required to check crystal pathologies without ctruncate")
+        mtz = gemmi.read_mtz_file(str(hklin))
+
+        def column(label):
+            return np.array(mtz.column_with_label(label).array, dtype=float)
+
+        if columns.i and columns.sigi:
+            intensity, sigma = column(columns.i), column(columns.sigi)
+        elif columns.f and columns.sigf:
+            f, sigf = column(columns.f), column(columns.sigf)
+            intensity, sigma = f * f, 2.0 * f * sigf
+        elif columns.i_plus and columns.i_minus:
+            intensity, sigma = cls._merge_anomalous(column(columns.i_plus), column(columns.sigi_plus),
+                                                    column(columns.i_minus), column(columns.sigi_minus))
+        elif columns.f_plus and columns.f_minus:
+            f, sigf = cls._merge_anomalous(column(columns.f_plus), column(columns.sigf_plus),
+                                           column(columns.f_minus), column(columns.sigf_minus))
+            intensity, sigma = f * f, 2.0 * f * sigf
+        else:
+            raise RuntimeError(f"No intensity or amplitude columns found in {hklin}")
+        hkl = np.array(mtz.make_miller_array(), dtype=int)
+        present = np.isfinite(intensity) & np.isfinite(sigma)
+        return cls(hkl[present], intensity[present], sigma[present], mtz.cell, mtz.spacegroup)
+
+    @staticmethod
+    def _merge_anomalous(plus, sigplus, minus, sigminus):
+        with np.errstate(invalid='ignore'):
+            value = np.nanmean(np.vstack([plus, minus]), axis=0)
+            sigma = np.sqrt(np.nanmean(np.vstack([sigplus, sigminus]) ** 2, axis=0))
+        return value, sigma
+
+    def __len__(self):
+        return len(self.hkl)
+
+    def reciprocal_vectors(self, hkl=None):
+        """Return the Cartesian reciprocal space vectors of the reflections"""
+        return (self.hkl if hkl is None else hkl) @ np.array(self.cell.frac.mat.tolist())
+
+    def expand_to_p1(self):
+        """Return the Miller indices of all the symmetry and Friedel mates of the reflections, and the index of
+        the reflection each was generated from"""
+        rotations = np.array([op.rot for op in self.ops.sym_ops]) // gemmi.Op.DEN
+        mates = np.einsum('ij,njk->nik', self.hkl, rotations).reshape(-1, 3)
+        mates = np.concatenate([mates, -mates])
+        index = np.tile(np.arange(len(self.hkl)), 2 * len(rotations))
+        return mates, index
+
+    def resolution_shells(self, nshells):
+        """Return the index of the resolution shell of each reflection, with the same number of reflections in
+        each shell"""
+        order = np.argsort(self.d_star_sq)
+        shell = np.empty(len(self), dtype=int)
+        shell[order] = np.arange(len(self)) * nshells // max(len(self), 1)
+        return shell
+
+    def normalised_intensities(self, nshells=MOMENT_SHELLS):
+        """Return the intensities divided by epsilon and the mean of the intensities in their resolution shell"""
+        shell = self.resolution_shells(nshells)
+        corrected = self.intensity / self.epsilon
+        mean = np.bincount(shell, weights=corrected, minlength=nshells) / \
+            np.maximum(np.bincount(shell, minlength=nshells), 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return corrected / mean[shell]
+
+
+class MillerLookup(object):
+    """Find the reflection (if any) that is equivalent to each of an array of Miller indices"""
+
+    def __init__(self, data):
+        mates, index = data.expand_to_p1()
+        self.offset = int(np.abs(mates).max()) + int(np.abs(LTEST_OFFSETS).max()) + 1
+        keys = self.encode(mates)
+        self.keys, first = np.unique(keys, return_index=True)
+        self.index = index[first]
+
+    def encode(self, hkl):
+        width = 2 * self.offset + 1
+        shifted = hkl + self.offset
+        return (shifted[:, 0] * width + shifted[:, 1]) * width + shifted[:, 2]
+
+    def find(self, hkl):
+        """Return the index of the reflection equivalent to each Miller index, or -1 if there isn't one"""
+        keys = self.encode(hkl)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.index[pos], -1)
+
+
+def l_test(data):
+    """Return the mean |L| of the L-test over pairs of acentric reflections with indices differing by two"""
+    lookup = MillerLookup(data)
+    acentric = np.flatnonzero(~data.centric)
+    values = []
+    for offset in LTEST_OFFSETS:
+        partner = lookup.find(data.hkl[acentric] + offset)
+        paired = partner >= 0
+        i1 = data.intensity[acentric[paired]]
+        i2 = data.intensity[partner[paired]]
+        partner_acentric = ~data.centric[partner[paired]]
+        total = i1 + i2
+        use = partner_acentric & (total > 0)
+        values.append(np.clip(np.abs((i1[use] - i2[use]) / total[use]), 0.0, 1.0))
+    values = np.concatenate(values)
+    if not len(values):
+        return None
+    return float(values.mean())
+
+
+def second_moment(data):
+    """Return <I^2>/<I>^2 of the acentric normalised intensities (2.0 untwinned, 1.5 perfectly twinned)"""
+    e_sq = data.normalised_intensities()[~data.centric]
+    e_sq = e_sq[np.isfinite(e_sq)]
+    if not len(e_sq):
+        return None
+    return float(np.mean(e_sq ** 2) / np.mean(e_sq) ** 2)
+
+
+def anisotropic_b_eigenvalues(data, nshells=ANISOTROPY_SHELLS, niter=20):
+    """Fit the anisotropy of the intensities and return the eigenvalues of the (trace-free) anisotropic B
+
+    The mean intensity is modelled as k * exp(-s.B.s/4), with a separate scale k for each resolution shell, so
+    only the variation of the intensities with direction within the shells is fitted and not the isotropic
+    fall-off, which doesn't follow the Wilson plot at low resolution. The model is fitted by Gauss-Newton least
+    squares to I/model - 1, which uses every intensity including the weak and negative ones, rather than to
+    ln(I), which can only use the strong ones and is biased by them. The fit is made to all the symmetry mates
+    of the reflections so that B has the symmetry of the crystal.
+    """
+    if len(data) < 10 * (nshells + 5):
+        return None
+    mates, index = data.expand_to_p1()
+    s = data.reciprocal_vectors(mates)
+    shells = np.eye(nshells)[data.resolution_shells(nshells)[index]]
+    aniso = -0.25 * np.column_stack([s[:, 0] ** 2 - s[:, 2] ** 2, s[:, 1] ** 2 - s[:, 2] ** 2,
+                                     2 * s[:, 0] * s[:, 1], 2 * s[:, 0] * s[:, 2], 2 * s[:, 1] * s[:, 2]])
+    design = np.column_stack([shells, aniso])
+    target = (data.intensity / data.epsilon)[index]
+    shell_means = (target @ shells) / shells.sum(axis=0)
+    if np.any(shell_means <= 0):
+        return None
+    params = np.concatenate([np.log(shell_means), np.zeros(5)])
+    for _ in range(niter):
+        ratio = target / np.exp(design @ params)
+        step = np.linalg.lstsq(-ratio[:, None] * design, 1.0 - ratio, rcond=None)[0]
+        params += step
+        if not np.all(np.isfinite(params)):
+            return None
+        if np.abs(step).max() < 1e-6:
+            break
+    b11, b22, b12, b13, b23 = params[nshells:]
+    btensor = np.array([[b11, b12, b13], [b12, b22, b23], [b13, b23, -b11 - b22]])
+    return np.linalg.eigvalsh(btensor)
+
+
+def patterson_peak(data, resolution=PATTERSON_RESOLUTION, min_distance=TNCS_MIN_DISTANCE):
+    """Return the height (as a fraction of the origin peak) and distance from the origin of the highest
+    Patterson peak more than min_distance from the origin or a lattice centring vector"""
+    dmax, dmin = resolution
+    use = (data.d_star_sq >= 1.0 / dmax ** 2) & (data.d_star_sq <= 1.0 / dmin ** 2) & (data.intensity > 0)
+    if not np.any(use):
+        return None, None
+    mates, index = data.expand_to_p1()
+    keep = use[index]
+    mates, values = mates[keep], data.intensity[index[keep]]
+    size = [2 * (2 * int(np.abs(mates[:, i]).max()) + 1) for i in range(3)]
+    grid = np.zeros(size)
+    grid[mates[:, 0] % size[0], mates[:, 1] % size[1], mates[:, 2] % size[2]] = values
+    patterson = np.fft.ifftn(grid).real
+    origin = patterson[0, 0, 0]
+
+    axes = [np.fft.fftfreq(n, d=1.0 / n) / n for n in size]  # Fractional coordinates in [-0.5, 0.5)
+    frac = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+    orth = np.array(data.cell.orth.mat.tolist())
+    distance = np.full(size, np.inf)
+    for centring in data.ops.cen_ops:
+        shifted = frac - np.array(centring) / gemmi.Op.DEN
+        shifted -= np.round(shifted)
+        distance = np.minimum(distance, np.linalg.norm(shifted @ orth.T, axis=-1))
+    far = distance > min_distance
+    if not np.any(far):
+        return None, None
+    peak = np.argmax(np.where(far, patterson, -np.inf))
+    return float(patterson.flat[peak] / origin), float(distance.flat[peak])
+
+
+class PathologyStatistics(object):
+    """Statistics used to screen reflection data for crystal pathologies, with flags equivalent to ctruncate's
+    NCS, TWIN and ANISO"""
+
+    def __init__(self, data):
+        self.nreflections = len(data)
+        self.l_test = l_test(data)
+        self.second_moment = second_moment(data)
+        eigenvalues = anisotropic_b_eigenvalues(data)
+        self.b_eigenvalues = None if eigenvalues is None else [float(e) for e in eigenvalues]
+        self.patterson_peak, self.patterson_distance = patterson_peak(data)
+
+    @classmethod
+    def from_mtz(cls, hklin, columns):
+        return cls(ReflectionData.from_mtz(hklin, columns))
+
+    @property
+    def delta_b(self):
+        if self.b_eigenvalues is None:
+            return None
+        return self.b_eigenvalues[-1] - self.b_eigenvalues[0]
+
+    @property
+    def has_ncs(self):
+        return self.patterson_peak is not None and self.patterson_peak > TNCS_PEAK_FRACTION
+
+    @property
+    def has_twinning(self):
+        return self.l_test is not None and self.l_test < LTEST_TWINNED
+
+    @property
+    def has_anisotropy(self):
+        return self.delta_b is not None and self.delta_b > ANISOTROPY_DELTA_B
+
+    def __str__(self):
+        def fmt(value):
+            return 'n/a' if value is None else f"{value:.3f}"
+        return (f"Reflections: {self.nreflections}\n"
+                f"<|L|>: {fmt(self.l_test)} <I^2>/<I>^2: {fmt(self.second_moment)}\n"
+                f"Anisotropic delta B: {fmt(self.delta_b)}\n"
+                f"Off-origin Patterson peak: {fmt(self.patterson_peak)} at {fmt(self.patterson_distance)} A\n")
@@ -0,0 +1,182 @@
+"""
+Created on 19 Oct 2026
+
+Polling of jobs running on remote prediction servers (JPred, TopCons).
+
+A job is polled by repeatedly calling a check function that returns the state of the job. The time between
+checks increases exponentially (with random jitter so that many jobs don't poll in lockstep) up to a maximum,
+polling stops when a deadline is reached, and it can be cancelled from another thread by setting an Event.
+"""
+import asyncio
+import logging
+import random
+import time
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCEL_CHECK_INTERVAL = 0.5  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class PollTimeoutError(RuntimeError):
+    pass
+
+
+class PollCancelledError(RuntimeError):
+    pass
+
+
+class JobFailedError(RuntimeError):
+    pass
+
+
+class Backoff(object):
+    """Exponentially increasing delays between polls
+
+    Parameters
+    ----------
+    initial : float
+       The first delay in seconds
+    maximum : float
+       The maximum delay in seconds
+    factor : float
+       The factor the delay is multiplied by after each poll
+    jitter : float
+       The fraction of each delay that is randomised: delays are drawn uniformly from [delay * (1 - jitter), delay]
+    """
+
+    def __init__(self, initial=2.0, maximum=60.0, factor=2.0, jitter=0.25, rng=None):
+        if not 0.0 <= jitter <= 1.0:
+            raise RuntimeError(f"Backoff jitter must be between 0 and 1: {jitter}")
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def delays(self):
+        delay = self.initial
+        while True:
+            yield self.rng.uniform(delay * (1.0 - self.jitter), delay)
+            delay = min(delay * self.factor, self.maximum)
+
+
+class Deadline(object):
+    """A time budget that can be shared between all the jobs in a run
+
+    Parameters
+    ----------
+    budget : float
+       The number of seconds from now until the deadline (None for no deadline)
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.start = time.monotonic()
+
+    def remaining(self):
+        if self.budget is None:
+            return float('inf')
+        return max(0.0, self.budget - (time.monotonic() - self.start))
+
+    def expired(self):
+        return self.remaining() <= 0.0
+
+    def limited(self, budget):
+        """Return a deadline budget seconds from now, or this deadline if it is sooner
+
+        This lets a single job have its own time limit without going past the deadline of the run.
+        """
+        if budget is None or self.remaining() <= budget:
+            return self
+        return Deadline(budget)
+
+
+async def poll_job(check, backoff=None, deadline=None, cancel=None, description='job'):
+    """Poll a remote job until it has finished
+
+    Parameters
+    ----------
+    check : callable
+       Called with no arguments to check the job and returns a (state, result) tuple, where state is one of
+       QUEUED, RUNNING, FINISHED or FAILED. It is run in a thread so may block on network calls.
+    backoff : :obj:`Backoff`
+       The delays between checks
+    deadline : :obj:`Deadline`
+       Polling stops with a PollTimeoutError once the deadline has passed
+    cancel : :obj:`threading.Event`
+       Polling stops with a PollCancelledError once the event is set
+    description : str
+       A description of the job for log and error messages
+
+    Returns
+    -------
+    The result returned by check once the job has finished
+    """
+    loop = asyncio.get_running_loop()
+    delays = (backoff or Backoff()).delays()
+    deadline = deadline or Deadline()
+    npolls = 0
+    while True:
+        if cancel is not None and cancel.is_set():
+            raise PollCancelledError(f"Polling of {description} was cancelled")
+        state, result = await loop.run_in_executor(None, check)
+        npolls += 1
+        if state == FINISHED:
+            logger.debug(f"{description} finished after {npolls} polls")
+            return result
+        elif state == FAILED:
+            raise JobFailedError(f"{description} failed: {result}")
+        if deadline.expired():
+            raise PollTimeoutError(f"{description} did not finish before the deadline of {deadline.budget}s")
+        delay = min(next(delays), deadline.remaining())
+        logger.debug(f"{description} is {state} - checking again in {delay:.1f}s")
+        await _sleep(delay, cancel, description)
+
+
+async def _sleep(delay, cancel, description):
+    """Sleep for delay seconds, waking regularly to check whether polling has been cancelled"""
+    if cancel is None:
+        await asyncio.sleep(delay)
+        return
+    end = time.monotonic() + delay
+    while True:
+        if cancel.is_set():
+            raise PollCancelledError(f"Polling of {description} was cancelled")
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, CANCEL_CHECK_INTERVAL))
+
+
+def wait_for_job(check, **kwargs):
+    """Block until a remote job has finished and return the result - see poll_job for the arguments"""
+    return asyncio.run(poll_job(check, **kwargs))
+
+
+async def poll_jobs(checks, **kwargs):
+    """Poll several remote jobs concurrently - see poll_job for the arguments
+
+    Parameters
+    ----------
+    checks : dict
+       The check function of each job, keyed by a name for the job
+
+    Returns
+    -------
+    dict
+       The result of each job, or the exception raised while polling it, keyed by name
+    """
+    description = kwargs.pop('description', 'job')
+    names = list(checks)
+    results = await asyncio.gather(*[poll_job(checks[name], description=f'{description} {name}', **kwargs)
+                                     for name in names], return_exceptions=True)
+    return dict(zip(names, results))
+
+
+def wait_for_jobs(checks, **kwargs):
+    """Block until several remote jobs have finished - see poll_jobs for the arguments"""
+    return asyncio.run(poll_jobs(checks, **kwargs))
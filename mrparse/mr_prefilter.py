@@ -0,0 +1,325 @@
+"""
+Created on 19 Oct 2026
+
+An ungapped alignment prefilter for sequence database searches, in the style of the MMseqs2 prefilter.
+
+The sequences of the database are packed into a single array of residue codes, which is stored next to the database
+(or in the MrParse cache directory) and memory-mapped by the worker processes that each scan a part of it. For each
+part, the diagonals on which the query and a database sequence share at least two 3-mers are found, and the best
+ungapped segment on each of those diagonals is scored with BLOSUM62. The database sequences with the highest scores
+are passed to phmmer, which does the gapped alignment.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import json
+import logging
+import mmap
+import multiprocessing
+from pathlib import Path
+import tempfile
+
+from Bio.Align import substitution_matrices
+import numpy as np
+
+from mrparse.mr_fasta_index import fasta_metadata, index_paths, scan_fasta
+from mrparse.mr_output import AtomicFile
+from mrparse.mr_timing import span
+
+PACKED_SUFFIX = '.mrppack'
+PACKED_VERSION = 1
+KMER_LENGTH = 3
+MIN_DIAGONAL_HITS = 2
+MIN_SCORE = 40
+DEFAULT_CANDIDATES = 5000
+CHUNK_RESIDUES = 4 * 1024 * 1024
+BUILD_CHUNK_RESIDUES = 64 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+BLOSUM62 = substitution_matrices.load('BLOSUM62')
+ALPHABET = BLOSUM62.alphabet
+# Only the 20 standard amino acids are used in k-mers
+NSTANDARD = 20
+UNKNOWN = ALPHABET.index('X')
+SEPARATOR = len(ALPHABET)
+SEPARATOR_SCORE = -1000
+
+_CODES = np.full(256, UNKNOWN, dtype=np.uint8)
+for _i, _aa in enumerate(ALPHABET):
+    _CODES[ord(_aa)] = _CODES[ord(_aa.lower())] = _i
+_CODES[ord('>')] = SEPARATOR
+
+# The scores of each residue code against each other, with the separator between the sequences scoring so low that
+# no ungapped segment can extend across it
+SCORES = np.full((SEPARATOR + 1, SEPARATOR + 1), SEPARATOR_SCORE, dtype=np.int32)
+SCORES[:SEPARATOR, :SEPARATOR] = np.array(BLOSUM62, dtype=np.int32)
+
+
+def encode(sequence):
+    """Return the residue codes of a sequence (str or bytes)"""
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', errors='replace')
+    return _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def kmer_values(codes, k=KMER_LENGTH):
+    """Return the k-mers of an array of residue codes as integers, with -1 for k-mers of non-standard residues"""
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    values = np.zeros(n, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    for j in range(k):
+        window = codes[j:j + n]
+        values = values * NSTANDARD + window
+        valid &= window < NSTANDARD
+    values[~valid] = -1
+    return values
+
+
+class PackedDatabase(object):
+    """The sequences of a FASTA database packed into one memory-mapped array of residue codes
+
+    The sequences are separated by SEPARATOR codes. starts holds the position of each sequence in the packed array
+    (with a final entry for the end of the array) and records the byte range of each sequence in the FASTA file.
+    """
+
+    def __init__(self, fasta, directory):
+        self.fasta = str(fasta)
+        self.directory = str(directory)
+        path = Path(directory)
+        self.codes = np.load(path.joinpath('codes.npy'), mmap_mode='r')
+        self.starts = np.load(path.joinpath('starts.npy'), mmap_mode='r')
+        self.records = np.load(path.joinpath('records.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def build(cls, fasta, directory=None):
+        """Pack fasta, writing the arrays to directory or the first writable location of index_paths"""
+        candidates = [Path(directory)] if directory else index_paths(fasta, suffix=PACKED_SUFFIX)
+        for path in candidates:
+            try:
+                path.mkdir(parents=True, exist_ok=True)
+                return cls._build(fasta, path)
+            except OSError as e:
+                logger.debug(f"Cannot write packed sequence database to {path}: {e}")
+        raise RuntimeError(f"Cannot write a packed copy of sequence database: {fasta}")
+
+    @classmethod
+    def _build(cls, fasta, path):
+        logger.info(f"Packing sequence database {fasta}")
+        records, lengths = [], []
+        for _, offset, end, length in scan_fasta(fasta):
+            records.append((offset, end))
+            lengths.append(length)
+        records = np.array(records, dtype=np.uint64).reshape(-1, 2)
+        starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.array(lengths, dtype=np.int64) + 1, out=starts[1:])
+
+        with AtomicFile(path.joinpath('codes.npy'), mode='wb') as w:
+            codes = np.lib.format.open_memmap(w.tmp_path, mode='w+', dtype=np.uint8, shape=(int(starts[-1]),))
+            with open(fasta, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                first = 0
+                while first < len(records):
+                    last = int(np.searchsorted(starts, starts[first] + BUILD_CHUNK_RESIDUES, side='right'))
+                    last = min(max(last, first + 1), len(records))
+                    sequences = [b''.join(data[int(o):int(e)].split(b'\n', 1)[1:]).translate(None, b'\r\n')
+                                 for o, e in records[first:last]]
+                    codes[starts[first]:starts[last]] = encode(b'>'.join(sequences) + b'>')
+                    first = last
+            codes.flush()
+            del codes
+        for name, array in (('starts.npy', starts), ('records.npy', records)):
+            with AtomicFile(path.joinpath(name), mode='wb') as w:
+                np.save(w, array)
+        with AtomicFile(path.joinpath('metadata.json')) as w:
+            w.write(json.dumps(dict(fasta_metadata(fasta, version=PACKED_VERSION), nsequences=len(records))))
+        logger.info(f"Packed {len(records)} sequences of {fasta} in {path}")
+        return cls(fasta, path)
+
+    @classmethod
+    def load(cls, fasta):
+        """Return the packed copy of fasta, or None if it doesn't exist or fasta has changed since it was packed"""
+        metadata = fasta_metadata(fasta, version=PACKED_VERSION)
+        for path in index_paths(fasta, suffix=PACKED_SUFFIX):
+            try:
+                with open(path.joinpath('metadata.json')) as fh:
+                    stored = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            if all(stored.get(key) == value for key, value in metadata.items()):
+                return cls(fasta, path)
+            logger.debug(f"Ignoring out of date packed sequence database {path}")
+        return None
+
+    @classmethod
+    def open(cls, fasta):
+        """Return the packed copy of fasta, packing it if necessary"""
+        return cls.load(fasta) or cls.build(fasta)
+
+    def shards(self, nshards):
+        """Split the sequences into up to nshards (first, last) ranges with similar numbers of residues"""
+        bounds = np.linspace(0, self.starts[-1], nshards + 1)
+        edges = np.unique(np.searchsorted(self.starts, bounds))
+        edges[-1] = len(self)
+        return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+    def write_sequences(self, numbers, fpath):
+        """Write the sequences with the given numbers to a new FASTA file, in the order of the database"""
+        with open(self.fasta, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                AtomicFile(fpath, mode='wb') as w:
+            for offset, end in self.records[np.sort(numbers)]:
+                record = data[int(offset):int(end)]
+                w.write(record if record.endswith(b'\n') else record + b'\n')
+        return len(numbers)
+
+
+def query_profile(query):
+    """Return the score of each position of the query against each residue code"""
+    return SCORES[encode(query)]
+
+
+def diagonal_hits(query_kmers, codes, k=KMER_LENGTH):
+    """Return the (query position, packed position) of each k-mer that the query shares with the packed codes"""
+    nkmers = NSTANDARD ** k
+    # Tables of the number of query positions of each k-mer and the first of them in order, with a final entry
+    # for the invalid k-mers (-1)
+    order = np.argsort(query_kmers, kind='stable')
+    order = order[query_kmers[order] >= 0]
+    kmer_counts = np.bincount(query_kmers[order], minlength=nkmers + 1)
+    kmer_first = np.cumsum(kmer_counts) - kmer_counts
+    values = kmer_values(codes, k)
+    values[values < 0] = nkmers
+    counts = kmer_counts[values]
+    left = kmer_first[values]
+    positions = np.repeat(np.arange(len(values)), counts)
+    first = np.repeat(left, counts)
+    rank = np.arange(len(positions)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[first + rank], positions
+
+
+def best_segment_scores(profile, codes, segment_starts, query_starts, lengths):
+    """Return the score of the best ungapped segment of each of a set of diagonals
+
+    Diagonal n aligns the lengths[n] residues of the query from query_starts[n] with the codes from
+    segment_starts[n]. The best segment is found from the running sum of the scores along each diagonal, as the
+    largest rise of the running sum from its lowest earlier value.
+    """
+    nsegments = len(lengths)
+    if not nsegments:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.zeros(nsegments, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    segment = np.repeat(np.arange(nsegments), lengths)
+    step = np.arange(len(segment)) - offsets[segment]
+    scores = profile[query_starts[segment] + step, codes[segment_starts[segment] + step]].astype(np.int64)
+    running = np.cumsum(scores)
+    # Make the running sums restart at 0 at the start of each diagonal
+    running -= np.repeat(running[offsets] - scores[offsets], lengths)
+    previous = running - scores
+    # Shift each diagonal below all the earlier ones so that the running minimum also restarts on each diagonal
+    shift = segment * (2 * int(np.abs(profile).max()) * int(lengths.max()) + 1)
+    lowest = np.minimum.accumulate(previous - shift) + shift
+    return np.maximum(np.maximum.reduceat(running - lowest, offsets), 0)
+
+
+def score_sequences(profile, query_kmers, codes, starts, k=KMER_LENGTH, min_diagonal_hits=MIN_DIAGONAL_HITS):
+    """Return the numbers (within starts) of the sequences with diagonal hits and their best ungapped scores
+
+    Parameters
+    ----------
+    codes : :obj:`numpy.ndarray`
+       The packed residue codes of the sequences
+    starts : :obj:`numpy.ndarray`
+       The start of each sequence in codes, and the end of the last sequence
+    """
+    query_positions, positions = diagonal_hits(query_kmers, codes, k)
+    if not len(positions):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    sequences = np.searchsorted(starts, positions, side='right') - 1
+    diagonals = positions - query_positions
+    # Keep the diagonals of each sequence with enough hits
+    ndiagonals = len(codes) + len(profile)
+    keys, counts = np.unique(sequences * ndiagonals + diagonals + len(profile), return_counts=True)
+    keys = keys[counts >= min_diagonal_hits]
+    if not len(keys):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    sequences, diagonals = keys // ndiagonals, keys % ndiagonals - len(profile)
+    # Clip each diagonal to the query and its sequence
+    first = np.maximum(starts[sequences], diagonals)
+    last = np.minimum(starts[sequences + 1] - 1, diagonals + len(profile))
+    scores = best_segment_scores(profile, codes, first, first - diagonals, last - first)
+    best = np.zeros(len(starts) - 1, dtype=np.int64)
+    np.maximum.at(best, sequences, scores)
+    numbers = np.unique(sequences)
+    return numbers, best[numbers]
+
+
+def top_scores(numbers, scores, ncandidates):
+    """Return the ncandidates (numbers, scores) with the highest scores"""
+    if len(numbers) > ncandidates:
+        top = np.argpartition(-scores, ncandidates - 1)[:ncandidates]
+        numbers, scores = numbers[top], scores[top]
+    return numbers, scores
+
+
+def scan_shard(directory, query, first, last, ncandidates=DEFAULT_CANDIDATES, min_score=MIN_SCORE):
+    """Return the numbers and scores of the best scoring sequences first to last of a packed database
+
+    This is run in the worker processes, which each memory-map the packed database.
+    """
+    codes = np.load(Path(directory).joinpath('codes.npy'), mmap_mode='r')
+    starts = np.load(Path(directory).joinpath('starts.npy'), mmap_mode='r')
+    profile = query_profile(query)
+    query_kmers = kmer_values(encode(query))
+    numbers, scores = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    while first < last:
+        end = int(np.searchsorted(starts, starts[first] + CHUNK_RESIDUES, side='right')) - 1
+        end = min(max(end, first + 1), last)
+        chunk_starts = np.asarray(starts[first:end + 1]) - starts[first]
+        chunk_numbers, chunk_scores = score_sequences(profile, query_kmers,
+                                                      np.asarray(codes[starts[first]:starts[end]]), chunk_starts)
+        keep = chunk_scores >= min_score
+        numbers.append(chunk_numbers[keep] + first)
+        scores.append(chunk_scores[keep])
+        first = end
+    return top_scores(np.concatenate(numbers), np.concatenate(scores), ncandidates)
+
+
+def ungapped_prefilter(query, fasta, fpath, ncandidates=DEFAULT_CANDIDATES, nproc=1, min_score=MIN_SCORE, cache=True):
+    """Write the ncandidates sequences of fasta with the best ungapped alignments to the query to fpath
+
+    The database is split between nproc worker processes. Processes cannot be started from a daemonic process (such
+    as a multiprocessing.Pool worker), in which case threads are used, which still run the NumPy code in parallel.
+    The packed copy of the database is kept for later searches unless cache is False.
+
+    Returns
+    -------
+    nsequences : int
+       The number of sequences in fasta, which should be given to phmmer with -Z
+    """
+    with span('prefilter', method='ungapped', candidates=ncandidates), contextlib.ExitStack() as stack:
+        if cache:
+            database = PackedDatabase.open(fasta)
+        else:
+            database = PackedDatabase.build(fasta, directory=stack.enter_context(tempfile.TemporaryDirectory()))
+        shards = database.shards(max(1, nproc))
+        args = [(database.directory, query, first, last, ncandidates, min_score) for first, last in shards]
+        if len(shards) > 1:
+            daemonic = multiprocessing.current_process().daemon
+            executor_class = ThreadPoolExecutor if daemonic else ProcessPoolExecutor
+            with executor_class(max_workers=len(shards)) as executor:
+                results = list(executor.map(scan_shard, *zip(*args)))
+        else:
+            results = [scan_shard(*a) for a in args]
+        numbers, scores = top_scores(np.concatenate([r[0] for r in results]),
+                                     np.concatenate([r[1] for r in results]), ncandidates)
+        database.write_sequences(numbers, fpath)
+        nsequences = len(database)
+        # Release the memory-mapped arrays before any temporary copy is removed
+        del database
+    logger.info(f"Selected {len(numbers)} of the {nsequences} sequences of {fasta} with an ungapped alignment "
+                f"score of at least {min_score} to the target sequence")
+    return nsequences
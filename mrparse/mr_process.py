@@ -0,0 +1,212 @@
+"""
+Created on 19 Oct 2026
+
+Running of external programs.
+
+The output of a program is streamed to a file (or discarded) rather than being held in memory, so programs
+like phmmer that can write hundreds of MB don't need to be buffered in Python. Only the last few lines are
+kept to report if the program fails. The wall time and peak memory use (resident set size) of each program
+are recorded on the ProcessResult it returns.
+"""
+import collections
+import copy
+import logging
+import os
+from pathlib import Path
+import subprocess
+import time
+
+from mrparse.mr_timing import span
+
+TAIL_LINES = 50
+TAIL_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessError(subprocess.CalledProcessError):
+    """Raised when a program exits with a non-zero return code"""
+
+    def __init__(self, result):
+        super(ProcessError, self).__init__(result.returncode, result.cmd, output=result.tail)
+        self.result = result
+
+    def __str__(self):
+        return f"{super(ProcessError, self).__str__()}\nLast lines of output:\n{self.result.tail}"
+
+
+class ProcessResult(object):
+    """The outcome of running a program
+
+    Attributes
+    ----------
+    cmd : list
+       The command that was run
+    returncode : int
+    wall_time : float
+       The time taken in seconds
+    max_rss : int
+       The peak resident set size of the program in bytes (None if it could not be measured)
+    tail : str
+       The last lines of the output
+    output : str
+       The complete output if it was captured, otherwise None
+    stdout : str
+       The file the output was written to, if any
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.returncode = None
+        self.wall_time = None
+        self.max_rss = None
+        self.tail = ''
+        self.output = None
+        self.stdout = None
+
+    def __str__(self):
+        rss = 'unknown' if self.max_rss is None else f"{self.max_rss / 1024 ** 2:.1f} MB"
+        return (f"{Path(str(self.cmd[0])).name} exited with code {self.returncode} after {self.wall_time:.2f}s "
+                f"(peak RSS {rss})")
+
+
+def process_environment():
+    """Return the environment for external programs
+
+    PYTHONPATH is unset so programs that run their own Python (such as ccp4-python scripts) don't inherit ours.
+    """
+    env = copy.copy(os.environ)
+    env.pop('PYTHONPATH', None)
+    return env
+
+
+def run_process(cmd, stdout=None, capture=False, cwd=None, env=None, check=True, tail_lines=TAIL_LINES):
+    """Run a program, streaming its output (stdout and stderr combined) to a file
+
+    Parameters
+    ----------
+    cmd : list
+       The command to run
+    stdout : str or file object
+       A path or an open file to write the output to. If None the output is discarded (apart from the tail).
+    capture : bool
+       Keep the complete output in memory and return it as ProcessResult.output. Only use this for programs
+       with small outputs.
+    cwd : str
+       The directory to run the program in
+    env : dict
+       The environment to run the program in [process_environment()]
+    check : bool
+       Raise a ProcessError if the program exits with a non-zero return code
+    tail_lines : int
+       The number of lines at the end of the output to keep for error reporting
+
+    Returns
+    -------
+    :obj:`ProcessResult`
+    """
+    cmd = [str(c) for c in cmd]
+    result = ProcessResult(cmd)
+    logger.debug("Running cmd: %s", " ".join(cmd))
+    if env is None:
+        env = process_environment()
+
+    close_stdout = False
+    if stdout is not None and not hasattr(stdout, 'fileno'):
+        result.stdout = str(stdout)
+        stdout = open(stdout, 'wb')
+        close_stdout = True
+    elif stdout is not None:
+        result.stdout = getattr(stdout, 'name', None)
+        stdout.flush()
+    start = time.perf_counter()
+    try:
+        with span(Path(cmd[0]).name) as s:
+            if stdout is not None and not capture:
+                # The program writes straight to the file without the output passing through Python
+                process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=stdout, stderr=subprocess.STDOUT,
+                                           cwd=cwd, env=env)
+                _wait(process, result)
+            else:
+                process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT, cwd=cwd, env=env)
+                tail, output = _stream(process.stdout, stdout, tail_lines, capture)
+                _wait(process, result)
+                result.tail = tail
+                if capture:
+                    result.output = output
+            s.attrs.update(returncode=result.returncode, max_rss=result.max_rss)
+    finally:
+        result.wall_time = time.perf_counter() - start
+        if close_stdout:
+            stdout.close()
+    if result.stdout and not result.tail:
+        result.tail = read_tail(result.stdout, tail_lines)
+
+    logger.debug(str(result))
+    if check and result.returncode != 0:
+        raise ProcessError(result)
+    return result
+
+
+def _stream(pipe, stdout, tail_lines, capture):
+    """Copy the output from pipe to stdout in blocks, returning the last tail_lines lines (and all of it if
+    capture is set)"""
+    tail = collections.deque(maxlen=tail_lines)
+    chunks = [] if capture else None
+    if stdout is not None:
+        stdout = getattr(stdout, 'buffer', stdout)  # Write bytes to text files
+    partial = b''
+    with pipe:
+        for block in iter(lambda: pipe.read(READ_SIZE), b''):
+            if stdout is not None:
+                stdout.write(block)
+            if capture:
+                chunks.append(block)
+            lines = (partial + block).split(b'\n')
+            partial = lines.pop()
+            tail.extend(lines[-tail_lines:])
+    if partial:
+        tail.append(partial)
+    output = _decode(b''.join(chunks)).replace('\r\n', '\n') if capture else None
+    return _decode(b'\n'.join(tail)), output
+
+
+def _wait(process, result):
+    """Wait for process to finish, recording its return code and peak memory use"""
+    if hasattr(os, 'wait4'):
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            result.returncode = process.wait()
+            return
+        process.returncode = _exit_code(status)
+        result.returncode = process.returncode
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        result.max_rss = rusage.ru_maxrss if os.uname().sysname == 'Darwin' else rusage.ru_maxrss * 1024
+    else:
+        result.returncode = process.wait()
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def read_tail(fpath, nlines=TAIL_LINES, max_bytes=TAIL_BYTES):
+    """Return the last nlines lines of a file, reading at most max_bytes from the end of it"""
+    try:
+        with open(fpath, 'rb') as fh:
+            fh.seek(0, os.SEEK_END)
+            size = fh.tell()
+            fh.seek(max(0, size - max_bytes))
+            data = fh.read()
+    except OSError:
+        return ''
+    return _decode(b'\n'.join(data.split(b'\n')[-nlines:]))
+
+
+def _decode(data):
+    return data.decode('utf-8', errors='replace')
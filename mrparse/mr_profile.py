@@ -0,0 +1,221 @@
+"""
+Created on 19 Oct 2026
+
+Optional CPU (cProfile) and memory (tracemalloc) profiling of a MrParse run.
+
+Each profiled process writes its own files to the profile directory:
+
+* <name>_<pid>.prof - the cProfile statistics, which can be viewed with pstats or snakeviz
+* <name>_<pid>.snapshot - the tracemalloc snapshot of the memory still allocated at the end of the stage
+* <name>_<pid>_memory.txt - the peak memory use and the lines that allocated the most memory
+
+merge_profiles combines the files of all the processes into a single summary.
+"""
+import collections
+import contextlib
+import cProfile
+import glob
+import io
+import linecache
+import logging
+import os
+from pathlib import Path
+import pstats
+import tracemalloc
+
+PROFILE_MODES = ('cpu', 'mem', 'both')
+PROFILE_DIR = 'profiles'
+PROFILE_SUMMARY = 'profile_summary.txt'
+MERGED_PROFILE = 'merged.prof'
+TRACEMALLOC_FRAMES = 10
+TOP_ENTRIES = 40
+
+logger = logging.getLogger(__name__)
+
+_tracing_pid = None
+
+
+class Profiler(object):
+    """Profile the code run while the profiler is active
+
+    Parameters
+    ----------
+    name : str
+       The name of the profiled stage, used to name the output files
+    mode : str
+       One of PROFILE_MODES
+    directory : str
+       The directory to write the profiles to
+    """
+
+    def __init__(self, name, mode, directory=PROFILE_DIR):
+        if mode not in PROFILE_MODES:
+            raise RuntimeError(f"Unknown profile mode {mode} - must be one of: {', '.join(PROFILE_MODES)}")
+        self.name = name
+        self.mode = mode
+        self.directory = Path(directory).resolve()
+        self._profile = None
+        self._started_tracemalloc = False
+
+    @property
+    def cpu(self):
+        return self.mode in ('cpu', 'both')
+
+    @property
+    def mem(self):
+        return self.mode in ('mem', 'both')
+
+    def fpath(self, suffix):
+        return self.directory.joinpath(f"{self.name}_{os.getpid()}{suffix}")
+
+    def start(self):
+        global _tracing_pid
+        if self.mem and tracemalloc.is_tracing() and _tracing_pid != os.getpid():
+            # Tracing was inherited from the parent of a forked process, so restart it to only count this process
+            tracemalloc.stop()
+        if self.mem and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracing_pid = os.getpid()
+            self._started_tracemalloc = True
+        if self.cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(str(self.fpath('.prof')))
+            self._profile = None
+        if self.mem and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(str(self.fpath('.snapshot')))
+            _, peak = tracemalloc.get_traced_memory()
+            with open(self.fpath('_memory.txt'), 'w') as w:
+                w.write(f"Peak traced memory of {self.name} (pid {os.getpid()}): {_megabytes(peak)}\n\n")
+                w.write(memory_report(snapshot.statistics('lineno')))
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.stop()
+        except Exception as e:
+            # A failure to write the profiles shouldn't hide the outcome of the profiled code
+            logger.warning(f"Could not write the {self.name} profile: {e}")
+
+
+def profiling(name, mode, directory=PROFILE_DIR):
+    """Return a Profiler for the mode, or a context that does nothing if mode is None"""
+    if mode is None:
+        return contextlib.nullcontext()
+    return Profiler(name, mode, directory)
+
+
+class ProfiledCall(object):
+    """Call an object within a Profiler
+
+    Like the objects passed to the multiprocessing pool (which are called through __call__), this can be
+    pickled so is used to profile each of the pool workers.
+    """
+
+    def __init__(self, func, name, mode, directory=PROFILE_DIR):
+        self.func = func
+        self.name = name
+        self.mode = mode
+        self.directory = str(Path(directory).resolve())
+
+    def __call__(self, *args, **kwargs):
+        with Profiler(self.name, self.mode, self.directory):
+            return self.func(*args, **kwargs)
+
+
+def profiled(func, name, mode, directory=PROFILE_DIR):
+    """Return func wrapped in a ProfiledCall if mode is set, otherwise func itself"""
+    if mode is None:
+        return func
+    return ProfiledCall(func, name, mode, directory)
+
+
+def _megabytes(nbytes):
+    return f"{nbytes / 1024 ** 2:.1f} MB"
+
+
+def memory_report(statistics, limit=TOP_ENTRIES):
+    """Return a table of the lines of code that allocated the most memory
+
+    Parameters
+    ----------
+    statistics : list
+       (filename, lineno, size, count) tuples, or tracemalloc.Statistic objects
+    """
+    rows = []
+    for stat in statistics:
+        if isinstance(stat, tracemalloc.Statistic):
+            frame = stat.traceback[0]
+            stat = (frame.filename, frame.lineno, stat.size, stat.count)
+        rows.append(stat)
+    rows.sort(key=lambda r: r[2], reverse=True)
+    out = io.StringIO()
+    out.write(f"{'Size':>10} {'Blocks':>9}  Location\n")
+    for filename, lineno, size, count in rows[:limit]:
+        out.write(f"{_megabytes(size):>10} {count:>9}  {filename}:{lineno}\n")
+        line = linecache.getline(filename, lineno).strip()
+        if line:
+            out.write(f"{'':>21}  {line}\n")
+    other = rows[limit:]
+    if other:
+        out.write(f"{_megabytes(sum(r[2] for r in other)):>10} {sum(r[3] for r in other):>9}  "
+                  f"{len(other)} other locations\n")
+    out.write(f"Total allocated: {_megabytes(sum(r[2] for r in rows))}\n")
+    return out.getvalue()
+
+
+def merge_profiles(directory=PROFILE_DIR, summary=PROFILE_SUMMARY, limit=TOP_ENTRIES):
+    """Combine the profiles of all the processes in directory into a single summary
+
+    The CPU profiles are also merged into a single .prof file that can be loaded with pstats.
+
+    Returns
+    -------
+    summary : :obj:`pathlib.Path`
+       The path to the summary, or None if there were no profiles
+    """
+    directory = Path(directory)
+    prof_files = sorted(glob.glob(str(directory.joinpath('*_[0-9]*.prof'))))
+    snapshot_files = sorted(glob.glob(str(directory.joinpath('*.snapshot'))))
+    if not (prof_files or snapshot_files):
+        return None
+
+    out = io.StringIO()
+    if prof_files:
+        stats = pstats.Stats(*prof_files, stream=out)
+        stats.dump_stats(str(directory.joinpath(MERGED_PROFILE)))
+        out.write(f"CPU profile of {len(prof_files)} processes: {', '.join(Path(f).name for f in prof_files)}\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        out.write("\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(limit)
+    if snapshot_files:
+        totals = collections.defaultdict(lambda: [0, 0])
+        for fpath in snapshot_files:
+            for stat in tracemalloc.Snapshot.load(fpath).statistics('lineno'):
+                frame = stat.traceback[0]
+                total = totals[(frame.filename, frame.lineno)]
+                total[0] += stat.size
+                total[1] += stat.count
+        out.write(f"Memory allocated at the end of {len(snapshot_files)} processes:\n")
+        for fpath in sorted(glob.glob(str(directory.joinpath('*_memory.txt')))):
+            with open(fpath) as fh:
+                out.write(f"  {fh.readline()}")
+        out.write("\n")
+        out.write(memory_report([(f, l, s, c) for (f, l), (s, c) in totals.items()], limit=limit))
+
+    summary = directory.joinpath(summary)
+    with open(summary, 'w') as w:
+        w.write(out.getvalue())
+    return summary
@@ -7,8 +7,11 @@ import logging
 from mrparse import mr_homolog 
 from mrparse import mr_alphafold
 from mrparse import mr_hit
+from mrparse import mr_hmmer_api
 from mrparse.mr_region import RegionFinder
 from mrparse import mr_pfam
+from mrparse.mr_output import write_progress
+from mrparse.mr_timing import span
 from mrparse.mr_util import now
 
 logger = logging.getLogger(__name__)
@@ -31,6 +34,10 @@ class SearchModelFinder(object):
         self.max_hits = kwargs.get("max_hits", 10)
         self.database = kwargs.get("database", "all")
         self.nproc = kwargs.get("nproc", 1)
+        self.prefilter = kwargs.get("prefilter", None)
+        self.use_cache = kwargs.get("use_cache", True)
+        self.defer_ellg = kwargs.get("defer_ellg", False)
+        self.results_writer = kwargs.get("results_writer", None)
         self.hits = None
         self.model_hits = None
         self.regions = None
@@ -43,34 +50,56 @@ class SearchModelFinder(object):
         to the pool and instance methods don't work, so we add the object to the pool and define __call__
         https://stackoverflow.com/questions/1816958/cant-pickle-type-instancemethod-when-using-multiprocessing-pool-map/6975654#6975654
         """
+        api_search = None
+        if self.use_api and self.database in ["all", "afdb"] and self.search_engine != mr_hit.FASTPREFILTER:
+            # Run the EBI HMMER API search of the AlphaFold database while the PDB is searched locally
+            api_search = mr_hmmer_api.start_search(self.seq_info.sequence, max_hits=self.max_hits,
+                                                   use_cache=self.use_cache)
         if self.database in ["all", "pdb"]:
-            logger.debug(f'SearchModelFinder started at {now()}')
-            self.find_homolog_regions()
-            logger.debug(f'SearchModelFinder homolog regions done at {now()}')
-            self.prepare_homologs()
+            with span('homologs'):
+                logger.debug(f'SearchModelFinder started at {now()}')
+                self.find_homolog_regions()
+                logger.debug(f'SearchModelFinder homolog regions done at {now()}')
+                self.prepare_homologs()
+                self.write_progress('homologs', finished=not self.ellg_pending())
         if self.database in ["all", "afdb"]: 
-            logger.debug(f'SearchModelFinder homologs done at {now()}')
-            self.find_model_regions()
-            logger.debug(f'SearchModelFinder model regions done at {now()}')
-            self.prepare_models()
-            logger.debug(f'SearchModelFinder models done at {now()}')
+            with span('models'):
+                logger.debug(f'SearchModelFinder homologs done at {now()}')
+                self.find_model_regions(api_search=api_search)
+                logger.debug(f'SearchModelFinder model regions done at {now()}')
+                self.prepare_models()
+                logger.debug(f'SearchModelFinder models done at {now()}')
+                self.write_progress('models')
         return self
+
+    def write_progress(self, stage, finished=True):
+        """Update the results data files for the HTML report with the results of a stage"""
+        if not self.results_writer:
+            return
+        if stage == 'homologs':
+            write_progress(self.results_writer.write_homologs, self, finished=finished)
+        elif stage == 'models':
+            write_progress(self.results_writer.write_models, self, finished=finished)
     
     def find_homolog_regions(self):
         self.hits = mr_hit.find_hits(self.seq_info, search_engine=self.search_engine,
                                      hhsearch_exe=self.hhsearch_exe, hhsearch_db=self.hhsearch_db,
                                      afdb_seqdb=self.afdb_seqdb, pdb_seqdb=self.pdb_seqdb, phmmer_dblvl=self.phmmer_dblvl, 
-                                     use_api=self.use_api, max_hits=self.max_hits, nproc=self.nproc)
+                                     use_api=self.use_api, max_hits=self.max_hits, nproc=self.nproc,
+                                     prefilter=self.prefilter)
         if not self.hits:
             logger.critical('SearchModelFinder PDB search could not find any hits!')
             return None
         self.regions = RegionFinder().find_regions_from_hits(self.hits)
         return self.regions
 
-    def find_model_regions(self):
-        self.model_hits = mr_hit.find_hits(self.seq_info, search_engine="phmmer",
+    def find_model_regions(self, api_search=None):
+        # The AlphaFold database can only be searched with phmmer, with or without the ungapped prefilter
+        search_engine = mr_hit.FASTPREFILTER if self.search_engine == mr_hit.FASTPREFILTER else mr_hit.PHMMER
+        self.model_hits = mr_hit.find_hits(self.seq_info, search_engine=search_engine,
                                            hhsearch_exe=None, hhsearch_db=None, afdb_seqdb=self.afdb_seqdb, pdb_seqdb=self.pdb_seqdb, 
-                                           phmmer_dblvl="af2", use_api=self.use_api, max_hits=self.max_hits, nproc=self.nproc)
+                                           phmmer_dblvl="af2", use_api=self.use_api, max_hits=self.max_hits, nproc=self.nproc,
+                                           prefilter=self.prefilter, api_search=api_search, use_cache=self.use_cache)
         if not self.model_hits:
             logger.critical('SearchModelFinder EBI Alphafold database search could not find any hits!')
             return None
@@ -81,8 +110,26 @@ class SearchModelFinder(object):
         if not self.hits and self.regions:
             return None
         self.homologs = mr_homolog.homologs_from_hits(self.hits, self.pdb_dir, self.pdb_local)
-        if self.hkl_info:
-            mr_homolog.calculate_ellg(self.homologs, self.hkl_info)
+        if self.hkl_info and not self.defer_ellg:
+            # Show the homologs while the eLLG values are calculated
+            self.write_progress('homologs', finished=False)
+            mr_homolog.calculate_ellg(self.homologs, self.hkl_info, nproc=self.nproc)
+        return self.homologs
+
+    def ellg_pending(self):
+        """Return True if the eLLGs of the homologs have been left for calculate_ellg"""
+        return bool(self.defer_ellg and self.hkl_info and self.homologs)
+
+    def calculate_ellg(self):
+        """Calculate the eLLGs of the homologs if they were deferred with defer_ellg
+
+        When the SearchModelFinder is run in a multiprocessing.Pool worker, which cannot start processes, the
+        eLLGs are deferred so they can be calculated in parallel by the main process as soon as the worker returns.
+        """
+        if not self.ellg_pending():
+            return self.homologs
+        mr_homolog.calculate_ellg(self.homologs, self.hkl_info, nproc=self.nproc)
+        self.write_progress('homologs')
         return self.homologs
 
     def prepare_models(self):
@@ -93,15 +140,24 @@ class SearchModelFinder(object):
 
     def homologs_as_dicts(self):
         """Return a list of per homlog dictionaries serializable to JSON"""
-        if not (self.regions and len(self.regions)):
-            raise RuntimeError("No regions generated by SearchModelFinder")
-        return [h.static_dict for h in self.homologs.values()]
+        return list(self.iter_homolog_dicts())
 
     def models_as_dicts(self):
         """Return a list of per model dictionaries serializable to JSON"""
+        return list(self.iter_model_dicts())
+
+    def iter_homolog_dicts(self):
+        """Generate per homolog dictionaries serializable to JSON"""
+        if not (self.regions and len(self.regions)):
+            raise RuntimeError("No regions generated by SearchModelFinder")
+        return (h.static_dict for h in self.homologs.values())
+
+    def iter_model_dicts(self, nmodels=20):
+        """Generate per model dictionaries serializable to JSON for the nmodels models with the highest summed pLDDT"""
         if not (self.model_regions and len(self.model_regions)):
             raise RuntimeError("No regions generated by SearchModelFinder")
-        return sorted([m.static_dict for m in self.models.values()], key=lambda k: k['sum_plddt'], reverse=True)[:20]
+        models = sorted(self.models.values(), key=lambda m: m.sum_plddt, reverse=True)[:nmodels]
+        return (m.static_dict for m in models)
 
     def homologs_with_graphics(self):
         """List of homologs including PFAM graphics directives
@@ -110,10 +166,7 @@ class SearchModelFinder(object):
         list of homologs - this was just done because it made development quicker.
         The list of homologs and PFAM graphics needs to be kept separate
         """
-        if not (self.regions and len(self.regions)):
-            raise RuntimeError("No regions generated by SearchModelFinder")
-        mr_pfam.add_pfam_dict_to_homologs(self.homologs, self.seq_info.nresidues)
-        return self.homologs_as_dicts()
+        return list(self.iter_homologs_with_graphics())
 
     def models_with_graphics(self):
         """List of models including PFAM graphics directives
@@ -122,7 +175,18 @@ class SearchModelFinder(object):
         list of models - this was just done because it made development quicker.
         The list of models and PFAM graphics needs to be kept separate
         """
+        return list(self.iter_models_with_graphics())
+
+    def iter_homologs_with_graphics(self):
+        """Generate per homolog dictionaries including PFAM graphics directives"""
+        if not (self.regions and len(self.regions)):
+            raise RuntimeError("No regions generated by SearchModelFinder")
+        mr_pfam.add_pfam_dict_to_homologs(self.homologs, self.seq_info.nresidues)
+        return self.iter_homolog_dicts()
+
+    def iter_models_with_graphics(self):
+        """Generate per model dictionaries including PFAM graphics directives"""
         if not (self.model_regions and len(self.model_regions)):
             raise RuntimeError("No regions generated by SearchModelFinder")
         mr_pfam.add_pfam_dict_to_models(self.models, self.seq_info.nresidues)
-        return self.models_as_dicts()
+        return self.iter_model_dicts()
@@ -0,0 +1,80 @@
+"""
+Created on 19 Oct 2026
+
+Sequence identity of many pairwise alignments in a single vectorised call.
+
+The identities are those calculated by mrbump's simpleSeqID.getPercent for each alignment:
+
+* local identity - the percentage of the aligned columns (where neither sequence has a gap) that are identical
+* overall identity - the number of identical aligned columns as a percentage of the length of the target sequence
+
+All the alignments are concatenated into a single uint8 array so that the identities of every alignment are
+calculated with a few NumPy operations rather than a Python loop over each residue.
+"""
+import numpy as np
+
+GAP = ord('-')
+
+
+def encode(sequences):
+    """Concatenate sequences into a single uint8 array"""
+    return np.frombuffer(''.join(sequences).encode('ascii', errors='replace'), dtype=np.uint8)
+
+
+def segment_sums(values, lengths):
+    """Return the sums of consecutive segments of values with the given lengths"""
+    sums = np.zeros(len(lengths), dtype=np.int64)
+    nonempty = lengths > 0
+    if np.any(nonempty):
+        starts = np.cumsum(lengths) - lengths
+        sums[nonempty] = np.add.reduceat(values.astype(np.int64), starts[nonempty])
+    return sums
+
+
+def batch_identity(alignments, target_alignments, target_sequences):
+    """Calculate the local and overall sequence identity of a list of alignments
+
+    Parameters
+    ----------
+    alignments : list
+       The aligned sequences of the hits
+    target_alignments : list
+       The aligned target sequences, in the same order as alignments
+    target_sequences : list or str
+       The full target sequence of each alignment, or a single target sequence shared by all of them
+
+    Returns
+    -------
+    (local, overall) : (:obj:`numpy.ndarray`, :obj:`numpy.ndarray`)
+       The percentage identities of each alignment
+    """
+    nalignments = len(alignments)
+    if len(target_alignments) != nalignments:
+        raise RuntimeError("The number of alignments and target alignments must be the same")
+    if isinstance(target_sequences, str):
+        target_lengths = np.full(nalignments, len(target_sequences), dtype=np.int64)
+    else:
+        target_lengths = np.fromiter((len(s) for s in target_sequences), dtype=np.int64, count=nalignments)
+    if not nalignments:
+        return np.zeros(0), np.zeros(0)
+
+    # Columns are only compared up to the end of the shorter sequence of each pair
+    lengths = np.fromiter((min(len(a), len(t)) for a, t in zip(alignments, target_alignments)),
+                          dtype=np.int64, count=nalignments)
+    seq1 = encode([a[:n] for a, n in zip(alignments, lengths)])
+    seq2 = encode([t[:n] for t, n in zip(target_alignments, lengths)])
+
+    aligned = (seq1 != GAP) & (seq2 != GAP)
+    identical = aligned & (seq1 == seq2)
+    naligned = segment_sums(aligned, lengths)
+    nidentical = segment_sums(identical, lengths)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        local = np.where(naligned > 0, 100.0 * nidentical / naligned, 0.0)
+        overall = np.where(target_lengths > 0, 100.0 * nidentical / target_lengths, 0.0)
+    return local, overall
+
+
+def sequence_identity(alignment, target_alignment, target_sequence):
+    """Return the (local, overall) percentage identity of a single alignment"""
+    local, overall = batch_identity([alignment], [target_alignment], target_sequence)
+    return float(local[0]), float(overall[0])
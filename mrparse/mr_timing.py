@@ -0,0 +1,220 @@
+"""
+Created on 19 Oct 2026
+
+Timing and resource use of the stages of a MrParse run.
+
+Each stage is wrapped in a span, either with the span context manager or the timed decorator. A span records
+its wall and CPU time, the bytes downloaded while it was open and the peak memory use (resident set size) of
+the process and of any programs it ran.
+
+The stages run in different processes, so when timing is enabled (enable_timings) each process appends its
+finished spans to its own file in the timings directory whenever an outermost span closes. write_timings
+gathers the spans from all the processes along with a summary of each stage.
+
+This module only uses the standard library so that it can be imported by any other module (including
+mr_process) without creating import cycles.
+"""
+import contextlib
+import functools
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TIMINGS_DIR_ENV = 'MRPARSE_TIMINGS_DIR'
+SPANS_FILE_PATTERN = 'spans_*.jsonl'
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_finished = []
+
+
+class Span(object):
+    """The timing and resource use of a stage
+
+    Attributes
+    ----------
+    name : str
+       The name of the stage
+    parent : str
+       The name of the span this span was opened within
+    start : float
+       The time the span was opened (seconds since the epoch)
+    wall_time : float
+       The elapsed time in seconds
+    cpu_time : float
+       The CPU time used by the thread in seconds
+    bytes_downloaded : int
+       The number of bytes downloaded while the span was open
+    peak_rss : int
+       The peak resident set size of the process in bytes when the span closed
+    children_peak_rss : int
+       The largest peak resident set size of the programs run by the process when the span closed
+    attrs : dict
+       Any other information about the stage
+    """
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.pid = os.getpid()
+        self.start = time.time()
+        self.wall_time = None
+        self.cpu_time = None
+        self.bytes_downloaded = 0
+        self.peak_rss = None
+        self.children_peak_rss = None
+        self.attrs = attrs
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.thread_time()
+
+    def finish(self):
+        self.wall_time = time.perf_counter() - self._start_wall
+        self.cpu_time = time.thread_time() - self._start_cpu
+        self.peak_rss, self.children_peak_rss = peak_rss()
+
+    def as_dict(self):
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+
+
+def peak_rss():
+    """Return the peak resident set size in bytes of this process and of its largest child process"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if os.uname().sysname == 'Darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    """Return the innermost open span of this thread, or None"""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Record the timing and resource use of the code within a with block
+
+    Examples
+    --------
+    >>> with span('search', engine='phmmer') as s:
+    ...     run_phmmer()
+    ...     s.attrs['nhits'] = len(hits)
+    """
+    stack = _stack()
+    s = Span(name, parent=stack[-1].name if stack else None, **attrs)
+    stack.append(s)
+    try:
+        yield s
+    finally:
+        s.finish()
+        stack.pop()
+        if stack:
+            stack[-1].bytes_downloaded += s.bytes_downloaded
+        with _lock:
+            _finished.append(s)
+        if not stack:
+            flush_spans()
+
+
+def timed(name=None, **attrs):
+    """Decorator that records a span for each call of a function"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__, **attrs):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def add_bytes_downloaded(nbytes):
+    """Add to the bytes downloaded by the innermost open span of this thread"""
+    s = current_span()
+    if s is not None:
+        s.bytes_downloaded += nbytes
+
+
+def enable_timings(directory):
+    """Write the spans of this process, and any processes it starts, to files in directory"""
+    os.environ[TIMINGS_DIR_ENV] = str(Path(directory).resolve())
+
+
+def timings_dir():
+    directory = os.environ.get(TIMINGS_DIR_ENV)
+    return Path(directory) if directory else None
+
+
+def flush_spans():
+    """Append the finished spans of this process to its file in the timings directory"""
+    directory = timings_dir()
+    with _lock:
+        spans = list(_finished)
+        if directory is None:
+            if len(_finished) > 1000:  # Nothing will collect them
+                del _finished[:]
+            return
+        del _finished[:]
+    if not spans:
+        return
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory.joinpath(f'spans_{os.getpid()}.jsonl'), 'a') as w:
+            for s in spans:
+                w.write(json.dumps(s.as_dict(), default=str) + '\n')
+    except OSError as e:
+        logger.debug(f"Could not write timings: {e}")
+
+
+def collect_spans(directory=None):
+    """Return all the spans written to the timings directory, ordered by start time"""
+    flush_spans()
+    directory = Path(directory) if directory else timings_dir()
+    spans = []
+    if directory is None or not directory.is_dir():
+        return spans
+    for fpath in directory.glob(SPANS_FILE_PATTERN):
+        with open(fpath) as fh:
+            spans.extend(json.loads(line) for line in fh if line.strip())
+    spans.sort(key=lambda s: s['start'])
+    return spans
+
+
+def summarise_spans(spans):
+    """Return the totals for each stage name"""
+    stages = {}
+    for s in spans:
+        stage = stages.setdefault(s['name'], {'name': s['name'], 'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                               'bytes_downloaded': 0, 'peak_rss': 0})
+        stage['count'] += 1
+        stage['wall_time'] += s['wall_time']
+        stage['cpu_time'] += s['cpu_time']
+        if s['parent'] is None or s['parent'] != s['name']:
+            stage['bytes_downloaded'] += s['bytes_downloaded']
+        stage['peak_rss'] = max(stage['peak_rss'], s['peak_rss'] or 0, s['children_peak_rss'] or 0)
+    return sorted(stages.values(), key=lambda stage: stage['wall_time'], reverse=True)
+
+
+def gather_timings(directory=None):
+    """Return all the recorded spans and a summary of each stage"""
+    spans = collect_spans(directory)
+    return {'summary': summarise_spans(spans), 'spans': spans}
@@ -5,22 +5,29 @@ Created on 16 Nov 2018
 """
 
 import logging
-import os
 from pathlib import Path
 import shutil
-import time
+import xml.etree.ElementTree as ET
 import zipfile
 
-from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation
-from mrparse.mr_util import now, run_cmd
-
+import requests
 
-class OutOfTimeException(Exception):
-    pass
+from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation
+from mrparse.mr_archive import iter_archive_members
+from mrparse.mr_poll import Backoff, Deadline, PollTimeoutError, wait_for_job, RUNNING, FINISHED, FAILED
+from mrparse.mr_util import now
 
+OutOfTimeException = PollTimeoutError
 
 POLL_TIME = 2
 MAX_POLL_TIME = 120
+BATCH_POLL_TIME_PER_SEQUENCE = 60
+TOPCONS_WSDL_URL = "http://topcons.net/pred/api_submitseq/?wsdl"
+TOPCONS_REQUEST_TIMEOUT = 60  # seconds
+WSDL_NS = 'http://schemas.xmlsoap.org/wsdl/'
+WSDL_SOAP_NS = 'http://schemas.xmlsoap.org/wsdl/soap/'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
 
 TM = AnnotationSymbol()
 TM.symbol = 'M'
@@ -30,41 +37,214 @@ TM.stype = 'Transmembrane Helix'
 logger = logging.getLogger(__name__)
 
 
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_wsdl(wsdl):
+    """Read the endpoint and the document/literal operations of a SOAP service from its WSDL
+
+    Parameters
+    ----------
+    wsdl : bytes or str
+       The WSDL document
+
+    Returns
+    -------
+    dict
+       'location' (the endpoint URL), 'namespace' (of the request elements), 'qualified' (whether the parameter
+       elements are in the namespace) and 'operations': the (soapAction, [parameter names]) of each operation
+    """
+    root = ET.fromstring(wsdl)
+    address = root.find(f'.//{{{WSDL_NS}}}service/{{{WSDL_NS}}}port/{{{WSDL_SOAP_NS}}}address')
+    if address is None:
+        raise RuntimeError("Cannot find the SOAP endpoint in the WSDL")
+    schema = root.find(f'{{{WSDL_NS}}}types/{{{XSD_NS}}}schema')
+    if schema is None:
+        raise RuntimeError("Cannot find the XML schema in the WSDL")
+    elements = {e.get('name'): e for e in schema.findall(f'{{{XSD_NS}}}element')}
+    types = {t.get('name'): t for t in schema.findall(f'{{{XSD_NS}}}complexType')}
+    operations = {}
+    for operation in root.findall(f'{{{WSDL_NS}}}binding/{{{WSDL_NS}}}operation'):
+        name = operation.get('name')
+        soap_operation = operation.find(f'{{{WSDL_SOAP_NS}}}operation')
+        element = elements.get(name)
+        if element is None:
+            continue
+        # The request element either refers to a named complexType or defines its own
+        if element.get('type'):
+            complex_type = types.get(element.get('type').split(':')[-1])
+        else:
+            complex_type = element.find(f'{{{XSD_NS}}}complexType')
+        params = []
+        if complex_type is not None:
+            params = [e.get('name') for e in complex_type.iter(f'{{{XSD_NS}}}element')]
+        soap_action = soap_operation.get('soapAction', '') if soap_operation is not None else ''
+        operations[name] = (soap_action, params)
+    return {'location': address.get('location'),
+            'namespace': schema.get('targetNamespace', root.get('targetNamespace')),
+            'qualified': schema.get('elementFormDefault') == 'qualified',
+            'operations': operations}
+
+
+class TopConsClient(object):
+    """Client for the TopCons SOAP API: https://topcons.net/pred/help-wsdl-api/
+
+    This makes the same submitjob and checkjob calls as the topcons2_wsdl.py script, but from within the process
+    and without needing a SOAP library.
+    """
+
+    def __init__(self, wsdl_url=TOPCONS_WSDL_URL, timeout=TOPCONS_REQUEST_TIMEOUT, session=None):
+        self.wsdl_url = wsdl_url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self._service = None
+
+    @property
+    def service(self):
+        """The endpoint and operations of the service, read from the WSDL when first needed"""
+        if self._service is None:
+            response = self.session.get(self.wsdl_url, timeout=self.timeout)
+            response.raise_for_status()
+            self._service = parse_wsdl(response.content)
+        return self._service
+
+    def call(self, operation, *args):
+        """Call an operation and return the first row of the array of strings that it returns"""
+        service = self.service
+        try:
+            soap_action, params = service['operations'][operation]
+        except KeyError:
+            raise RuntimeError(f"TopCons service has no operation: {operation}")
+        namespace = service['namespace']
+        envelope = ET.Element(f'{{{SOAP_ENV_NS}}}Envelope')
+        request = ET.SubElement(ET.SubElement(envelope, f'{{{SOAP_ENV_NS}}}Body'), f'{{{namespace}}}{operation}')
+        for param, value in zip(params, args):
+            ET.SubElement(request, f'{{{namespace}}}{param}' if service['qualified'] else param).text = value
+        response = self.session.post(service['location'], data=ET.tostring(envelope, encoding='utf-8'),
+                                     headers={'Content-Type': 'text/xml; charset=utf-8',
+                                              'SOAPAction': f'"{soap_action}"'},
+                                     timeout=self.timeout)
+        try:
+            root = ET.fromstring(response.content)
+        except ET.ParseError:
+            response.raise_for_status()
+            raise RuntimeError(f"Cannot parse TopCons {operation} response: {response.text}")
+        fault = root.find(f'.//{{{SOAP_ENV_NS}}}Fault')
+        if fault is not None:
+            raise RuntimeError(f"TopCons {operation} failed: {fault.findtext('faultstring')}")
+        response.raise_for_status()
+        for element in root.iter():
+            children = list(element)
+            if children and all(_local_name(c.tag) == 'string' for c in children):
+                return [c.text or '' for c in children]
+        raise RuntimeError(f"No results in TopCons {operation} response: {response.text}")
+
+    def submit(self, sequence):
+        """Submit the sequence(s) in FASTA format and return the jobid"""
+        jobid, result_url, numseq, errinfo, warninfo = self.call('submitjob', sequence, '', '', '')[:5]
+        if jobid in ("", "None"):
+            raise RuntimeError(f"Error submitting topcons job: {errinfo}")
+        if warninfo not in ("", "None"):
+            logger.warning(f"TopCons job {jobid}: {warninfo}")
+        return jobid
+
+    def status(self, jobid):
+        """Return the (state, message) of a job, where the message of a finished job is the URL of its results"""
+        status, result_url, errinfo = self.call('checkjob', jobid)[:3]
+        if status == "Finished":
+            return FINISHED, result_url
+        elif status == "Failed":
+            return FAILED, errinfo
+        elif status == "None":
+            raise RuntimeError(f"Incorrect jobid: {jobid}")
+        return RUNNING, status
+
+    def download(self, result_url, path):
+        """Download the results archive of a job to path"""
+        with self.session.get(result_url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as w:
+                for block in response.iter_content(chunk_size=1 << 16):
+                    w.write(block)
+        return path
+
+
 class TMPred(object):
+    CACHE_VERSION = 1
     
-    def __init__(self, seq_info):
+    def __init__(self, seq_info, client=None, deadline=None, cancel=None):
         self.seq_info = seq_info
         self.prediction = None
-        self.topcons_script = str(Path(__file__).parent.resolve().joinpath('scripts', 'topcons2_wsdl.py'))
+        self.client = client or TopConsClient()
         self.poll_time = POLL_TIME
         self.max_poll_time = MAX_POLL_TIME
+        self.deadline = deadline
+        self.cancel = cancel
 
     def parse_topcons_directory(self, results_dir):
         assert Path(results_dir).exists(), f"Cannot find directory: {results_dir}"
         results_file = Path(results_dir, 'query.result.txt')
         return self.parse_topcons_output(str(results_file))
 
+    @staticmethod
+    def iter_archive_results(ziparchive):
+        """Parse the predictions straight from the query.result.txt file in a TopCons results archive
+
+        The archive for a job is called <jobid>.zip and holds the results file for all the sequences in
+        <jobid>/query.result.txt. See parse_topcons_results for what is yielded.
+        """
+        results_file = f'{Path(ziparchive).stem}/query.result.txt'
+        for name, fh in iter_archive_members(ziparchive, results_file):
+            if name == results_file:
+                yield from TMPred.parse_topcons_results(fh)
+                return
+        raise RuntimeError(f"Cannot find {results_file} in TopCons results archive: {ziparchive}")
+
     @staticmethod
     def parse_topcons_output(results_file):
         with open(results_file) as fh:
-            line = fh.readline()
-            while line:
-                if line.startswith('TOPCONS predicted topology:'):
-                    prediction = fh.readline().strip()
-                if line.startswith('Predicted TOPCONS reliability'):
-                    fh.readline()
+            for seqnum, prediction, probabilties in TMPred.parse_topcons_results(fh):
+                return prediction, probabilties
+        raise RuntimeError(f"No predictions found in TopCons results file: {results_file}")
+
+    @staticmethod
+    def parse_topcons_results(fh):
+        """Parse the predictions for each sequence in a TopCons results file
+
+        A results file for a job with several sequences contains a block for each sequence starting with
+        a 'Sequence number:' line.
+
+        Yields
+        ------
+        (seqnum, prediction, probabilities) for each sequence, where seqnum starts from 1
+        """
+        seqnum = 1
+        prediction = None
+        probabilties = None
+        line = fh.readline()
+        while line:
+            if line.startswith('Sequence number:'):
+                if prediction is not None and probabilties is not None:
+                    yield seqnum, prediction, TMPred.fix_probabilties(prediction, probabilties)
+                seqnum = int(line.split(':')[1])
+                prediction = probabilties = None
+            if line.startswith('TOPCONS predicted topology:'):
+                prediction = fh.readline().strip()
+            if line.startswith('Predicted TOPCONS reliability'):
+                fh.readline()
+                line = fh.readline().strip()
+                probabilties = []
+                while line:
+                    try:
+                        seqid, prob = line.split()
+                    except ValueError:
+                        break
+                    probabilties.append((int(seqid), float(prob)))
                     line = fh.readline().strip()
-                    probabilties = []
-                    while line:
-                        try:
-                            seqid, prob = line.split()
-                        except ValueError:
-                            break
-                        probabilties.append((int(seqid), float(prob)))
-                        line = fh.readline().strip()
-                line = fh.readline()
-        probabilties = TMPred.fix_probabilties(prediction, probabilties)
-        return prediction, probabilties
+            line = fh.readline()
+        if prediction is not None and probabilties is not None:
+            yield seqnum, prediction, TMPred.fix_probabilties(prediction, probabilties)
     
     def create_annotation(self, annotation, probabilties):
         ann = SequenceAnnotation()
@@ -99,69 +279,92 @@ class TMPred(object):
         return probabilities
 
     @staticmethod
-    def cleanup(results_dir):
-        if Path(results_dir).exists():
-            shutil.rmtree(results_dir)
+    def cleanup(results_path):
+        """Remove a results archive or directory"""
+        results_path = Path(results_path)
+        if results_path.is_dir():
+            shutil.rmtree(results_path)
+        elif results_path.exists():
+            results_path.unlink()
     
-    def run_topcons(self, seqin):
+    def run_topcons(self, seqin, max_poll_time=None):
+        """Run a TopCons job and return the path to the results archive
+
+        The job is abandoned after max_poll_time seconds (self.max_poll_time by default), or sooner if the
+        deadline shared with the other predictors of the run passes first.
+        """
+        budget = max_poll_time or self.max_poll_time
+        deadline = self.deadline.limited(budget) if self.deadline else Deadline(budget)
         jobid = self.submit_job(seqin)
-        start = time.time()
-        while True:
-            elapsed_time = time.time() - start
-            if elapsed_time > self.max_poll_time:
-                raise OutOfTimeException(f"Exceed maximum runtime of: {self.max_poll_time}")
-            if self.job_finished(jobid):
-                break
-            time.sleep(self.poll_time)
-        results_dir = self.get_results(jobid)
-        return results_dir
-    
+        wait_for_job(lambda: self.job_state(jobid),
+                     backoff=Backoff(initial=self.poll_time, maximum=max(self.poll_time, self.max_poll_time / 4)),
+                     deadline=deadline, cancel=self.cancel, description=f'TopCons job {jobid}')
+        return self.get_results(jobid)
+
     def submit_job(self, seqin):
-        cmd = [self.topcons_script, '-m', 'submit', '-seq', seqin]
-        out = run_cmd(cmd)
-        jobid = None
-        for line in out.split(os.linesep):
-            if line.startswith("You have successfully submitted your job"):
-                jobid = line.split('=')[1].strip()
-        if jobid is None:
-            raise RuntimeError(f"Error submitting topcons job: {out}")
-        return jobid
-        
-    def job_finished(self, jobid):
-        """
-        Your job with jobid rst_rUF74H is finished!
-        The result file ./rst_rUF74H.zip has been retrieved for jobid rst_rUF74H
-        """
-        cmd = [self.topcons_script, '-m', 'get', '-jobid', jobid]
-        out = run_cmd(cmd)
-        _jobid = None
-        for line in out.split(os.linesep):
-            if line.endswith("finished!"):
-                _jobid = line.split()[4]
-                if _jobid != jobid:
-                    raise RuntimeError(f"Error collecting topcons job: {out}")
-                else:
-                    return True
-            elif line.endswith("Please check you typing!"):
-                raise RuntimeError(f"Incorrect jobid: {jobid}")
-        return False
+        with open(seqin) as fh:
+            return self.client.submit(fh.read())
+
+    def job_state(self, jobid):
+        """Return the (state, message) of a job, downloading the results archive if it has finished"""
+        state, message = self.client.status(jobid)
+        if state == FINISHED:
+            self.client.download(message, f'{jobid}.zip')
+            return FINISHED, None
+        return state, message
 
-    
     def get_results(self, jobid):
         ziparchive = jobid + '.zip'
         if not zipfile.is_zipfile(ziparchive):
             raise RuntimeError(f'File is not a valid zip archive: {ziparchive}')
-        zipf = zipfile.ZipFile(ziparchive)
-        if not zipf.infolist():
-            raise RuntimeError(f'Empty zip file: {ziparchive}')
-        zipf.extractall()
-        assert Path(jobid).exists()
-        return Path(jobid).resolve()
+        with zipfile.ZipFile(ziparchive) as zipf:
+            if not zipf.infolist():
+                raise RuntimeError(f'Empty zip file: {ziparchive}')
+        return Path(ziparchive).resolve()
     
+    def batch_predictions(self, sequences, max_poll_time=None):
+        """Run a single TopCons job for several sequences
+
+        Parameters
+        ----------
+        sequences : dict
+           Sequences keyed by name
+        max_poll_time : float
+           The number of seconds to wait for the job, by default MAX_POLL_TIME plus BATCH_POLL_TIME_PER_SEQUENCE for
+           each sequence as TopCons runs the sequences of a job one after another
+
+        Returns
+        -------
+        dict
+           The predicted annotation for each name (sequences without a prediction are missing)
+        """
+        names = list(sequences)
+        seqin = 'topcons_batch.fasta'
+        with open(seqin, 'w') as w:
+            for i, name in enumerate(names):
+                w.write(f">seq_{i}\n{sequences[name]}\n")
+        logger.info(f"Submitting TopCons batch job with {len(names)} sequences")
+        if max_poll_time is None:
+            max_poll_time = self.max_poll_time + BATCH_POLL_TIME_PER_SEQUENCE * len(names)
+        try:
+            ziparchive = self.run_topcons(seqin, max_poll_time=max_poll_time)
+        finally:
+            Path(seqin).unlink()
+        predictions = {}
+        for seqnum, prediction, probabilities in self.iter_archive_results(ziparchive):
+            predictions[names[seqnum - 1]] = self.create_annotation(prediction, probabilities)
+        missing = set(names) - set(predictions)
+        if missing:
+            logger.warning(f"TopCons batch job returned no predictions for: {sorted(missing)}")
+        self.cleanup(ziparchive)
+        return predictions
+
     def get_prediction(self):
         logger.debug(f"TMPred starting prediction at: {now()}")
-        topcons_dir = self.run_topcons(self.seq_info.sequence_file)
-        prediction, scores = self.parse_topcons_directory(topcons_dir)
+        ziparchive = self.run_topcons(self.seq_info.sequence_file)
+        results = self.iter_archive_results(ziparchive)
+        seqnum, prediction, scores = next(results)
+        results.close()
         self.prediction = self.create_annotation(prediction, scores)
         logger.debug(f"TMPred finished prediction at: {now()}")
-        self.cleanup(topcons_dir)
+        self.cleanup(ziparchive)
@@ -3,13 +3,18 @@ Created on 14 Dec 2018
 
 @author: jmht
 """
-import copy
 import datetime
+import json
 import logging
 import os
 from pathlib import Path
-import subprocess
-import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from mrparse.mr_process import run_process
 
 logger = logging.getLogger(__name__)
 
@@ -62,30 +67,51 @@ def make_workdir(dir_name_stem='mrparse'):
     return str(work_dir)
 
 
+def json_dumps(obj):
+    """Serialise obj to a JSON string, using orjson if it is available
+
+    Parameters
+    ----------
+    obj : object
+       A JSON serialisable object - numpy scalars and arrays are also accepted
+
+    Returns
+    -------
+    str
+
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+                            default=_json_default).decode('utf-8')
+    return json.dumps(obj, default=_json_default)
+
+
+def _json_default(obj):
+    """Convert numpy types that the JSON encoders cannot handle natively"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def static_properties(cls):
+    """Class decorator that records the properties included in a class's static_dict
+
+    The property getters are collected once when the class is created so that static_dict
+    doesn't need to search the class with dir() every time an object is serialised.
+    """
+    cls.STATIC_PROPERTIES = tuple((name, getattr(cls, name).fget) for name in dir(cls)
+                                  if name != 'static_dict' and isinstance(getattr(cls, name), property))
+    return cls
+
+
 def now():
     return datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
 
 
 def run_cmd(cmd):
-    """Should replace with pyjob
-    
-    Always set PYTHONPATH to null so processes don't inherit our environment
-    This needs some thinking about
+    """Run a command and return its output
+
+    The whole output is held in memory, so this should only be used for programs with small outputs - use
+    mr_process.run_process to stream the output of other programs to a file.
     """
-    logger.debug("Running cmd: %s", " ".join(cmd))
-    optd = {'stderr': subprocess.STDOUT}
-    pythonpath = 'PYTHONPATH'
-    if pythonpath in os.environ:
-        env = copy.copy(os.environ)
-        env.pop(pythonpath)
-        optd['env'] = env
-    optd['encoding'] = 'utf-8'
-    try:
-        out = subprocess.check_output(cmd, **optd)
-    except Exception as e:
-        logger.debug("Error submitting cmd %s: %s", cmd, e)
-        logger.debug("Traceback is:", exc_info=sys.exc_info())
-        logger.debug("Output from job is: %s", e)
-        raise (e)
-    logger.debug("%s got output: %s", cmd, out)
-    return out
+    return run_process(cmd, capture=True).output
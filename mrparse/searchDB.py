@@ -11,14 +11,15 @@
 #
 
 import os, sys
-import subprocess
 import shlex
 import time
 import pickle
 
-from mrbump.seq_align import simpleSeqID
 from mrbump.tools import MRBUMP_utils
 
+from mrparse.mr_process import run_process
+from mrparse.mr_seqid import batch_identity
+
 
 class PHHit:
     def __init__(self):
@@ -127,6 +128,9 @@ class phmmer:
         count = 1
         scoreList=[]
         TEMPresultsDict = dict([])
+        alignedHits = []
+        if not isinstance(phmmerALNLog, list):
+            phmmerALNLog = list(phmmerALNLog)
         for line in phmmerALNLog:
 
             if "No hits satisfy inclusion thresholds; no alignment saved" in line:
@@ -211,13 +215,9 @@ class phmmer:
             if "E-value" in line and "score" in line and "bias" in line and "Sequence" in line:
                 CAPTURE = True
 
-        # Open the Phmmer log file
-        if os.name == "nt":
-            plog = open(self.logfile, "r", newline="\r\n")
-        else:
-            plog = open(self.logfile, "r")
-        lines = plog.readlines()
-        plog.close()
+        # The lines of the log are needed again to grab the alignments, so use those we were given rather than
+        # reading the log file a second time
+        lines = phmmerALNLog
 
         import copy
 
@@ -289,12 +289,7 @@ class phmmer:
                             self.resultsDict[hitname].tarExtent = (int(endT) - int(startT))
                             self.resultsDict[hitname].tarMidpoint = ((float(endT) - float(startT)) / 2.0) + float(startT)
     
-                            simpSID = simpleSeqID.simpleSeqID()
-                            local, overall = simpSID.getPercent(self.resultsDict[hitname].alignment,
-                                                                self.resultsDict[hitname].targetAlignment, targetSequence)
-    
-                            self.resultsDict[hitname].localSEQID = local
-                            self.resultsDict[hitname].overallSEQID = overall
+                            alignedHits.append(hitname)
                             gr = MRBUMP_utils.getPDBres()
                             if self.resultsDict[hitname].expdta != "AFDB":
                                 self.resultsDict[hitname].resolution, self.resultsDict[hitname].expdta, self.resultsDict[hitname].releaseDate \
@@ -302,6 +297,14 @@ class phmmer:
                         
             count = count + 1
 
+        # Calculate the sequence identities of all the alignments at once
+        if alignedHits:
+            local, overall = batch_identity([self.resultsDict[h].alignment for h in alignedHits],
+                                            [self.resultsDict[h].targetAlignment for h in alignedHits], targetSequence)
+            for hitname, localSEQID, overallSEQID in zip(alignedHits, local, overall):
+                self.resultsDict[hitname].localSEQID = float(localSEQID)
+                self.resultsDict[hitname].overallSEQID = float(overallSEQID)
+
         # Figure out the domains for the target that have been matched
         domCount = 1
         self.targetDomainDict[domCount] = Domains()
@@ -384,48 +387,18 @@ class phmmer:
             sys.stdout.write("Phmmer command line:\n  %s\n" % command_line)
             sys.stdout.write("\n")
 
-        # Launch program
+        # Launch program, writing the output straight to the log file
         if os.name == "nt":
             process_args = shlex.split(command_line, posix=False)
-            p = subprocess.Popen(
-                process_args,
-                bufsize=0,
-                shell="False",
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT)
         else:
             process_args = shlex.split(command_line)
-            p = subprocess.Popen(process_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-        (child_stdout, child_stdin) = (p.stdout, p.stdin)
-
-        # Write the input
-        child_stdin.close()
+        run_process(process_args, stdout=self.logfile, check=False)
 
-        # Open the log file for writing
-        log = open(self.logfile, "w")
-        phmmerALNLog = []
-
-        # Watch the output for successful termination
-        out = child_stdout.readline().decode()
-
-        while out:
-            phmmerALNLog.append(out)
-            if debug == True:
-                sys.stdout.write(out)
-
-            if '[ok]' in out:
-                self.termination = True
-
-            if "E-value" in out and "score" in out and "bias" in out and "Sequence" in out:
-                out = child_stdout.readline().decode()
-
-            log.write(out)
-            log.flush()
-            out = child_stdout.readline().decode()
-
-        child_stdout.close()
+        with open(self.logfile) as log:
+            phmmerALNLog = log.readlines()
+        if debug == True:
+            sys.stdout.writelines(phmmerALNLog)
+        self.termination = any('[ok]' in line for line in phmmerALNLog)
 
         # Get the alignemnts for each of the hits
         self.getPhmmerAlignments(targetSequence, phmmerALNLog, PDBLOCAL=PDBLOCAL, DB=DB, seqMetaDB=seqMetaDB)
@@ -4,11 +4,18 @@ from pathlib import Path
 import pytest
 from collections import namedtuple
 
+from mrparse.mr_cache import CACHE_DIR_ENV
 from mrparse.mr_hit import _find_hits, _find_json_hits
 import data_constants
 
 
 # Pytest fixtures
+@pytest.fixture(autouse=True)
+def mrparse_cache_dir(tmp_path, monkeypatch):
+    """Keep the disk caches used by the tests out of the user's cache directory"""
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path.joinpath('cache')))
+
+
 @pytest.fixture(scope="session")
 def test_data():
     """Return a namedtuple object with the paths to all the data files we require.
@@ -28,6 +35,7 @@ def test_data():
         'jpred_tgz': str(Path(data_dir, 'jp_5or_zBY.tar.gz')),
         'phaser_log': str(Path(data_dir, 'phaser1.log')),
         'x5hxg_fasta': str(Path(data_dir, '5hxg.fasta')),
+        'x5lm4_mtz': str(Path(data_dir, 'example_data', '5lm4-sf.mtz')),
         'pdb_dir': str(Path(data_dir, 'pdbs'))
     }
     nt = namedtuple('TestData', d.keys())
@@ -0,0 +1,112 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import logging
+from pathlib import Path
+import time
+
+import pytest
+
+from mrparse import mr_analyse
+from mrparse.mr_analyse import (HTML_DIR, HTML_OUT, HTML_TEMPLATE_PDB, get_template, run_analyse_parallel,
+                                template_environment, write_html_report, write_html_reports)
+from mrparse.mr_output import ResultsWriter
+
+
+class MockFinder(object):
+    """A SearchModelFinder that records when its deferred eLLGs are calculated"""
+
+    def __init__(self, directory, nproc):
+        self.directory = directory
+        self.nproc = nproc
+        self.defer_ellg = False
+
+    def __call__(self):
+        return self
+
+    def calculate_ellg(self):
+        if self.defer_ellg:
+            Path(self.directory, 'ellg').touch()
+
+
+class MockClassifier(object):
+    """A classifier that runs until the eLLGs have been calculated (or 30 seconds)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.ellg_done = False
+
+    def __call__(self):
+        marker = Path(self.directory, 'ellg')
+        start = time.time()
+        while not marker.exists() and time.time() - start < 30:
+            time.sleep(0.05)
+        self.ellg_done = marker.exists()
+        return self
+
+
+def test_write_html_report(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = ResultsWriter(stages=['homologs'])
+    html_out = write_html_report(writer, database='pdb')
+    assert html_out == tmp_path.joinpath(HTML_OUT)
+    content = html_out.read_text()
+    assert f'{HTML_DIR}/vue.min.js' in content
+    assert 'mrparse_homologs.js' in content
+    assert '{{' not in content
+
+    # Later reports reuse the environment and the compiled template
+    assert template_environment() is template_environment(str(HTML_DIR))
+    template = get_template(HTML_TEMPLATE_PDB)
+    write_html_report(writer, database='pdb')
+    assert get_template(HTML_TEMPLATE_PDB) is template
+    assert html_out.read_text() == content
+
+
+def test_write_html_reports(tmp_path, monkeypatch):
+    templates = []
+
+    def counted_get_template(in_file_path):
+        templates.append(in_file_path)
+        return get_template(in_file_path)
+
+    monkeypatch.setattr(mr_analyse, 'get_template', counted_get_template)
+    reports = [(tmp_path.joinpath(f'target{i}', HTML_OUT), ResultsWriter(stages=['models'])) for i in range(3)]
+    for html_out, _ in reports:
+        html_out.parent.mkdir()
+    html_outs = write_html_reports(reports, database='afdb', assets_dir=tmp_path)
+    assert html_outs == [html_out for html_out, _ in reports]
+    # The template is compiled once and the static files are copied once for all the reports
+    assert len(templates) == 1
+    html_dir = tmp_path.joinpath('html')
+    assert html_dir.joinpath('vue.min.js').exists()
+    assert not list(html_dir.glob('*.jinja2'))
+    for html_out in html_outs:
+        content = html_out.read_text()
+        assert f'{html_dir}/vue.min.js' in content
+        assert 'mrparse_models.js' in content
+
+
+@pytest.fixture
+def analyse_logger(monkeypatch):
+    # The logger is otherwise only set up by mr_analyse.run
+    monkeypatch.setattr(mr_analyse, 'logger', logging.getLogger(mr_analyse.__name__))
+
+
+def test_run_analyse_parallel(tmp_path, analyse_logger):
+    finder, classifier, _ = run_analyse_parallel(MockFinder(tmp_path, nproc=2), MockClassifier(tmp_path), None,
+                                                 do_classify=True)
+    # The deferred eLLGs are calculated while the classifier is still running
+    assert finder.defer_ellg
+    assert classifier.ellg_done
+
+
+def test_run_analyse_parallel_nproc1(tmp_path, analyse_logger):
+    finder, _, _ = run_analyse_parallel(MockFinder(tmp_path, nproc=1), None, None, do_classify=False)
+    # With one processor the eLLGs are calculated by the SearchModelFinder in the pool worker
+    assert not finder.defer_ellg
+    assert not tmp_path.joinpath('ellg').exists()
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
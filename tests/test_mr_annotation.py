@@ -0,0 +1,66 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import numpy as np
+from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation, NULL_ANNOTATION, get_annotation_chunks
+
+HELIX = AnnotationSymbol(name='helix', symbol='H', stype='Alpha Helix')
+SHEET = AnnotationSymbol(name='sheet', symbol='E', stype='B strand')
+CC = AnnotationSymbol(name='CC', symbol='C', stype='Coiled-coil Helix')
+
+
+def make_annotation(annotation, scores, symbols, source):
+    ann = SequenceAnnotation()
+    ann.source = source
+    for s in symbols:
+        ann.library_add_annotation(s)
+    ann.annotation = annotation
+    ann.scores = scores
+    return ann
+
+
+def test_annotation_attributes():
+    ann = make_annotation(['H', 'H', '-'], ['0.5', '0.7', '0.1'], [HELIX], 'test')
+    assert ann.annotation == 'HH-'
+    assert ann.annotation[0:2] == 'HH'
+    assert len(ann) == 3
+    assert ann[1] == HELIX
+    assert ann[1].score == 0.7
+    assert ann[2] == NULL_ANNOTATION
+    ann.add_annotation(ann[0])
+    assert ann.annotation == 'HH-H'
+    assert list(ann.scores) == [0.5, 0.7, 0.1, 0.5]
+
+
+def test_add():
+    ss = make_annotation('HHH--EE-', [1.0] * 8, [HELIX, SHEET], 'ss')
+    cc = make_annotation('-CCCC---', [0.0, 0.9, 0.8, 0.7, 0.6, 0.0, 0.0, 0.0], [CC], 'cc')
+    consensus = ss + cc
+    assert consensus.annotation == 'H--CCEE-'
+    assert list(consensus.scores) == [1.0, 0.0, 0.0, 0.7, 0.6, 1.0, 1.0, 0.0]
+    assert set(consensus.annotation_library) == {'H', 'E', 'C'}
+
+
+def test_get_annotation_chunks():
+    ann = make_annotation('HHH--EEHH-CC', np.linspace(0.0, 1.0, 12), [HELIX, SHEET, CC], 'test')
+    chunks = get_annotation_chunks(ann)
+    assert [(c.start, c.end) for c in chunks] == [(0, 3), (5, 7), (7, 9)]
+    assert [c.annotation for c in chunks] == [HELIX, SHEET, HELIX]
+    assert chunks[1].annotation.source == 'test'
+    assert get_annotation_chunks(None) is None
+    assert get_annotation_chunks(SequenceAnnotation()) == []
+
+
+def test_to_from_dict():
+    ann = make_annotation('HHH--EE-', np.linspace(0.0, 1.0, 8), [HELIX, SHEET], 'ss')
+    ann2 = SequenceAnnotation.from_dict(ann.to_dict())
+    assert ann2.annotation == ann.annotation
+    assert list(ann2.scores) == list(ann.scores)
+    assert ann2.source == 'ss'
+    assert ann2[0] == HELIX and ann2[0].source == 'ss'
+    assert [c.start for c in get_annotation_chunks(ann2)] == [0, 5]
+
+
+if __name__ == '__main__':
+    import sys
+    import pytest
+    pytest.main([__file__] + sys.argv[1:])
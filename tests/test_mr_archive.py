@@ -0,0 +1,65 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import conftest
+
+import io
+import os
+import tarfile
+import zipfile
+import pytest
+from mrparse.mr_archive import UnsafeArchiveError, check_member_name, iter_archive_members
+from mrparse.mr_jpred import JPred
+from mrparse.mr_topcons import TMPred, TM
+
+
+def test_check_member_name():
+    assert check_member_name('jp_abc/jp_abc.concise') == 'jp_abc/jp_abc.concise'
+    for name in ['../jp_abc.concise', '/etc/passwd', 'jp_abc/../../x', 'C:\\x']:
+        with pytest.raises(UnsafeArchiveError):
+            check_member_name(name)
+
+
+def test_jpred_archive(test_data, tmp_path):
+    download_tgz = tmp_path.joinpath('jp_abc.tar.gz')
+    with tarfile.open(download_tgz, 'w:gz') as tf:
+        tf.add(test_data.jpred_concise, arcname='jp_abc.concise')
+        data = b'not needed'
+        info = tarfile.TarInfo('jp_abc.html')
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+    ss_pred, cc_28 = JPred.parse_results_archive(download_tgz)
+    assert len(ss_pred) == 800
+    assert ss_pred[19:22] == 'EEE'
+    assert os.listdir(tmp_path) == ['jp_abc.tar.gz']
+
+
+def test_unsafe_archive(tmp_path):
+    download_tgz = tmp_path.joinpath('jp_abc.tar.gz')
+    with tarfile.open(download_tgz, 'w:gz') as tf:
+        data = b'jnetpred:-,H\n'
+        info = tarfile.TarInfo('../jp_abc.concise')
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+    with pytest.raises(UnsafeArchiveError):
+        JPred.parse_results_archive(download_tgz)
+
+
+def test_topcons_archive(test_data, tmp_path):
+    ziparchive = tmp_path.joinpath('rst_abc.zip')
+    with zipfile.ZipFile(ziparchive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.write(test_data.topcons_output, 'rst_abc/seq_0/query.result.txt')
+        zf.write(test_data.topcons_output, 'rst_abc/query.result.txt')
+    results = list(TMPred.iter_archive_results(ziparchive))
+    assert len(results) == 1
+    seqnum, prediction, scores = results[0]
+    assert len(prediction) == 685
+    assert prediction[212] == TM.symbol
+    assert [name for name, fh in iter_archive_members(ziparchive, 'query.result.txt')] == \
+        ['rst_abc/seq_0/query.result.txt', 'rst_abc/query.result.txt']
+    assert os.listdir(tmp_path) == ['rst_abc.zip']
+
+
+if __name__ == '__main__':
+    import sys
+    import pytest
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,53 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import os
+import time
+from mrparse.mr_cache import DiskCache, file_hash, sequence_hash
+
+
+def test_get_set(tmp_path):
+    cache = DiskCache('test', cache_dir=tmp_path)
+    key = cache.key(sequence_hash('MKVL'), 'jpred', 1)
+    assert key == cache.key(sequence_hash('mkvl\n'), 'jpred', 1)
+    assert key != cache.key(sequence_hash('MKVL'), 'jpred', 2)
+    assert cache.get(key) is None
+    cache.set(key, {'annotation': 'HH-', 'scores': [1.0, 1.0, 0.0]})
+    assert cache.get(key) == {'annotation': 'HH-', 'scores': [1.0, 1.0, 0.0]}
+    cache.delete(key)
+    assert cache.get(key) is None
+
+
+def test_ttl(tmp_path):
+    cache = DiskCache('test', cache_dir=tmp_path, ttl=60)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    cache.ttl = -1
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_max_entries(tmp_path):
+    cache = DiskCache('test', cache_dir=tmp_path, max_entries=2)
+    for i, key in enumerate(['a', 'b']):
+        cache.set(key, i)
+        os.utime(cache.path(key), (time.time() - 100 + i, time.time() - 100 + i))
+    cache.get('a')  # a is now the most recently used
+    cache.set('c', 2)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 0 and cache.get('c') == 2
+
+
+def test_file_hash(tmp_path):
+    fpath = tmp_path.joinpath('data.mtz')
+    fpath.write_bytes(b'MTZ data')
+    digest = file_hash(fpath)
+    assert file_hash(fpath, blocksize=3) == digest
+    fpath.write_bytes(b'Other MTZ data')
+    assert file_hash(fpath) != digest
+
+
+if __name__ == '__main__':
+    import sys
+    import pytest
+    pytest.main([__file__] + sys.argv[1:])
@@ -4,8 +4,15 @@ import conftest
 import logging
 import pytest
 
+from mrparse.mr_annotation import AnnotationSymbol, SequenceAnnotation
+from mrparse.mr_cache import DiskCache
+from mrparse import mr_classify
+from mrparse.mr_classify import PREDICTION_CACHE, MrClassifier, classify_batch
+from mrparse.mr_deepcoil import CCPred
+from mrparse.mr_deeptmhmm import TMPred
+from mrparse.mr_jpred import JPred
 from mrparse.mr_sequence import Sequence
-from mrparse.mr_classify import MrClassifier
+from mrparse.mr_topcons import TMPred as TopConsPred
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -19,6 +26,99 @@ def test_generate_null(test_data):
     assert classifier.classification_prediction is None
 
 
+def test_prediction_cache(test_data):
+    seq_info = Sequence(test_data.x2uvoA_fasta)
+    classifier = MrClassifier(seq_info=seq_info)
+    cache = DiskCache(PREDICTION_CACHE)
+    predictor = CCPred(seq_info, None)
+    assert not classifier.load_cached_prediction(predictor, cache)
+    predictor.prediction = SequenceAnnotation()
+    predictor.prediction.source = 'Deepcoil'
+    predictor.prediction.library_add_annotation(AnnotationSymbol(name='CC', symbol='C', stype='Coiled-coil Helix'))
+    predictor.prediction.annotation = 'CC-'
+    predictor.prediction.scores = [0.9, 0.8, 0.1]
+    classifier.cache_prediction(predictor, cache)
+    assert len(cache) == 1
+
+    predictor = CCPred(seq_info, None)
+    assert classifier.load_cached_prediction(predictor, cache)
+    assert predictor.prediction.annotation == 'CC-'
+    assert not classifier.load_cached_prediction(CCPred(seq_info, None), None)
+
+
+
+def test_classify_batch_cached(monkeypatch):
+    helix = AnnotationSymbol(name='helix', symbol='H', stype='Alpha Helix')
+    submitted = []
+
+    def batch_predictions(self, sequences):
+        submitted.append(sorted(sequences))
+        predictions = {}
+        for name, sequence in sequences.items():
+            predictions[name] = SequenceAnnotation()
+            predictions[name].source = 'JPred'
+            predictions[name].library_add_annotation(helix)
+            predictions[name].annotation = 'H' * len(sequence)
+            predictions[name].scores = [1.0] * len(sequence)
+        return predictions
+
+    monkeypatch.setattr(JPred, 'batch_predictions', batch_predictions)
+    sequences = {'a': 'MKVLAAG', 'b': 'GSWT'}
+    results = classify_batch(sequences, do_tm_predictor=False)
+    assert submitted == [['a', 'b']]
+    assert results['b']['ss_prediction'].annotation == 'HHHH'
+
+    # The second batch is served from the cache, apart from the new sequence
+    results = classify_batch(dict(sequences, c='PPG'), do_tm_predictor=False)
+    assert submitted == [['a', 'b'], ['c']]
+    assert results['a']['ss_prediction'].annotation == 'HHHHHHH'
+    assert results['c']['ss_prediction'].annotation == 'HHH'
+    assert results['a']['tm_prediction'] is None
+
+
+
+@pytest.mark.parametrize('deeptmhmm_pybiolib', [False, True])
+def test_classify_batch_tm_predictor(monkeypatch, deeptmhmm_pybiolib):
+    used = []
+    for predictor in (TMPred, TopConsPred):
+        monkeypatch.setattr(predictor, 'batch_predictions',
+                            lambda self, sequences: used.append(self.__class__) or {})
+    classify_batch({'a': 'MKVLAAG'}, do_ss_predictor=False, use_cache=False, deeptmhmm_pybiolib=deeptmhmm_pybiolib)
+    assert used == [TMPred if deeptmhmm_pybiolib else TopConsPred]
+
+
+def test_shared_deadline(test_data, monkeypatch):
+    deadlines = []
+    monkeypatch.setattr(JPred, 'get_prediction', lambda self: deadlines.append(self.deadline))
+    for predictor in (JPred, TopConsPred):
+        monkeypatch.setattr(predictor, 'batch_predictions',
+                            lambda self, sequences: deadlines.append(self.deadline) or {})
+    classifier = MrClassifier(seq_info=Sequence(test_data.x2uvoA_fasta), do_tm_predictor=False, do_cc_predictor=False,
+                              use_cache=False)
+    classifier.get_prediction()
+    assert deadlines == [classifier.deadline]
+    assert classifier.deadline.budget == mr_classify.CLASSIFY_MAX_RUNTIME
+
+    deadlines.clear()
+    classify_batch({'a': 'MKVLAAG'}, use_cache=False, max_runtime=600)
+    assert len(deadlines) == 2
+    assert deadlines[0] is deadlines[1]
+    assert deadlines[0].budget == 600
+
+
+def test_deadline_passed(test_data, monkeypatch):
+    started = []
+    monkeypatch.setattr(CCPred, 'get_prediction', lambda self: started.append(self.__class__))
+    monkeypatch.setattr(JPred, 'get_prediction', lambda self: started.append(self.__class__))
+    classifier = MrClassifier(seq_info=Sequence(test_data.x2uvoA_fasta), do_tm_predictor=False, use_cache=False,
+                              max_runtime=0)
+    classifier.get_prediction()
+    assert started == []
+    assert not classifier.do_cc_predictor
+    assert not classifier.do_ss_predictor
+    assert classifier.classification_prediction is None
+
+
 if __name__ == '__main__':
     import sys
     pytest.main([__file__] + sys.argv[1:])
\ No newline at end of file
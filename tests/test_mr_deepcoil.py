@@ -4,8 +4,9 @@ import pytest
 import configparser
 import logging
 import os
+from mrparse import mr_deepcoil
 from mrparse.mr_sequence import Sequence
-from mrparse.mr_deepcoil import CCPred
+from mrparse.mr_deepcoil import CCPred, deepcoil_windows, stitch_probabilities, DEEPCOIL_MAX_RESIDUES
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -25,6 +26,50 @@ def test_run(test_data):
     assert annotation.scores[0] > 0.01 # first few are always non-zero
 
 
+def test_deepcoil_windows():
+    assert deepcoil_windows(171) == [(0, 171)]
+    windows = deepcoil_windows(1234)
+    assert windows[0][0] == 0 and windows[-1][1] == 1234
+    assert all(end - start == DEEPCOIL_MAX_RESIDUES for start, end in windows)
+    assert all(w1[1] - w2[0] >= 50 for w1, w2 in zip(windows, windows[1:]))
+
+
+def test_stitch_probabilities():
+    windows = [(0, 4), (2, 6)]
+    probabilities = stitch_probabilities(6, windows, [[0.1, 0.2, 0.3, 0.4], [0.5, 0.6, 0.7, 0.8]])
+    assert list(probabilities) == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.7, 0.8])
+
+
+def test_dispatch(test_data, monkeypatch):
+    seq_info = Sequence(test_data.x2uvoA_fasta)
+    calls = []
+
+    def probabilities_in_process(sequences):
+        calls.append(sorted(sequences))
+        return {name: [0.9] * len(sequence) for name, sequence in sequences.items()}
+
+    monkeypatch.setattr(mr_deepcoil, 'probabilities_in_process', probabilities_in_process)
+    # The deepcoil script is used unless in_process is set, even if the deepcoil package is installed
+    with pytest.raises(RuntimeError, match="Cannot find or execute"):
+        CCPred(seq_info, '/nonexistent/deepcoil').get_prediction()
+    assert not calls
+    cc = CCPred(seq_info, '/nonexistent/deepcoil', in_process=True)
+    cc.get_prediction()
+    assert calls == [['query']]
+    assert len(cc.prediction) == 171
+
+
+def test_in_process(test_data):
+    pytest.importorskip('deepcoil')
+    seq_info = Sequence(test_data.x2uvoA_fasta)
+    cc = CCPred(seq_info, None, in_process=True)
+    cc.get_prediction()
+    assert len(cc.prediction) == 171
+    predictions = cc.batch_predictions({'a': seq_info.sequence, 'b': seq_info.sequence * 4, 'short': 'MKV'})
+    assert sorted(predictions) == ['a', 'b']
+    assert len(predictions['b']) == 4 * 171
+
+
 if __name__ == '__main__':
     import sys
     import pytest
@@ -0,0 +1,89 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import io
+from pathlib import Path
+
+import pytest
+
+from mrparse import mr_deeptmhmm
+from mrparse.mr_deeptmhmm import DEEPTMHMM_OUTPUT, TMPred, TM_alpha
+from mrparse.mr_sequence import Sequence
+
+THREELINE = """>seq_0 | TM
+MKVLLAAGLLLVAGSSAQA
+SSSSSOOOMMMMMMMMIII
+>seq_1 | GLOB
+MDVCVRLA
+IIIIIIII
+"""
+
+
+def test_parse_deeptmhmm_records():
+    records = dict(TMPred.parse_deeptmhmm_records(io.StringIO(THREELINE)))
+    assert records == {'seq_0': 'SSSSSOOOMMMMMMMMIII', 'seq_1': 'IIIIIIII'}
+    annotation = TMPred(None).create_annotation(records['seq_0'])
+    assert annotation[8] == TM_alpha
+    assert len(annotation) == 19
+
+
+
+class MockJob(object):
+    """A biolib job that predicts every residue of the sequences in its input to be inside the membrane"""
+
+    def __init__(self, args):
+        self.fasta = args.split()[1]
+
+    def save_files(self, output_dir):
+        with open(self.fasta) as fh:
+            records = fh.read().split('>')[1:]
+        Path(output_dir).mkdir()
+        with open(Path(output_dir, DEEPTMHMM_OUTPUT), 'w') as w:
+            for record in records:
+                name, sequence = record.split()
+                w.write(f">{name} | TM\n{sequence}\n{'M' * len(sequence)}\n")
+
+
+class MockApp(object):
+    def cli(self, args):
+        return MockJob(args)
+
+
+@pytest.fixture
+def seq_info(tmp_path):
+    seqin = tmp_path.joinpath('query.fasta')
+    seqin.write_text(">query\nMKVLLAAGLLLVAG\n")
+    return Sequence(str(seqin))
+
+
+def test_run_exe(seq_info, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(mr_deeptmhmm, 'deeptmhmm_app', lambda: pytest.fail("pybiolib used without use_pybiolib"))
+    commands = []
+
+    def run_process(cmd):
+        commands.append(cmd)
+        tmp_path.joinpath('biolib_results').mkdir()
+        tmp_path.joinpath('biolib_results', DEEPTMHMM_OUTPUT).write_text(THREELINE)
+
+    monkeypatch.setattr(mr_deeptmhmm, 'run_process', run_process)
+    tm = TMPred(seq_info, '/opt/biolib')
+    tm.get_prediction()
+    assert commands == [['/opt/biolib', 'run', 'DTU/DeepTMHMM', '--fasta', seq_info.sequence_file]]
+    assert tm.prediction.annotation == 'SSSSSOOOMMMMMMMMIIIIIIIIIII'
+    with pytest.raises(RuntimeError):
+        tm.batch_predictions({'a': 'MKVL'})
+
+
+def test_run_pybiolib(seq_info, monkeypatch):
+    monkeypatch.setattr(mr_deeptmhmm, 'deeptmhmm_app', MockApp)
+    monkeypatch.setattr(mr_deeptmhmm, 'run_process', lambda cmd: pytest.fail(f"Ran {cmd} with use_pybiolib"))
+    tm = TMPred(seq_info, '/opt/biolib', use_pybiolib=True)
+    tm.get_prediction()
+    assert tm.prediction.annotation == 'M' * 14
+    predictions = tm.batch_predictions({'a': 'MKVL', 'b': 'GSW'})
+    assert {name: p.annotation for name, p in predictions.items()} == {'a': 'MMMM', 'b': 'MMM'}
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,134 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import os
+
+import pytest
+
+from mrparse.mr_fasta_index import FastaIndex, accession, index_paths, scan_fasta
+from mrparse.mr_hit import SequenceHit, validate_hit_ranges
+
+SEQUENCES = {
+    'AF-A0A000-F1': 'MSKGEELFTGVVPILVELDGDVNGHKFSVSGEGEGDATYGKLTLKFICTTGKLPVPWPTLVTTFSYGVQCFSRYPDHMKQ',
+    'AF-A0A001-F1': 'MVLSEGEWQLVLHVWAKVEAD',
+    '101m_A': 'MVLSEGEWQLVLHVWAKVEADVAGHGQDILIRLFKSHPETLEKFDRVKHLKTEAEMKASEDLKKHGVTVLTALGAILKKKGHHEAELKPLAQSHATKHKIPIKYLEFISEAIIHVLHSRHPGDFGADAQGAMNKALELFRKDIAAKYKELGYQG',
+}
+
+
+def write_fasta(fpath, newline='\n', width=60):
+    with open(fpath, 'w', newline='') as w:
+        for key, sequence in SEQUENCES.items():
+            header = key if key.startswith('1') else f"AFDB:{key}"
+            w.write(f">{header} a description{newline}")
+            for i in range(0, len(sequence), width):
+                w.write(sequence[i:i + width] + newline)
+    return fpath
+
+
+@pytest.fixture
+def fasta(tmp_path):
+    return write_fasta(tmp_path.joinpath('sequences.fasta'))
+
+
+def test_accession():
+    assert accession('>AFDB:AF-A0A000-F1 Putative uncharacterized protein') == 'AF-A0A000-F1'
+    assert accession(b'>101m_A mol:protein length:154  MYOGLOBIN') == '101m_A'
+    assert accession('>') == ''
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_scan_fasta(tmp_path, newline):
+    fpath = write_fasta(tmp_path.joinpath('sequences.fasta'), newline=newline)
+    # A small read size checks records that span the blocks
+    records = list(scan_fasta(fpath, read_size=50))
+    assert [r[0] for r in records] == list(SEQUENCES)
+    assert [r[3] for r in records] == [len(s) for s in SEQUENCES.values()]
+    assert records[0][1] == 0 and records[-1][2] == os.path.getsize(fpath)
+
+
+def test_sequence(fasta):
+    with FastaIndex.open(fasta) as index:
+        assert len(index) == len(SEQUENCES)
+        for key, sequence in SEQUENCES.items():
+            assert index.sequence(key) == sequence
+            assert index.length(key) == len(sequence)
+        assert index.sequence('101m_A', 2, 5) == 'VLSE'
+        assert index.header('AF-A0A001-F1') == '>AFDB:AF-A0A001-F1 a description'
+        assert 'AF-A0A002-F1' not in index
+        assert index.length('AF-A0A002-F1') is None
+        with pytest.raises(KeyError):
+            index.sequence('AF-A0A002-F1')
+
+
+def test_validate_range(fasta):
+    with FastaIndex.open(fasta) as index:
+        assert index.validate_range('AF-A0A001-F1', 1, 21)
+        assert not index.validate_range('AF-A0A001-F1', 1, 22)
+        assert not index.validate_range('AF-A0A001-F1', 0, 10)
+        assert not index.validate_range('AF-A0A001-F1', 10, 9)
+        assert not index.validate_range('AF-A0A002-F1', 1, 10)
+
+
+def test_load(fasta):
+    assert FastaIndex.load(fasta) is None
+    FastaIndex.build(fasta).close()
+    assert os.path.exists(index_paths(fasta)[0])
+    assert FastaIndex.load(fasta) is not None
+    # The index is out of date once the database changes
+    with open(fasta, 'a') as w:
+        w.write(">AF-A0A002-F1\nMKV\n")
+    assert FastaIndex.load(fasta) is None
+    with FastaIndex.open(fasta) as index:
+        assert index.sequence('AF-A0A002-F1') == 'MKV'
+
+
+def test_cache_dir(fasta, tmp_path, monkeypatch):
+    cache_dir = tmp_path.joinpath('cache')
+    monkeypatch.setenv('MRPARSE_CACHE_DIR', str(cache_dir))
+    os.chmod(fasta.parent, 0o555)
+    try:
+        if os.access(fasta.parent, os.W_OK):
+            pytest.skip('Cannot make the database directory read-only')
+        with FastaIndex.open(fasta) as index:
+            assert index.index_path.startswith(str(cache_dir))
+            assert index.sequence('101m_A') == SEQUENCES['101m_A']
+    finally:
+        os.chmod(fasta.parent, 0o755)
+
+
+def test_shards(fasta, tmp_path):
+    with FastaIndex.open(fasta) as index:
+        shards = index.shard_ranges(2)
+        assert len(shards) == 2
+        contents = []
+        for i, (start, end) in enumerate(shards):
+            contents.append(index.write_shard(start, end, tmp_path.joinpath(f'shard{i}.fasta')).read_text())
+        assert ''.join(contents) == fasta.read_text()
+        keys = [r[0] for i in range(len(shards)) for r in scan_fasta(tmp_path.joinpath(f'shard{i}.fasta'))]
+        assert keys == list(SEQUENCES)
+        assert len(index.shard_ranges(10)) == len(SEQUENCES)
+
+
+def test_write_sequences(fasta, tmp_path):
+    fpath = tmp_path.joinpath('subset.fasta')
+    with FastaIndex.open(fasta) as index:
+        assert index.write_sequences(['101m_A', 'AF-A0A002-F1', 'AF-A0A000-F1'], fpath) == 2
+    assert [r[0] for r in scan_fasta(fpath)] == ['101m_A', 'AF-A0A000-F1']
+
+
+def test_validate_hit_ranges(fasta):
+    hits = {}
+    for name, pdb_id, chain_id, stop in (('ok', '101m', 'A', 154), ('long', 'AF-A0A001-F1', None, 30),
+                                         ('missing', 'AF-A0A002-F1', None, 30)):
+        hit = SequenceHit()
+        hit.name, hit.pdb_id, hit.chain_id, hit.hit_start, hit.hit_stop = name, pdb_id, chain_id, 1, stop
+        hits[name] = hit
+    # The hits are only checked against an index that already exists
+    assert list(validate_hit_ranges(dict(hits), fasta)) == ['ok', 'long', 'missing']
+    assert not any(path.exists() for path in index_paths(fasta))
+    FastaIndex.build(fasta).close()
+    assert list(validate_hit_ranges(hits, fasta)) == ['ok', 'missing']
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
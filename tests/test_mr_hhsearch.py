@@ -0,0 +1,119 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import io
+import os
+
+from Bio import SearchIO
+import pytest
+
+from mrparse.mr_hhsearch import HHSEARCH_DB_CACHE_ENV, database_prefix, iter_hhr_alignments, iter_hhr_hits
+
+HHR = """Query         2UVO_A
+Match_columns 171
+No_of_seqs    1 out of 1
+Neff          1.0
+Searched_HMMs 3
+Date          Tue Oct 19 12:00:00 2026
+Command       hhsearch -i 2uvoA.fasta -d pdb70/pdb70 -o hhsearch.log
+
+ No Hit                             Prob E-value P-value  Score    SS Cols Query HMM  Template HMM
+  1 2UVO_A Agglutinin isolectin 1  100.0 3.7E-34 1.2E-38  210.3   0.0  171    1-171     1-171 (171)
+  2 1ULK_A Lectin-C               99.9 2.1E-20 7.0E-25  120.0   0.0   80    5-84     10-89 (126)
+  3 1EN2_A Lectin                 99.0 1.0E-05 3.0E-10   40.0   0.0   40   30-69      1-40 (90)
+
+No 1
+>2UVO_A Agglutinin isolectin 1; AGGLUTININ, ISOLECTIN
+Probab=100.00  E-value=3.7e-34  Score=210.31  Aligned_cols=171  Identities=100%  Similarity=2.050  Sum_probs=166.9
+
+Q ss_pred             ceecc
+Q 2UVO_A            1 ERCGEQGSNMECPNNLCCSQYGYCGMGGDYCGKGCQNGACWTSKRCGSQAGGATCTNNQCCSQYGYCGFGAEYCGAGC   78 (171)
+Q Consensus       1 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~   78 (171)
+                      ||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||
+T Consensus       1 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~   78 (171)
+T 2UVO_A            1 ERCGEQGSNMECPNNLCCSQYGYCGMGGDYCGKGCQNGACWTSKRCGSQAGGATCTNNQCCSQYGYCGFGAEYCGAGC   78 (171)
+T ss_dssp             CCCCC
+
+Q 2UVO_A           79 QGGPCRADIKCGSQAGGKLCPNNLCCSQWGFCGLGSEFCGGGCQSGACSTDKPCGKDAGGRVCTNNYCCSKWGSCGIG  156 (171)
+T 2UVO_A           79 QGGPCRADIKCGSQAGGKLCPNNLCCSQWGFCGLGSEFCGGGCQSGACSTDKPCGKDAGGRVCTNNYCCSKWGSCGIG  156 (171)
+
+No 2
+>1ULK_A Lectin-C; chitin-binding protein
+Probab=99.90  E-value=2.1e-20  Score=120.00  Aligned_cols=80  Identities=40%  Similarity=0.800  Sum_probs=70.0
+
+Q 2UVO_A            5 EQGS-NMECPNNLCCSQ   20 (171)
+T 1ULK_A           10 EKGSANIECP--LCCSE   25 (126)
+
+No 3
+>1EN2_A Lectin
+Probab=99.00  E-value=1e-05  Score=40.00  Aligned_cols=40  Identities=30%  Similarity=0.500  Sum_probs=30.0
+
+Q 2UVO_A           30 CGKGCQNGAC   39 (171)
+T 1EN2_A            1 CGRGCSNGQC   10 (90)
+
+No 4
+>1ULK_A Lectin-C; chitin-binding protein
+Probab=90.00  E-value=0.5  Score=20.00  Aligned_cols=10  Identities=30%  Similarity=0.500  Sum_probs=8.0
+
+Q 2UVO_A          100 CGSQAGGKLC  109 (171)
+T 1ULK_A           90 CGTQAGNKLC   99 (126)
+
+Done!
+"""
+
+
+def test_alignments_match_searchio():
+    alignments = list(iter_hhr_alignments(io.StringIO(HHR)))
+    hsps = sorted((hsp for hit in SearchIO.read(io.StringIO(HHR), 'hhsuite2-text') for hsp in hit.hsps),
+                  key=lambda h: h.output_index)
+    assert len(alignments) == len(hsps) == 4
+    for aln, hsp in zip(alignments, hsps):
+        assert aln.index == hsp.output_index
+        assert aln.hit_id == hsp.hit_id
+        assert aln.evalue == hsp.evalue
+        assert aln.score == hsp.score
+        assert (aln.query_start, aln.query_end) == hsp.query_range
+        assert (aln.hit_start, aln.hit_end) == hsp.hit_range
+        assert aln.query_seq == str(hsp.query.seq)
+        assert aln.hit_seq == str(hsp.hit.seq)
+    assert alignments[1].description == 'Lectin-C; chitin-binding protein'
+
+
+def test_hits():
+    hits = [(rank, score, aln.index) for rank, score, aln in iter_hhr_hits(io.StringIO(HHR))]
+    assert hits == [(1, 210.31, 0), (2, 120.0, 1), (3, 40.0, 2), (2, 120.0, 3)]
+
+
+def test_hits_max_hits():
+    fh = io.StringIO(HHR)
+    hits = [(rank, aln.hit_id) for rank, _, aln in iter_hhr_hits(fh, max_hits=2)]
+    assert hits == [(1, '2UVO_A'), (2, '1ULK_A')]
+    # Reading stopped at the third template, without reading the alignment after it
+    assert 'CGTQAGNKLC' in fh.read()
+
+
+def test_database_prefix(tmp_path, monkeypatch):
+    db = tmp_path.joinpath('pdb70')
+    db.mkdir()
+    for suffix in ('_a3m.ffdata', '_a3m.ffindex', '_hhm.ffdata', '_hhm.ffindex'):
+        db.joinpath(f'pdb70{suffix}').write_text(suffix)
+    monkeypatch.delenv(HHSEARCH_DB_CACHE_ENV, raising=False)
+    assert database_prefix(db) == str(db.joinpath('pdb70'))
+
+    cache_dir = tmp_path.joinpath('shm')
+    monkeypatch.setenv(HHSEARCH_DB_CACHE_ENV, str(cache_dir))
+    assert database_prefix(db) == str(cache_dir.joinpath('pdb70', 'pdb70'))
+    staged = cache_dir.joinpath('pdb70', 'pdb70_hhm.ffdata')
+    assert staged.read_text() == '_hhm.ffdata'
+    # An up to date copy is reused, a changed database is copied again
+    mtime = staged.stat().st_mtime_ns
+    database_prefix(db)
+    assert staged.stat().st_mtime_ns == mtime
+    db.joinpath('pdb70_hhm.ffdata').write_text('changed')
+    database_prefix(db)
+    assert staged.read_text() == 'changed'
+    assert not [f for f in os.listdir(staged.parent) if f.endswith('.tmp')]
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
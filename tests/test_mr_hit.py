@@ -1,7 +1,9 @@
 #!/usr/bin/env ccp4-python
 import set_mrparse_path
+import json
+
 from mrparse.mr_sequence import Sequence
-from mrparse.mr_hit import find_hits, sort_hits_by_size
+from mrparse.mr_hit import _find_json_hits, find_hits, fix_af_phmmer_lines, sort_hits_by_size
 
 
 def test_hit_2uvoA(test_data):
@@ -57,6 +59,43 @@ def test_hit_2uvoA_sort_by_size(test_data, get_2uvo_test_hits):
     assert hit_names.index(name) == 2, f"Incorrect ascending for: {name}"
 
 
+
+def test_fix_af_phmmer_lines():
+    row = "    1.2e-50  170.1   0.0    1.3e-50  170.0   0.0    1.0  1  AFDB:{}  AFDB release_date: 2022-01-01\n"
+    lines = [row.format('AF-P1-F1'), row.format('AF-P1-F1'), row.format('AF-P1-F1'), row.format('AF-P2-F1'),
+             row.format('AF-P1-F1'), ">> AFDB:AF-P1-F1  AFDB release_date: 2022-01-01\n"]
+    fixed = [line.split()[8] if len(line.split()) > 8 else line for line in fix_af_phmmer_lines(iter(lines))]
+    assert fixed == ['AFDB:AF-P1-F1', 'AFDB:AF-P1-F1_2', 'AFDB:AF-P1-F1_3', 'AFDB:AF-P2-F1', 'AFDB:AF-P1-F1', lines[-1]]
+    # The names are the same every time the log is read
+    assert list(fix_af_phmmer_lines(lines)) == list(fix_af_phmmer_lines(lines))
+
+
+def api_hit(name, aliaseq, alimodel, score=50.0):
+    domain = {'alihmmfrom': 1, 'alihmmto': len(alimodel), 'alisqfrom': 11, 'alisqto': 10 + len(aliaseq.replace('-', '')),
+              'aliaseq': aliaseq, 'alimodel': alimodel}
+    return {'name': name, 'evalue': 1e-20, 'score': score, 'ndom': 1, 'domains': [domain]}
+
+
+def test_find_json_hits(tmp_path):
+    target_sequence = 'MKVLAAGIVALLLAAGCSSS'
+    results = {'results': {'hits': [api_hit('P11111_9ZZZZ', 'MKVLAAGIVA', 'MKVLSAGIVA'),
+                                    api_hit('P22222_9ZZZZ', 'MKV-AAG', 'MKVLAAG'),
+                                    {'name': 'P33333_9ZZZZ', 'evalue': 1e-5, 'domains': []},
+                                    api_hit('P44444_9ZZZZ', 'MKVLAAG', 'MKVLAAG')]}}
+    json_file = tmp_path.joinpath('phmmer_afdb.json')
+    with open(json_file, 'w') as w:
+        json.dump(results, w)
+    hits = _find_json_hits(json_file, target_sequence, max_hits=3)
+    # The hit without a domain is skipped and the hit ranked beyond max_hits is dropped
+    assert list(hits) == ['P11111_1', 'P22222_1']
+    hit = hits['P11111_1']
+    assert hit.pdb_id == 'AF-P11111-F1'
+    assert (hit.query_start, hit.query_stop, hit.hit_start, hit.hit_stop) == (1, 10, 11, 20)
+    assert (hit.local_sequence_identity, hit.overall_sequence_identity) == (90, 45)
+    hit = hits['P22222_1']
+    assert (hit.local_sequence_identity, hit.overall_sequence_identity) == (100, 30)
+
+
 if __name__ == '__main__':
     import sys
     import pytest
@@ -2,6 +2,7 @@
 import set_mrparse_path
 import conftest
 
+import pytest
 from mrparse.mr_hkl import HklInfo
 from mrparse.mr_sequence import Sequence
 
@@ -26,7 +27,42 @@ def test_2uvo_seqin(test_data):
     assert abs(hkl_info.molecular_weight - 17131) < 0.1
 
 
+def test_2uvo_cached(test_data, tmp_path, monkeypatch):
+    monkeypatch.setenv('MRPARSE_CACHE_DIR', str(tmp_path))
+    hkl_info = HklInfo(test_data.x2uvo_mtz)
+    hkl_info()
+    seq_info = Sequence(test_data.x2uvoA_fasta)
+    cached = HklInfo(test_data.x2uvo_mtz, seq_info=seq_info)
+    assert cached.pathologies_checked
+    assert cached.input_mtz_obj.f == 'FP'
+    assert cached.space_group == hkl_info.space_group
+    assert (cached.has_ncs, cached.has_twinning, cached.has_anisotropy) == (True, False, True)
+    assert cached.predicted_ncopies == 4
+
+
+def test_5lm4_native(test_data):
+    pytest.importorskip('gemmi')
+    hkl_info = HklInfo(test_data.x5lm4_mtz, use_cache=False, pathology_method='native')
+    hkl_info()
+    assert hkl_info.pathologies_checked
+    assert hkl_info.pathology_statistics.nreflections == 11255
+    assert hkl_info.has_ncs is False
+    assert hkl_info.has_twinning is False
+    assert hkl_info.has_anisotropy is True
+
+
+@pytest.mark.parametrize('mtz', ['x2uvo_mtz', 'x5lm4_mtz'])
+def test_native_pathologies(test_data, mtz):
+    pytest.importorskip('gemmi')
+    hkl_info = HklInfo(getattr(test_data, mtz), use_cache=False)
+    hkl_info()
+    native = HklInfo(getattr(test_data, mtz), use_cache=False, pathology_method='native')
+    native()
+    assert native.pathology_statistics is not None
+    for attr in ['has_ncs', 'has_twinning', 'has_anisotropy']:
+        assert getattr(native, attr) == getattr(hkl_info, attr), attr
+
+
 if __name__ == '__main__':
     import sys
-    import pytest
     pytest.main([__file__] + sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,153 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from mrparse import mr_hit
+from mrparse.mr_hmmer_api import HmmerApiClient, HmmerApiError, search, start_search, write_results
+from mrparse.mr_poll import Backoff
+
+SEQUENCE = 'MKVLAAGIVALLLAAGCSSSKEETPAAK'
+DOMAIN = {'alihmmfrom': 1, 'alihmmto': 16, 'alisqfrom': 5, 'alisqto': 20,
+          'aliaseq': 'MKVLAAGIVALLLAAG', 'alimodel': 'MKVLSAGIVALLLAAG'}
+RESULTS = {'results': {'hits': [{'name': 'P12345_9ZZZZ', 'evalue': 1e-20, 'score': 60.0, 'ndom': 1,
+                                 'domains': [DOMAIN]}]}}
+
+
+class MockHmmer(BaseHTTPRequestHandler):
+    """A local HMMER API: a search is submitted with a POST and its results are ready on the second GET"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.submissions.append(parse_qs(body))
+        self.send_response(303)
+        self.send_header('Location', '/results/ABCD/score')
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.polls.append(parse_qs(url.query))
+        if url.path != '/results/ABCD/score':
+            self.send_response(404)
+            self.end_headers()
+            return
+        if len(self.server.polls) < 2:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write(b'<html>Your search is running</html>')
+            return
+        content = json.dumps(RESULTS).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockHmmer)
+    httpd.submissions, httpd.polls = [], []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server):
+    return HmmerApiClient(url=f'http://127.0.0.1:{server.server_address[1]}', timeout=5)
+
+
+def fast_backoff():
+    return Backoff(initial=0.01, maximum=0.01)
+
+
+def test_search(server, client):
+    data = search(SEQUENCE, max_hits=5, client=client, backoff=fast_backoff())
+    assert data == RESULTS
+    assert server.submissions == [{'seqdb': ['uniprotkb'], 'seq': [f'>Seq\n{SEQUENCE}']}]
+    assert len(server.polls) == 2
+    assert server.polls[-1] == {'output': ['json'], 'range': ['1,5']}
+
+
+def test_search_cached(server, client):
+    search(SEQUENCE, max_hits=5, client=client, backoff=fast_backoff())
+    assert search(SEQUENCE, max_hits=5, client=client, backoff=fast_backoff()) == RESULTS
+    assert len(server.submissions) == 1
+    # The number of hits is part of the cache key
+    search(SEQUENCE, max_hits=10, client=client, backoff=fast_backoff())
+    assert len(server.submissions) == 2
+    search(SEQUENCE, max_hits=5, client=client, backoff=fast_backoff(), use_cache=False)
+    assert len(server.submissions) == 3
+
+
+def test_start_search(server, client, tmp_path):
+    future = start_search(SEQUENCE, max_hits=5, client=client, backoff=fast_backoff())
+    logfile = write_results(future.result(timeout=30), tmp_path.joinpath('phmmer_afdb.json'))
+    with open(logfile) as fh:
+        assert json.load(fh) == RESULTS
+
+
+def test_search_failed(server, client, monkeypatch):
+    monkeypatch.setattr(client, 'submit', lambda sequence, seqdb=None: client.url + '/results/MISSING/score')
+    with pytest.raises(HmmerApiError):
+        search(SEQUENCE, client=client, backoff=fast_backoff())
+
+
+def test_search_unreachable():
+    client = HmmerApiClient(url='http://127.0.0.1:9', timeout=1)
+    with pytest.raises(HmmerApiError):
+        search(SEQUENCE, client=client, backoff=fast_backoff())
+
+
+def test_find_hits(server, client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api_search = start_search(SEQUENCE, max_hits=5, client=client, backoff=fast_backoff())
+    hits = mr_hit.find_hits(SimpleNamespace(sequence=SEQUENCE), phmmer_dblvl='af2', use_api=True, max_hits=5,
+                            api_search=api_search)
+    assert list(hits) == ['P12345_1']
+    hit = hits['P12345_1']
+    assert hit.pdb_id == 'AF-P12345-F1'
+    assert (hit.local_sequence_identity, hit.overall_sequence_identity) == (94, 54)
+    with open(tmp_path.joinpath('phmmer_afdb.json')) as fh:
+        assert json.load(fh) == RESULTS
+
+
+def test_find_hits_fallback(tmp_path, monkeypatch):
+    """A failed API search falls back to a local phmmer search of the AlphaFold database"""
+    monkeypatch.chdir(tmp_path)
+    calls = {}
+
+    def run_phmmer(seq_info, **kwargs):
+        calls['run_phmmer'] = kwargs
+        return 'phmmer_af2.log', 'AFDB'
+
+    def find_hits(**kwargs):
+        calls['find_hits'] = kwargs
+        return {}
+
+    monkeypatch.setattr(mr_hit, 'run_phmmer', run_phmmer)
+    monkeypatch.setattr(mr_hit, '_find_hits', find_hits)
+    client = HmmerApiClient(url='http://127.0.0.1:9', timeout=1)
+    api_search = start_search(SEQUENCE, client=client, backoff=fast_backoff())
+    assert mr_hit.find_hits(SimpleNamespace(sequence=SEQUENCE), phmmer_dblvl='af2', use_api=True,
+                            api_search=api_search) == {}
+    assert calls['run_phmmer']['dblvl'] == 'af2'
+    assert calls['find_hits']['af2'] is True
+    assert calls['find_hits']['logfile'] == 'phmmer_af2.log'
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
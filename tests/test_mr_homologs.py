@@ -1,10 +1,16 @@
 #!/usr/bin/env ccp4-python
 import set_mrparse_path
+import json
 import pytest
 import logging
+from types import SimpleNamespace
+from mrparse import mr_homolog
 from mrparse.mr_sequence import Sequence
+from mrparse.mr_hit import SequenceHit
 from mrparse.mr_hkl import HklInfo
-from mrparse.mr_homolog import homologs_from_hits, calculate_ellg, ellg_data_from_phaser_log
+from mrparse.mr_homolog import (HomologData, apply_ellg_results, homologs_from_hits, calculate_ellg,
+                                ellg_data_from_phaser_log, parse_ellg_summary)
+from mrparse.mr_util import json_dumps
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -22,6 +28,8 @@ def test_2uvoA_homologs(test_data, get_2uvo_test_hits):
     assert h.chain_id == chain_id
     d = h.static_dict
     assert d['chain_id'] == chain_id
+    assert d['range'] == f"{h.query_start}-{h.query_stop}"
+    assert json.loads(json_dumps(d))['chain_id'] == chain_id
     
     
 @pytest.mark.skip(reason="Tests using phaser are currently too slow to run")
@@ -47,6 +55,50 @@ def test_phaser_log_ellg(test_data, get_2uvo_test_hits):
     assert ellg_data['2x3t_C_1'].molecular_weight == pytest.approx(16694)
 
 
+def test_parse_ellg_summary(test_data):
+    with open(test_data.phaser_log) as fh:
+        summary = fh.read()
+    data = parse_ellg_summary(summary.splitlines())
+    assert data['2x3t_C_1']['ellg'] == 1378.4
+    assert isinstance(data['2x3t_C_1']['ncopies'], int)
+    assert set(data['2x3t_C_1']) == {'ellg', 'rmsd', 'frac_scat', 'total_frac_scat_known', 'total_frac_scat', 'ncopies'}
+
+
+
+def test_apply_ellg_results(test_data):
+    with open(test_data.phaser_log) as fh:
+        data = parse_ellg_summary(fh)
+    homologs = {name: HomologData() for name in list(data) + ['missing']}
+    # The results of two PHASER runs that each calculated the eLLGs of some of the ensembles
+    names = sorted(data)
+    results = [{name: data[name] for name in names[1::2]}, {name: data[name] for name in names[0::2]}]
+    apply_ellg_results(homologs, names + ['missing'], results)
+    assert homologs['2x3t_C_1'].ellg == 1378.4
+    assert all(homologs[name].ncopies == data[name]['ncopies'] for name in names)
+    assert homologs['missing'].ellg is None
+
+
+def test_calculate_ellg(monkeypatch):
+    runs = []
+
+    def run_mr_ellg(hklin, labels, molecular_weight, ncopies, ensembles):
+        runs.append((hklin, labels, molecular_weight, ncopies, ensembles))
+        return {name: {'ellg': 10.0 * seq_ident, 'ncopies': 1} for name, _, seq_ident in ensembles}
+
+    monkeypatch.setattr(mr_homolog, 'run_mr_ellg', run_mr_ellg)
+    homologs = {}
+    for name, seq_id in [('a', 50.0), ('b', 90.0), ('c', None)]:
+        homologs[name] = HomologData()
+        homologs[name].hit = SequenceHit()
+        homologs[name].hit.local_sequence_identity = seq_id
+        homologs[name].pdb_file = f'{name}.pdb'
+    mtz = SimpleNamespace(i='IMEAN', sigi='SIGIMEAN', f=None, sigf=None)
+    hkl_info = SimpleNamespace(hklin='data.mtz', input_mtz_obj=mtz, molecular_weight=8602.0, predicted_ncopies=2)
+    calculate_ellg(homologs, hkl_info, nproc=1)
+    assert runs == [('data.mtz', ('I', ('IMEAN', 'SIGIMEAN')), 8602.0, 2, [('a', 'a.pdb', 0.5), ('b', 'b.pdb', 0.9)])]
+    assert [homologs[name].ellg for name in 'abc'] == [5.0, 9.0, -1]
+
+
 if __name__ == '__main__':
     import sys
     pytest.main([__file__] + sys.argv[1:])
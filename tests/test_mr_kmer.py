@@ -0,0 +1,94 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import random
+
+import numpy as np
+import pytest
+
+from mrparse import mr_kmer
+from mrparse.mr_fasta_index import scan_fasta
+from mrparse.mr_kmer import KmerIndex, encode, kmers, prefilter_database
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+NSEQUENCES = 200
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choices(AMINO_ACIDS, k=length))
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A database of random sequences and a query that is similar to sequence 123"""
+    rng = random.Random(0)
+    sequences = [random_sequence(rng, rng.randint(3, 300)) for _ in range(NSEQUENCES)]
+    query = ''.join(aa if rng.random() < 0.6 else rng.choice(AMINO_ACIDS) for aa in sequences[123])
+    fpath = tmp_path.joinpath('sequences.fasta')
+    with open(fpath, 'w') as w:
+        for i, sequence in enumerate(sequences):
+            w.write(f">AFDB:AF-SEQ{i}-F1 sequence {i}\n")
+            w.write('\n'.join(sequence[j:j + 60] for j in range(0, len(sequence), 60)) + '\n')
+    return fpath, sequences, query
+
+
+def test_kmers():
+    values, valid = kmers(encode('LVxCA'), k=2)
+    # L and V are both in the first group of the reduced alphabet
+    assert values[0] == 0
+    assert list(valid) == [True, False, False, True]
+    values, valid = kmers(encode('LV'), k=3)
+    assert not len(values)
+
+
+def test_shared_kmers(database, monkeypatch):
+    fasta, sequences, query = database
+    # Small chunks check the layout of the postings across chunks
+    monkeypatch.setattr(mr_kmer, 'CHUNK_RESIDUES', 2000)
+    index = KmerIndex.build(fasta, k=3)
+    assert len(index) == NSEQUENCES
+    numbers, shared = index.shared_kmers(query)
+
+    def distinct(sequence):
+        values, valid = kmers(encode(sequence), k=3)
+        return set(values[valid])
+
+    query_kmers = distinct(query)
+    expected = {i: len(query_kmers & distinct(s)) for i, s in enumerate(sequences)}
+    assert dict(zip(numbers.tolist(), shared.tolist())) == {i: n for i, n in expected.items() if n}
+
+
+def test_candidates(database, tmp_path):
+    fasta, sequences, query = database
+    index = KmerIndex.open(fasta)
+    candidates = index.candidates(query, 10)
+    assert len(candidates) == 10
+    assert candidates[0] == 123
+    fpath = tmp_path.joinpath('candidates.fasta')
+    assert index.write_candidates(candidates, fpath) == 10
+    assert sorted(int(r[0].split('-')[1][3:]) for r in scan_fasta(fpath)) == sorted(candidates.tolist())
+
+
+def test_load(database):
+    fasta, _, _ = database
+    assert KmerIndex.load(fasta, k=3) is None
+    KmerIndex.build(fasta, k=3)
+    assert KmerIndex.load(fasta, k=3) is not None
+    assert KmerIndex.load(fasta, k=4) is None
+    with open(fasta, 'a') as w:
+        w.write(">AF-NEW-F1\nMKV\n")
+    assert KmerIndex.load(fasta, k=3) is None
+
+
+def test_prefilter_database(database, tmp_path):
+    fasta, _, query = database
+    fpath = tmp_path.joinpath('prefilter.fasta')
+    assert prefilter_database(query, fasta, 5, fpath) == NSEQUENCES
+    keys = [r[0] for r in scan_fasta(fpath)]
+    assert len(keys) <= 5
+    assert 'AF-SEQ123-F1' in keys
+    assert np.all(np.diff([int(k.split('-')[1][3:]) for k in keys]) > 0)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
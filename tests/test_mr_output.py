@@ -0,0 +1,68 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import json
+import os
+from mrparse.mr_output import JsonArrayWriter, ResultsWriter, iterencode, stream_records, write_stage_js
+
+
+def test_json_array_writer():
+    fname = 'foo.json'
+    records = [{'name': 'a', 'value': 1}, {'name': 'b', 'value': None}]
+    with JsonArrayWriter(fname) as writer:
+        for r in records:
+            writer.write(r)
+    assert writer.nrecords == 2
+    with open(fname) as f:
+        assert json.load(f) == records
+    os.unlink(fname)
+
+
+def test_iterencode_generators():
+    data = {'pfam': {'homologs': (x for x in [{'a': 1}, {'b': 2}]), 'models': []}, 'hkl_info': None}
+    assert json.loads("".join(iterencode(data))) == {'pfam': {'homologs': [{'a': 1}, {'b': 2}], 'models': []},
+                                                     'hkl_info': None}
+
+
+def test_stream_records():
+    fname = 'foo.json'
+    records = [{'name': 'a', 'pdb_file': 'a.pdb', '_pfam_json': {'length': 10}}]
+    streamed = list(stream_records(iter(records), fname, exclude_keys=['_pfam_json'], strip_keys=['pdb_file']))
+    assert streamed == [{'name': 'a', '_pfam_json': {'length': 10}}]
+    with open(fname) as f:
+        assert json.load(f) == [{'name': 'a', 'pdb_file': 'a.pdb'}]
+    os.unlink(fname)
+
+
+def read_stage_js(fname):
+    """Return the arguments of the mrparse_update call in a stage data file"""
+    with open(fname) as f:
+        content = f.read().strip()
+    prefix = 'mrparse_update('
+    assert content.startswith(prefix) and content.endswith(');')
+    return json.loads('[' + content[len(prefix):-2] + ']')
+
+
+def test_write_stage_js():
+    fname = 'foo.js'
+    write_stage_js(fname, 'homologs', (h for h in [{'name': 'a'}]), finished=False)
+    assert read_stage_js(fname) == ['homologs', False, [{'name': 'a'}]]
+    assert not [f for f in os.listdir('.') if f.startswith(fname) and f.endswith('.tmp')]
+    os.unlink(fname)
+
+
+def test_results_writer_initialise():
+    writer = ResultsWriter(stages=['homologs', 'classification'])
+    writer.initialise()
+    data_files = writer.report_config()['data_files']
+    assert sorted(data_files) == ['classification', 'homologs', 'status']
+    assert read_stage_js(data_files['homologs']) == ['homologs', False, None]
+    assert read_stage_js(data_files['status']) == ['status', True, {'complete': False}]
+    assert writer.write_stage('models', []) is None
+    for data_file in data_files.values():
+        os.unlink(data_file)
+
+
+if __name__ == '__main__':
+    import sys
+    import pytest
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,102 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import conftest
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+gemmi = pytest.importorskip('gemmi')
+from mrparse.mr_pathology import LTEST_TWINNED, MillerLookup, PathologyStatistics, ReflectionData
+
+
+def wilson_data(test_data, modulation=None, seed=0):
+    """Return the reflections of the 5lm4 MTZ file with random (Wilson distributed) acentric intensities"""
+    mtz = gemmi.read_mtz_file(test_data.x5lm4_mtz)
+    hkl = np.array(mtz.make_miller_array(), dtype=int)
+    rng = np.random.default_rng(seed)
+    intensity = rng.exponential(size=len(hkl))
+    if modulation is not None:
+        intensity *= modulation(hkl, np.array(mtz.make_1_d2_array()))
+    return ReflectionData(hkl, intensity, np.full(len(hkl), 0.01), mtz.cell, mtz.spacegroup)
+
+
+def test_untwinned(test_data):
+    stats = PathologyStatistics(wilson_data(test_data))
+    assert stats.l_test == pytest.approx(0.5, abs=0.02)
+    assert stats.second_moment == pytest.approx(2.0, abs=0.15)
+    assert not stats.has_twinning
+    assert not stats.has_ncs
+    assert not stats.has_anisotropy
+
+
+def test_twinned(test_data):
+    data = wilson_data(test_data)
+    # Perfect merohedral twinning by the operator k,h,-l
+    twin = MillerLookup(data).find(data.hkl[:, [1, 0, 2]] * [1, 1, -1])
+    paired = twin >= 0
+    data.intensity[paired] = 0.5 * (data.intensity[paired] + data.intensity[twin[paired]])
+    stats = PathologyStatistics(data)
+    assert stats.l_test == pytest.approx(0.375, abs=0.03)
+    assert stats.has_twinning
+
+
+def test_tncs(test_data):
+    # A second copy translated by half the c axis
+    stats = PathologyStatistics(wilson_data(test_data, lambda hkl, d_star_sq: 1.0 + np.cos(np.pi * hkl[:, 2])))
+    assert stats.has_ncs
+    assert stats.patterson_distance == pytest.approx(89.62 / 2, abs=2.0)
+
+
+def test_anisotropy(test_data):
+    def falloff(hkl, d_star_sq):
+        # B of 20 A^2 in the a*b* plane and 60 A^2 along c*
+        return np.exp(-0.25 * (20.0 * d_star_sq + 40.0 * (hkl[:, 2] / 89.62) ** 2))
+
+    stats = PathologyStatistics(wilson_data(test_data, falloff))
+    assert stats.delta_b == pytest.approx(40.0, abs=10.0)
+    assert stats.has_anisotropy
+
+
+def mtz_columns(**labels):
+    """Return a selection of MTZ columns like the one made by the MtzParser"""
+    columns = dict.fromkeys(['f', 'sigf', 'i', 'sigi', 'f_plus', 'sigf_plus', 'f_minus', 'sigf_minus',
+                             'i_plus', 'sigi_plus', 'i_minus', 'sigi_minus', 'free'])
+    columns.update(labels)
+    return SimpleNamespace(**columns)
+
+
+def test_5lm4(test_data):
+    # ctruncate is run on the intensities when there are any, and so are the native checks, so the intensities
+    # decide the flags. ctruncate flags twinning when the L-test <|L|> is below 0.44, the same threshold as
+    # LTEST_TWINNED: 5lm4 is not twinned, with an <|L|> of 0.515. Its mean intensity at 4-3 A along c* is a
+    # third of that in the a*b* plane, which ctruncate flags as anisotropy (test_mr_hkl compares the flags with
+    # ctruncate itself where CCP4 is installed).
+    assert LTEST_TWINNED == 0.44
+    stats = PathologyStatistics.from_mtz(test_data.x5lm4_mtz, mtz_columns(i='I', sigi='SIGI', f='FP', sigf='SIGFP'))
+    assert stats.nreflections == 11255
+    assert stats.l_test == pytest.approx(0.515, abs=0.001)
+    assert stats.delta_b == pytest.approx(28.8, abs=0.5)
+    assert not stats.has_twinning
+    assert not stats.has_ncs
+    assert stats.has_anisotropy
+    # The anomalous intensities agree with the mean intensities
+    stats = PathologyStatistics.from_mtz(test_data.x5lm4_mtz, mtz_columns(i_plus='I(+)', sigi_plus='SIGI(+)',
+                                                                          i_minus='I(-)', sigi_minus='SIGI(-)'))
+    assert stats.l_test == pytest.approx(0.515, abs=0.001)
+    assert stats.delta_b == pytest.approx(29.0, abs=0.5)
+    assert stats.has_anisotropy
+    # The deposited amplitudes are weaker than the square root of the intensities in the a*b* plane at high
+    # resolution, so give statistics close to the thresholds: an <|L|> of 0.446 and an anisotropic delta B of 7.7
+    stats = PathologyStatistics.from_mtz(test_data.x5lm4_mtz, mtz_columns(f='FP', sigf='SIGFP'))
+    assert stats.l_test == pytest.approx(0.446, abs=0.001)
+    assert stats.second_moment == pytest.approx(2.11, abs=0.01)
+    assert stats.delta_b == pytest.approx(7.7, abs=0.5)
+    assert not stats.has_twinning
+    assert not stats.has_anisotropy
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,141 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import conftest
+
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import shutil
+import tarfile
+import threading
+import pytest
+from mrparse.mr_jpred import JPred, JPredClient
+from mrparse.mr_poll import (Backoff, Deadline, JobFailedError, PollCancelledError, PollTimeoutError, wait_for_job,
+                             QUEUED, RUNNING, FINISHED, FAILED)
+
+FAST_BACKOFF = Backoff(initial=0.01, maximum=0.05)
+
+
+def test_backoff():
+    delays = Backoff(initial=1.0, maximum=8.0, factor=2.0, jitter=0.25).delays()
+    for expected in [1.0, 2.0, 4.0, 8.0, 8.0]:
+        assert expected * 0.75 <= next(delays) <= expected
+
+
+def test_wait_for_job():
+    states = iter([(QUEUED, None), (RUNNING, None), (FINISHED, 'result')])
+    assert wait_for_job(lambda: next(states), backoff=FAST_BACKOFF) == 'result'
+
+
+def test_job_failed():
+    with pytest.raises(JobFailedError):
+        wait_for_job(lambda: (FAILED, 'malformed'), backoff=FAST_BACKOFF)
+
+
+def test_deadline():
+    with pytest.raises(PollTimeoutError):
+        wait_for_job(lambda: (RUNNING, None), backoff=FAST_BACKOFF, deadline=Deadline(0.1))
+
+
+def test_deadline_limited():
+    deadline = Deadline(10)
+    assert deadline.limited(60) is deadline
+    assert deadline.limited(None) is deadline
+    assert deadline.limited(1).budget == 1
+    assert Deadline().limited(1).budget == 1
+
+
+def test_cancel():
+    cancel = threading.Event()
+    timer = threading.Timer(0.1, cancel.set)
+    timer.start()
+    with pytest.raises(PollCancelledError):
+        wait_for_job(lambda: (RUNNING, None), backoff=Backoff(initial=60.0), cancel=cancel)
+    timer.cancel()
+
+
+class MockJPredHandler(BaseHTTPRequestHandler):
+    """Simulate JPred jobs that are queued, then running, then finished"""
+    jobid = 'jp_mock01'
+    states = ['Job {} is in the queue',
+              'Job {} started',
+              'Job {} finished. Results available at the following URL:']
+    archive = None
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.submissions += 1
+        jobid = self.jobid if self.server.submissions == 1 else f'{self.jobid}_{self.server.submissions}'
+        self.server.jobs[jobid] = 0
+        self.send_response(202)
+        self.send_header('Location', f'http://localhost/cgi-bin/rest/job/id/{jobid}')
+        self.end_headers()
+
+    def do_GET(self):
+        jobid = self.path.split('/')[-1]
+        if self.path.endswith('.tar.gz'):
+            body = self.archive
+        elif '/job/id/' in self.path and jobid in self.server.jobs:
+            message = self.states[min(self.server.jobs[jobid], len(self.states) - 1)].format(jobid)
+            self.server.jobs[jobid] += 1
+            self.server.npolls += 1
+            body = message.encode()
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def jpred_server(test_data):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tf:
+        tf.add(test_data.jpred_concise, arcname=f'{MockJPredHandler.jobid}.concise')
+    MockJPredHandler.archive = buf.getvalue()
+    server = ThreadingHTTPServer(('localhost', 0), MockJPredHandler)
+    server.npolls = 0
+    server.submissions = 0
+    server.jobs = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_jpred_mock_server(jpred_server, test_data):
+    url = f'http://localhost:{jpred_server.server_address[1]}'
+    client = JPredClient(rest_url=f'{url}/cgi-bin/rest', results_url=f'{url}/results')
+    jpred = JPred(client=client, backoff=FAST_BACKOFF, deadline=Deadline(10))
+    jobid = jpred.submit_job(test_data.x2uvoA_fasta)
+    assert jobid == MockJPredHandler.jobid
+    download_tgz = jpred.get_results(jobid)
+    assert jpred_server.npolls == 3
+    p = jpred.get_prediction(download_tgz=str(download_tgz), cleanup=True)
+    assert len(p) == 800
+    assert p.annotation[19:22] == 'EEE', p.annotation[19:22]
+    shutil.rmtree(jobid, ignore_errors=True)
+
+
+def test_jpred_batch_mock_server(jpred_server):
+    url = f'http://localhost:{jpred_server.server_address[1]}'
+    client = JPredClient(rest_url=f'{url}/cgi-bin/rest', results_url=f'{url}/results')
+    jpred = JPred(client=client, backoff=FAST_BACKOFF, deadline=Deadline(10))
+    sequences = {'a': 'MKVL' * 10, 'b': 'GAVL' * 10, 'c': 'LLKA' * 10}
+    predictions = jpred.batch_predictions(sequences)
+    assert jpred_server.submissions == 3
+    assert sorted(predictions) == ['a', 'b', 'c']
+    assert all(p.annotation[19:22] == 'EEE' for p in predictions.values())
+    assert not any(Path(jobid).exists() for jobid in jpred_server.jobs)
+
+
+if __name__ == '__main__':
+    import sys
+    import pytest
+    pytest.main([__file__] + sys.argv[1:])
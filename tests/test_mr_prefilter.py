@@ -0,0 +1,99 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import random
+
+import numpy as np
+import pytest
+
+from mrparse import mr_prefilter
+from mrparse.mr_fasta_index import index_paths, scan_fasta
+from mrparse.mr_prefilter import (PACKED_SUFFIX, SEPARATOR, PackedDatabase, best_segment_scores, encode, kmer_values,
+                                  query_profile, ungapped_prefilter)
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+NSEQUENCES = 300
+HOMOLOG = 123
+
+
+def best_segment(scores):
+    best = current = 0
+    for score in scores:
+        current = max(0, current + score)
+        best = max(best, current)
+    return best
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A database of random sequences and a query that is similar to part of sequence HOMOLOG"""
+    rng = random.Random(0)
+    sequences = [''.join(rng.choices(AMINO_ACIDS, k=rng.randint(20, 300))) for _ in range(NSEQUENCES)]
+    sequences[HOMOLOG] = ''.join(rng.choices(AMINO_ACIDS, k=250))
+    query = ''.join(aa if rng.random() < 0.6 else rng.choice(AMINO_ACIDS) for aa in sequences[HOMOLOG][30:230])
+    fpath = tmp_path.joinpath('pdb_seqres.fasta')
+    with open(fpath, 'w') as w:
+        for i, sequence in enumerate(sequences):
+            w.write(f">{i:04d}_A mol:protein length:{len(sequence)}\n")
+            w.write('\n'.join(sequence[j:j + 80] for j in range(0, len(sequence), 80)) + '\n')
+    return fpath, sequences, query
+
+
+def test_kmer_values():
+    assert list(kmer_values(encode('AAR'))) == [0 * 400 + 0 * 20 + 1]
+    assert list(kmer_values(encode('ARXN'))) == [-1, -1]
+    assert not len(kmer_values(encode('AR')))
+
+
+def test_pack(database):
+    fasta, sequences, _ = database
+    packed = PackedDatabase.open(fasta)
+    assert len(packed) == NSEQUENCES
+    assert PackedDatabase.load(fasta) is not None
+    for i in (0, HOMOLOG, NSEQUENCES - 1):
+        start, end = packed.starts[i], packed.starts[i + 1]
+        assert np.array_equal(packed.codes[start:end - 1], encode(sequences[i]))
+        assert packed.codes[end - 1] == SEPARATOR
+    shards = packed.shards(4)
+    assert shards[0][0] == 0 and shards[-1][1] == NSEQUENCES
+    assert all(a[1] == b[0] for a, b in zip(shards[:-1], shards[1:]))
+
+
+def test_best_segment_scores(database):
+    _, sequences, query = database
+    rng = np.random.default_rng(0)
+    profile = query_profile(query)
+    codes = encode(''.join(sequences[:20]))
+    lengths = rng.integers(1, 60, 50)
+    segment_starts = rng.integers(0, len(codes) - 60, 50)
+    query_starts = rng.integers(0, len(query) - 60, 50)
+    scores = best_segment_scores(profile, codes, segment_starts, query_starts, lengths)
+    expected = [best_segment(profile[q + np.arange(n), codes[s + np.arange(n)]])
+                for s, q, n in zip(segment_starts, query_starts, lengths)]
+    assert list(scores) == expected
+
+
+@pytest.mark.parametrize('chunk_residues', [500, 1024 * 1024])
+def test_scan_shard(database, monkeypatch, chunk_residues):
+    fasta, _, query = database
+    monkeypatch.setattr(mr_prefilter, 'CHUNK_RESIDUES', chunk_residues)
+    packed = PackedDatabase.open(fasta)
+    numbers, scores = mr_prefilter.scan_shard(packed.directory, query, 0, len(packed), ncandidates=5)
+    assert len(numbers) <= 5
+    assert numbers[np.argmax(scores)] == HOMOLOG
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_ungapped_prefilter(database, tmp_path, nproc):
+    fasta, _, query = database
+    fpath = tmp_path.joinpath('candidates.fasta')
+    assert ungapped_prefilter(query, fasta, fpath, ncandidates=10, nproc=nproc, cache=False) == NSEQUENCES
+    keys = [r[0] for r in scan_fasta(fpath)]
+    assert 0 < len(keys) <= 10
+    assert f"{HOMOLOG:04d}_A" in keys
+    assert keys == sorted(keys)
+    assert not index_paths(fasta, suffix=PACKED_SUFFIX)[0].exists()
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,54 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+
+import os
+import sys
+import pytest
+from mrparse.mr_process import ProcessError, read_tail, run_process
+from mrparse.mr_util import run_cmd
+
+PRINT_LINES = "import sys\nfor i in range({}): print('line', i)\nsys.exit({})"
+
+
+def python_cmd(nlines, exit_code=0):
+    return [sys.executable, '-c', PRINT_LINES.format(nlines, exit_code)]
+
+
+def test_stream_to_file(tmp_path):
+    logfile = tmp_path.joinpath('out.log')
+    result = run_process(python_cmd(10000), stdout=logfile, tail_lines=3)
+    assert result.returncode == 0
+    assert result.output is None
+    assert logfile.read_text().count('\n') == 10000
+    assert result.tail.split('\n')[-3:] == ['line 9998', 'line 9999', '']
+    assert result.wall_time > 0
+    if hasattr(os, 'wait4'):
+        assert result.max_rss > 0
+
+
+def test_capture():
+    result = run_process(python_cmd(5), capture=True, tail_lines=2)
+    assert result.output.splitlines() == [f'line {i}' for i in range(5)]
+    assert result.tail == 'line 3\nline 4'
+    assert run_cmd(python_cmd(2)) == 'line 0\nline 1\n'
+
+
+def test_failure(tmp_path):
+    with pytest.raises(ProcessError) as excinfo:
+        run_process(python_cmd(100, exit_code=3), tail_lines=5)
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.result.tail.endswith('line 99')
+    assert 'line 94' not in excinfo.value.result.tail
+    result = run_process(python_cmd(1, exit_code=1), stdout=tmp_path.joinpath('out.log'), check=False)
+    assert result.returncode == 1
+    assert result.tail.strip() == 'line 0'
+
+
+def test_read_tail(tmp_path):
+    fpath = tmp_path.joinpath('big.log')
+    fpath.write_text(''.join(f'line {i}\n' for i in range(100000)))
+    assert read_tail(fpath, nlines=2, max_bytes=1024) == 'line 99999\n'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,79 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import multiprocessing
+import os
+import pstats
+
+import pytest
+
+from mrparse.mr_profile import MERGED_PROFILE, Profiler, ProfiledCall, merge_profiles, profiled
+
+NITEMS = 20000
+
+
+class Stage(object):
+    """A picklable stage like those run in the multiprocessing pool"""
+
+    def __call__(self):
+        self.data = allocate()
+        return self
+
+
+def allocate(n=NITEMS):
+    return [str(i) for i in range(n)]
+
+
+def test_cpu_profile(tmp_path):
+    with Profiler('main', 'cpu', tmp_path):
+        allocate()
+    stats = pstats.Stats(str(tmp_path.joinpath(f'main_{os.getpid()}.prof')))
+    assert any(func[2] == 'allocate' for func in stats.stats)
+    assert not list(tmp_path.glob('*.snapshot'))
+
+
+def test_memory_profile(tmp_path):
+    with Profiler('main', 'mem', tmp_path):
+        data = allocate()
+    assert tmp_path.joinpath(f'main_{os.getpid()}.snapshot').exists()
+    report = tmp_path.joinpath(f'main_{os.getpid()}_memory.txt').read_text()
+    assert report.startswith('Peak traced memory of main')
+    assert 'test_mr_profile.py' in report
+    assert not list(tmp_path.glob('*.prof'))
+    del data
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(RuntimeError):
+        Profiler('main', 'gpu', tmp_path)
+
+
+def test_profiled():
+    stage = Stage()
+    assert profiled(stage, 'stage', None) is stage
+    assert isinstance(profiled(stage, 'stage', 'cpu'), ProfiledCall)
+
+
+def test_merge_pool_profiles(tmp_path):
+    with Profiler('main', 'both', tmp_path):
+        with multiprocessing.Pool(2) as pool:
+            results = [pool.apply_async(ProfiledCall(Stage(), f'stage{i}', 'both', tmp_path)) for i in range(2)]
+            stages = [r.get() for r in results]
+    assert all(len(stage.data) == NITEMS for stage in stages)
+    assert len(list(tmp_path.glob('*.prof'))) == 3
+    assert len(list(tmp_path.glob('*.snapshot'))) == 3
+
+    summary = merge_profiles(tmp_path).read_text()
+    assert summary.startswith('CPU profile of 3 processes')
+    assert 'Memory allocated at the end of 3 processes' in summary
+    assert 'Peak traced memory of stage0' in summary
+    stats = pstats.Stats(str(tmp_path.joinpath(MERGED_PROFILE)))
+    assert any(func[2] == 'allocate' for func in stats.stats)
+
+
+def test_merge_no_profiles(tmp_path):
+    assert merge_profiles(tmp_path) is None
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,61 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+
+import random
+import pytest
+from mrparse.mr_seqid import batch_identity, sequence_identity
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def reference_identity(seq1, seq2, target_sequence):
+    naligned = nidentical = 0
+    for a, b in zip(seq1, seq2):
+        if a != '-' and b != '-':
+            naligned += 1
+            nidentical += a == b
+    local = 100.0 * nidentical / naligned if naligned else 0.0
+    overall = 100.0 * nidentical / len(target_sequence) if target_sequence else 0.0
+    return local, overall
+
+
+def random_alignments(n, seed=0):
+    rng = random.Random(seed)
+    target = ''.join(rng.choice(AMINO_ACIDS) for _ in range(300))
+    alignments, target_alignments = [], []
+    for _ in range(n):
+        start = rng.randrange(0, 200)
+        tali = list(target[start:start + rng.randrange(20, 100)])
+        ali = [c if rng.random() < 0.4 else rng.choice(AMINO_ACIDS + '-') for c in tali]
+        for _ in range(rng.randrange(0, 4)):
+            tali.insert(rng.randrange(len(tali)), '-')
+            ali.insert(rng.randrange(len(ali)), rng.choice(AMINO_ACIDS))
+        alignments.append(''.join(ali))
+        target_alignments.append(''.join(tali))
+    return alignments, target_alignments, target
+
+
+def test_sequence_identity():
+    assert sequence_identity('AC-DE', 'ACGDF', 'ACGDFHIK') == (75.0, 37.5)
+    assert sequence_identity('---', 'AAA', 'AAA') == (0.0, 0.0)
+    assert sequence_identity('', '', '') == (0.0, 0.0)
+
+
+def test_batch_identity_matches_reference():
+    alignments, target_alignments, target = random_alignments(500)
+    local, overall = batch_identity(alignments, target_alignments, target)
+    for i, (ali, tali) in enumerate(zip(alignments, target_alignments)):
+        assert (local[i], overall[i]) == pytest.approx(reference_identity(ali, tali, target))
+
+
+def test_batch_identity_matches_simpleseqid():
+    simpleSeqID = pytest.importorskip('mrbump.seq_align.simpleSeqID').simpleSeqID
+    alignments, target_alignments, target = random_alignments(200, seed=1)
+    local, overall = batch_identity(alignments, target_alignments, target)
+    for i, (ali, tali) in enumerate(zip(alignments, target_alignments)):
+        assert (local[i], overall[i]) == pytest.approx(simpleSeqID().getPercent(ali, tali, target))
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
@@ -0,0 +1,97 @@
+#!/usr/bin/env ccp4-python
+import set_mrparse_path
+import json
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+from mrparse import mr_timing
+from mrparse.mr_output import TIMINGS_JSON, ResultsWriter
+from mrparse.mr_process import run_process
+
+
+@pytest.fixture
+def timings_dir(tmp_path, monkeypatch):
+    directory = tmp_path.joinpath('timings')
+    # Set the variable enable_timings sets with monkeypatch so that it is restored after the test
+    monkeypatch.setenv(mr_timing.TIMINGS_DIR_ENV, str(directory.resolve()))
+    return directory
+
+
+def _child_stage():
+    with mr_timing.span('child'):
+        mr_timing.add_bytes_downloaded(10)
+
+
+def test_nested_spans(timings_dir):
+    with mr_timing.span('outer', engine='phmmer') as outer:
+        with mr_timing.span('inner'):
+            mr_timing.add_bytes_downloaded(100)
+        mr_timing.add_bytes_downloaded(50)
+    assert outer.bytes_downloaded == 150
+    spans = {s['name']: s for s in mr_timing.collect_spans()}
+    assert spans['outer']['parent'] is None
+    assert spans['outer']['attrs'] == {'engine': 'phmmer'}
+    assert spans['inner']['parent'] == 'outer'
+    assert spans['inner']['bytes_downloaded'] == 100
+    assert spans['outer']['wall_time'] >= spans['inner']['wall_time'] >= 0
+    assert spans['outer']['peak_rss'] > 0
+
+
+def test_timed_decorator(timings_dir):
+    @mr_timing.timed('stage')
+    def stage(x):
+        return x * 2
+
+    assert stage(2) == 4 and stage(3) == 6
+    summary = mr_timing.gather_timings()['summary']
+    assert [(s['name'], s['count']) for s in summary] == [('stage', 2)]
+
+
+def test_spans_from_other_processes(timings_dir):
+    process = multiprocessing.get_context('spawn').Process(target=_child_stage)
+    process.start()
+    process.join()
+    with mr_timing.span('parent'):
+        pass
+    spans = mr_timing.collect_spans()
+    assert sorted(s['name'] for s in spans) == ['child', 'parent']
+    assert len({s['pid'] for s in spans}) == 2
+
+
+def test_run_process_span(timings_dir):
+    run_process([sys.executable, '-c', 'pass'])
+    spans = mr_timing.collect_spans()
+    assert spans[-1]['name'] == os.path.basename(sys.executable)
+    assert spans[-1]['attrs']['returncode'] == 0
+
+
+def test_write_timings(timings_dir, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with mr_timing.span('search'):
+        pass
+    writer = ResultsWriter(stages=['timings'])
+    writer.write_timings(mr_timing.gather_timings())
+    with open(TIMINGS_JSON) as f:
+        timings = json.load(f)
+    assert [s['name'] for s in timings['summary']] == ['search']
+    assert len(timings['spans']) == 1
+    with open(writer.stage_file('timings')) as f:
+        assert f.read().startswith("mrparse_update(\"timings\", true,")
+
+
+def test_disabled(monkeypatch, tmp_path):
+    monkeypatch.delenv(mr_timing.TIMINGS_DIR_ENV, raising=False)
+    monkeypatch.chdir(tmp_path)
+    with mr_timing.span('search'):
+        pass
+    assert mr_timing.timings_dir() is None
+    assert mr_timing.collect_spans() == []
+    assert not os.listdir(tmp_path)
+
+
+if __name__ == '__main__':
+    import sys
+    pytest.main([__file__] + sys.argv[1:])
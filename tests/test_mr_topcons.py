@@ -2,10 +2,63 @@
 import set_mrparse_path
 import conftest
 
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
 import pytest
-from mrparse.mr_topcons import TMPred, TM
+from mrparse import mr_topcons
+from mrparse.mr_poll import Deadline
+from mrparse.mr_topcons import BATCH_POLL_TIME_PER_SEQUENCE, MAX_POLL_TIME, TMPred, TM, TopConsClient, parse_wsdl
 from mrparse.mr_sequence import Sequence
 
+MOCK_WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:tns="topcons.predict" targetNamespace="topcons.predict">
+  <wsdl:types>
+    <xs:schema targetNamespace="topcons.predict" elementFormDefault="qualified">
+      <xs:complexType name="submitjob">
+        <xs:sequence>
+          <xs:element name="seq" type="xs:string"/>
+          <xs:element name="fixtop" type="xs:string"/>
+          <xs:element name="jobname" type="xs:string"/>
+          <xs:element name="email" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:element name="submitjob" type="tns:submitjob"/>
+      <xs:element name="checkjob">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="jobid" type="xs:string"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+    </xs:schema>
+  </wsdl:types>
+  <wsdl:binding name="Application" type="tns:Application">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="submitjob"><soap:operation soapAction="submitjob" style="document"/></wsdl:operation>
+    <wsdl:operation name="checkjob"><soap:operation soapAction="checkjob" style="document"/></wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="Application">
+    <wsdl:port name="Application" binding="tns:Application">
+      <soap:address location="{url}/pred/api_submitseq/"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+SOAP_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soap11env:Envelope xmlns:soap11env="http://schemas.xmlsoap.org/soap/envelope/" xmlns:tns="topcons.predict">
+  <soap11env:Body>
+    <tns:{operation}Response><tns:{operation}Result><tns:StrArray>{strings}</tns:StrArray></tns:{operation}Result>
+    </tns:{operation}Response>
+  </soap11env:Body>
+</soap11env:Envelope>
+"""
+
 
 def test_parse(test_data):
     tc = TMPred(None)
@@ -22,6 +75,144 @@ def test_parse(test_data):
     assert annotation.scores[232] > 0.6, annotation.scores[232] 
 
 
+def test_parse_batch(test_data):
+    with open(test_data.topcons_output) as f:
+        header, block = f.read().split('Sequence number: 1', 1)
+    batch_output = header + 'Sequence number: 1' + block + 'Sequence number: 2' + block
+    results = list(TMPred.parse_topcons_results(io.StringIO(batch_output)))
+    assert [r[0] for r in results] == [1, 2]
+    for seqnum, prediction, scores in results:
+        assert len(prediction) == 685
+        assert prediction[212] == TM.symbol
+        assert scores[212] > 0.6
+
+
+def test_batch_deadline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    budgets = []
+
+    def wait_for_job(check, backoff=None, deadline=None, cancel=None, description=None):
+        budgets.append(deadline.budget)
+        raise mr_topcons.PollTimeoutError(f"{description} timed out")
+
+    monkeypatch.setattr(mr_topcons, 'wait_for_job', wait_for_job)
+    tc = TMPred(None)
+    monkeypatch.setattr(tc, 'submit_job', lambda seqin: 'rst_test')
+    sequences = {f'seq{i}': 'MKVLAAGIVALLLAAG' for i in range(200)}
+    with pytest.raises(mr_topcons.PollTimeoutError):
+        tc.batch_predictions(sequences)
+    with pytest.raises(mr_topcons.PollTimeoutError):
+        tc.batch_predictions(sequences, max_poll_time=600)
+    assert budgets == [MAX_POLL_TIME + 200 * BATCH_POLL_TIME_PER_SEQUENCE, 600]
+    assert not tmp_path.joinpath('topcons_batch.fasta').exists()
+
+
+class MockTopConsHandler(BaseHTTPRequestHandler):
+    """Simulate the TopCons SOAP service with a job that is queued, then running, then finished"""
+    jobid = 'rst_mock01'
+    states = ['Wait', 'Running', 'Finished']
+    archive = None
+
+    def do_GET(self):
+        url = f'http://localhost:{self.server.server_address[1]}'
+        if self.path.endswith('?wsdl'):
+            self.reply(MOCK_WSDL.replace('{url}', url).encode())
+        elif self.path == f'/static/result/{self.jobid}/{self.jobid}.zip':
+            self.reply(self.archive)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        request = ET.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        operation = request[0][0]
+        self.server.requests.append((self.headers['SOAPAction'], operation.tag, [(e.tag, e.text) for e in operation]))
+        if operation.tag.endswith('submitjob'):
+            strings = [self.jobid, '', '1', '', '']
+        else:
+            state = self.states[min(self.server.npolls, len(self.states) - 1)]
+            self.server.npolls += 1
+            url = f'http://localhost:{self.server.server_address[1]}/static/result/{self.jobid}/{self.jobid}.zip'
+            strings = [state, url, '']
+        operation = operation.tag.split('}')[1]
+        body = "".join(f'<tns:string>{s}</tns:string>' for s in strings)
+        self.reply(SOAP_RESPONSE.format(operation=operation, strings=body).encode())
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def topcons_server(test_data):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.write(test_data.topcons_output, arcname=f'{MockTopConsHandler.jobid}/query.result.txt')
+    MockTopConsHandler.archive = buf.getvalue()
+    server = ThreadingHTTPServer(('localhost', 0), MockTopConsHandler)
+    server.npolls = 0
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_wsdl():
+    service = parse_wsdl(MOCK_WSDL.replace('{url}', 'http://localhost'))
+    assert service['location'] == 'http://localhost/pred/api_submitseq/'
+    assert service['namespace'] == 'topcons.predict'
+    assert service['qualified']
+    assert service['operations'] == {'submitjob': ('submitjob', ['seq', 'fixtop', 'jobname', 'email']),
+                                     'checkjob': ('checkjob', ['jobid'])}
+
+
+def test_topcons_mock_server(topcons_server, test_data, tmp_path, monkeypatch):
+    seq_info = Sequence(str(Path(test_data.x2uvoA_fasta).resolve()))
+    monkeypatch.chdir(tmp_path)
+    url = f'http://localhost:{topcons_server.server_address[1]}'
+    client = TopConsClient(wsdl_url=f'{url}/pred/api_submitseq/?wsdl')
+    tc = TMPred(seq_info, client=client, deadline=Deadline(10))
+    tc.poll_time = 0.01
+    tc.get_prediction()
+    assert topcons_server.npolls == 3
+    soap_action, operation, params = topcons_server.requests[0]
+    assert soap_action == '"submitjob"'
+    assert operation == '{topcons.predict}submitjob'
+    assert [tag for tag, text in params] == [f'{{topcons.predict}}{p}' for p in ('seq', 'fixtop', 'jobname', 'email')]
+    assert params[0][1].startswith('>')
+    assert topcons_server.requests[1][2] == [('{topcons.predict}jobid', MockTopConsHandler.jobid)]
+    assert len(tc.prediction) == 685
+    assert tc.prediction.annotation[212] == TM.symbol
+    assert not tmp_path.joinpath(f'{MockTopConsHandler.jobid}.zip').exists()
+
+
+def test_shared_deadline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    deadlines = []
+
+    def wait_for_job(check, backoff=None, deadline=None, cancel=None, description=None):
+        deadlines.append(deadline)
+        raise mr_topcons.PollTimeoutError(f"{description} timed out")
+
+    monkeypatch.setattr(mr_topcons, 'wait_for_job', wait_for_job)
+    shared = Deadline(30)
+    tc = TMPred(None, deadline=shared)
+    monkeypatch.setattr(tc, 'submit_job', lambda seqin: 'rst_test')
+    with pytest.raises(mr_topcons.PollTimeoutError):
+        tc.batch_predictions({'a': 'MKVLAAGIVALLLAAG'})
+    with pytest.raises(mr_topcons.PollTimeoutError):
+        tc.batch_predictions({'a': 'MKVLAAGIVALLLAAG'}, max_poll_time=5)
+    # The job limit only applies if it is sooner than the deadline of the run
+    assert deadlines[0] is shared
+    assert deadlines[1].budget == 5
+
+
 @pytest.mark.skip(reason="TMPred server is missing the WSDL description file so can't be used.")
 def test_run(test_data):
     seq_info = Sequence(test_data.Q13586_fasta)